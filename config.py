@@ -126,9 +126,40 @@ HOMEWORK_DIR_FOR_CLASS = os.path.join(RAILGUN_ROOT, 'hw','course')
 # HOMEWORK_STATIC_DIR stores the copied description resources of all homeworks
 HOMEWORK_STATIC_DIR = os.path.join(RAILGUN_ROOT, 'hw/total/.static')
 
+# HOMEWORK_ARTIFACT_DIR stores the precompiled artifacts (.pyc files and jars
+# of Java classes) of all homeworks, built by `python manage.py build-cache`
+HOMEWORK_ARTIFACT_DIR = os.path.join(RAILGUN_ROOT, 'hw/total/.artifact')
+
+# HOMEWORK_JAVAC is the Java compiler to build the artifacts of homeworks
+HOMEWORK_JAVAC = 'javac'
+
+# HOMEWORK_CALIBRATION_RUNS controls how many times "manage.py calibrate" runs
+# the reference answer of each homework ("answer/<lang>.zip" or "answer.zip"
+# beside "hw.xml").  The runner then uses the slowest run multiplied by
+# HOMEWORK_TIMEOUT_FACTOR plus HOMEWORK_TIMEOUT_SLACK seconds as the timeout,
+# at least HOMEWORK_TIMEOUT_MIN seconds and at most the timeout in
+# "code.xml".  Set HOMEWORK_TIMEOUT_FACTOR to None to ignore the calibration
+HOMEWORK_CALIBRATION_RUNS = 5
+HOMEWORK_TIMEOUT_FACTOR = 3.0
+HOMEWORK_TIMEOUT_SLACK = 1.0
+HOMEWORK_TIMEOUT_MIN = 1
+
+# HOMEWORK_PREWARM_AHEAD controls how many seconds before a deadline the
+# runners should be warmed by "manage.py prewarm", which is supposed to be
+# executed by cron every few minutes.  HOMEWORK_PREWARM_COPIES prewarm tasks
+# are sent to each runner queue of the homework, to be taken by different
+# runner processes
+HOMEWORK_PREWARM_AHEAD = 6 * 3600
+HOMEWORK_PREWARM_COPIES = 4
+
 #use to store the type of homework
 HOMEWORK_TYPE_SET = ['black_box','white_box','xunit']
 
+# SUPERSEDE_PENDING_HANDINS determines whether a new submission should
+# reject the older pending submissions of the same user and homework, so
+# that the runners do not spend time on them during a deadline rush
+SUPERSEDE_PENDING_HANDINS = True
+
 # STORE_UPLOAD controls whether or not to store the student uploaded
 # homework content
 STORE_UPLOAD = True
@@ -179,6 +210,12 @@ ONLINE_GROUP_ID = None
 # OFFLINE_USER_HOST = ('127.0.0.1', 9778)
 ONLINE_USER_HOST = None
 
+# RUNNER_USER_LEASE_EXPIRES controls how many seconds a system account stays
+# leased to a submission if not renewed.  The runner renews the lease in
+# background until the submission is done, so a crashed runner holds the
+# account for at most such a long time
+RUNNER_USER_LEASE_EXPIRES = 30
+
 # RUNNER_CHECK_PERM determines whether the system will check the file
 # permissions of runner host, and show warnings if the permissions not
 # match requirements
@@ -188,10 +225,214 @@ RUNNER_CHECK_PERM = False
 # module to run
 RUNNER_DEFAULT_TIMEOUT = 3
 
+# RUNNER_DEFAULT_OUTPUT_LIMIT controls the default maximum bytes of stdout
+# and stderr that a submission may produce before it is killed
+RUNNER_DEFAULT_OUTPUT_LIMIT = 16 * 1024 * 1024
+
+# RUNNER_DEFAULT_MEMORY_LIMIT, RUNNER_DEFAULT_CPU_LIMIT and
+# RUNNER_DEFAULT_PIDS_LIMIT control the default memory bytes, CPU cores and
+# number of processes (or threads) a submission may use.  They may be
+# overridden by `memoryLimit`, `cpuLimit` and `pidsLimit` of <runner> in
+# `code.xml`.  Set to None for no limit.
+RUNNER_DEFAULT_MEMORY_LIMIT = 1024 * 1024 * 1024
+RUNNER_DEFAULT_CPU_LIMIT = 1.0
+RUNNER_DEFAULT_PIDS_LIMIT = 128
+
+# RUNNER_CGROUP_ROOT is a cgroup v2 directory, under which a child group is
+# created for each submission process to enforce the limits above, and to
+# tell when the submission is killed for running out of memory.  The runner
+# must be able to write it (e.g., run as root, or be delegated the group).
+# If cgroups are unavailable, or it is set to None, the limits fall back to
+# rlimits of the process.
+RUNNER_CGROUP_ROOT = '/sys/fs/cgroup/railgun'
+
+# RUNNER_OUTPUT_HEAD_SIZE and RUNNER_OUTPUT_TAIL_SIZE control how many bytes
+# from the beginning and the end of stdout and stderr are kept for logging
+# and reporting.  The bytes in the middle are dropped.
+RUNNER_OUTPUT_HEAD_SIZE = 32 * 1024
+RUNNER_OUTPUT_TAIL_SIZE = 32 * 1024
+
+# RUNNER_WORKSPACE_TEMPLATE determines whether the runner should prepare
+# the working directories from a private template of the homework code
+# files, which is built once for each homework version.  Files are cloned
+# with reflinks if the file system supports them.
+RUNNER_WORKSPACE_TEMPLATE = True
+
+# RUNNER_WORKSPACE_LINK determines whether the files that students cannot
+# overwrite should be hard linked from the template, instead of cloned.
+# Such files will be read-only and owned by the runner, so do not enable it
+# if the homework scripts need to write these files.
+RUNNER_WORKSPACE_LINK = False
+
+# RUNNER_WORKSPACE_ROOT stores the working directories of submissions.  It
+# is recommended to put it on a RAM-backed file system, for example,
+# '/dev/shm/railgun'.  If set to None, TEMPORARY_DIR will be used.
+RUNNER_WORKSPACE_ROOT = None
+
+# RUNNER_WORKSPACE_MOUNT determines whether each working directory should be
+# a dedicated tmpfs mount of RUNNER_WORKSPACE_QUOTA bytes.  The runner must
+# run as root to mount file systems.
+RUNNER_WORKSPACE_MOUNT = False
+
+# RUNNER_WORKSPACE_QUOTA controls the maximum bytes a working directory may
+# take.  It is enforced only if RUNNER_WORKSPACE_MOUNT is True, otherwise
+# the working directories exceeding it are reported in the logs.
+RUNNER_WORKSPACE_QUOTA = 64 * 1024 * 1024
+
+# RUNNER_WORKSPACE_ASYNC_CLEANUP determines whether the working directories
+# should be removed in a background thread, so that the runner can take
+# the next submission immediately.
+RUNNER_WORKSPACE_ASYNC_CLEANUP = True
+
+# RUNNER_ASYNC_REPORT determines whether the results of submissions should be
+# sent to the website in a background thread, so that the runner can take
+# the next submission without waiting for the website.  At most
+# RUNNER_REPORT_QUEUE_DEPTH reports may wait in each runner process before
+# the runner blocks, and a failed report is retried RUNNER_REPORT_RETRIES
+# times.  A report not answered by the website in RUNNER_REPORT_TIMEOUT
+# seconds is regarded as failed.
+RUNNER_ASYNC_REPORT = True
+RUNNER_REPORT_QUEUE_DEPTH = 16
+RUNNER_REPORT_RETRIES = 3
+RUNNER_REPORT_TIMEOUT = 30
+
+# RUNNER_CANCEL_POLL_INTERVAL controls how often (in seconds) a running
+# submission checks whether it has been superseded by a newer upload or
+# cancelled by the administrator, in which case its processes are killed.
+# Set it to 0 to check only before the submission starts.  The cancellation
+# flags expire after RUNNER_CANCEL_TTL seconds.
+RUNNER_CANCEL_POLL_INTERVAL = 1
+RUNNER_CANCEL_TTL = 24 * 3600
+
+# RUNNER_LEASE_HEARTBEAT controls how often (in seconds) a running
+# submission renews its lease in Redis, and RUNNER_LEASE_TTL how long the
+# lease lasts without renewal.  A `Running` submission whose lease has
+# expired has lost its runner, and is put into the queue again at most
+# HANDIN_REAP_RETRIES times by `manage.py reap`, or rejected after that.
+RUNNER_LEASE_HEARTBEAT = 10
+RUNNER_LEASE_TTL = 60
+HANDIN_REAP_RETRIES = 1
+
+# RUNNER_PYTHON_ZYGOTE determines whether Python submissions should be forked
+# from a zygote process which has preloaded the scorer stack, instead of
+# starting the native SafeRunner for each submission.  The forked process
+# has no secret key, so a submission which inspects the interpreter can
+# forge its score more easily than with the native SafeRunner
+RUNNER_PYTHON_ZYGOTE = False
+
+# RUNNER_PYTHON_ZYGOTE_MAX controls the maximum number of zygote processes
+# kept by each runner process
+RUNNER_PYTHON_ZYGOTE_MAX = 4
+
+# RUNNER_JAVA_SERVICE determines whether Java submissions should be built
+# and tested in a single JVM started for each build, instead of running
+# compile.sh.  Only the homework declaring `buildDir` in <compiler> are
+# affected.  Build the service by `ant` in runlib/java/javahost.
+RUNNER_JAVA_SERVICE = False
+
+# RUNNER_JAVA_SERVICE_JVM is the java executable to start the service
+RUNNER_JAVA_SERVICE_JVM = 'java'
+
+# RUNNER_JAVA_SERVICE_CLASSPATH lists the jars of the service, and the jars
+# of JUnit, JaCoCo, Checkstyle and ant-junit required by the service
+RUNNER_JAVA_SERVICE_CLASSPATH = [
+    os.path.join(RUNLIB_DIR, 'java/JavaHostService.jar'),
+    '/usr/share/java/junit4.jar',
+    '/usr/share/java/hamcrest-core.jar',
+    '/usr/share/java/org.jacoco.core.jar',
+    '/usr/share/java/org.jacoco.report.jar',
+    '/usr/share/java/asm-debug-all.jar',
+    '/usr/share/java/checkstyle-7.0-all.jar',
+    '/usr/share/ant/lib/ant.jar',
+    '/usr/share/ant/lib/ant-junit.jar',
+]
+
+# RUNNER_JAVA_SERVICE_CHECKSTYLE_CONFIG is the Checkstyle configuration used
+# by the service, unless `checkstyleConfig` is given in <compiler>
+RUNNER_JAVA_SERVICE_CHECKSTYLE_CONFIG = '/google_checks.xml'
+
 # RUNNER_CONCURRENTY controls how many runners will be executed at the
 # same time
 RUNNER_CONCURRENTY = 1
 
+# RUNNER_PRIORITY_DEADLINES decides the priority lanes of submissions by
+# the seconds remaining to the next deadline of the homework.  Submissions
+# due within RUNNER_PRIORITY_DEADLINES[0] seconds go to the first (most
+# urgent) lane, and so on.  Each other pending submission of the same user
+# moves a submission RUNNER_PRIORITY_PENDING_PENALTY lanes backwards, so
+# that one user cannot take the head of the queue from the others
+RUNNER_PRIORITY_DEADLINES = [15 * 60, 60 * 60, 6 * 3600, 24 * 3600,
+                             3 * 24 * 3600]
+RUNNER_PRIORITY_PENDING_PENALTY = 1
+
+# RUNNER_SJF_COST_STEPS lets the short submissions run before the long ones.
+# The expected running time of a submission is the median wall clock seconds
+# of the latest RUNNER_SJF_HISTORY submissions of the same homework and
+# language (or of the same language, if fewer than RUNNER_SJF_MIN_SAMPLES
+# of them exist), cached for RUNNER_SJF_MODEL_TTL seconds.  A submission
+# expected to run longer than RUNNER_SJF_COST_STEPS[i] seconds is moved
+# i + 1 lanes backwards
+RUNNER_SJF_COST_STEPS = [2, 10, 60]
+RUNNER_SJF_HISTORY = 100
+RUNNER_SJF_MIN_SAMPLES = 5
+RUNNER_SJF_MODEL_TTL = 300
+
+# Every RUNNER_SJF_AGING_INTERVAL seconds, the runner moves all the waiting
+# submissions one lane forward, so that no submission waits longer than
+# about 10 * RUNNER_SJF_AGING_INTERVAL seconds behind the urgent and short
+# ones.  Set to 0 to disable aging
+RUNNER_SJF_AGING_INTERVAL = 30
+
+# A runner started by "runner.py <queue> <shard>" also consumes the shard
+# queue "<queue>.<shard>".  The submissions of each homework are sent to one
+# of RUNNER_AFFINITY_REPLICAS live shards chosen by consistent hashing (each
+# shard is put onto the hash ring RUNNER_AFFINITY_VNODES times), so that the
+# warm state of the homework in the worker is reused.  If all of them have
+# RUNNER_AFFINITY_SPILL or more waiting submissions, the submission spills
+# over to the shared queue.  A shard is alive if its worker has refreshed
+# the registration within RUNNER_AFFINITY_EXPIRES seconds, which is done
+# every RUNNER_AFFINITY_HEARTBEAT seconds.  The submissions waiting in the
+# queues of the expired shards are moved back to the shared queue by the
+# live workers at the same interval.
+RUNNER_AFFINITY_REPLICAS = 2
+RUNNER_AFFINITY_VNODES = 64
+RUNNER_AFFINITY_SPILL = 4
+RUNNER_AFFINITY_HEARTBEAT = 10
+RUNNER_AFFINITY_EXPIRES = 30
+
+# RUNNER_AUTOSCALE lets the runner queue resize its pool between
+# RUNNER_AUTOSCALE_MIN and RUNNER_AUTOSCALE_MAX processes, by the queue
+# length, the load average, the available memory and the free system
+# accounts, instead of using RUNNER_CONCURRENTY.  At most one process is
+# added or removed every RUNNER_AUTOSCALE_INTERVAL seconds
+RUNNER_AUTOSCALE = False
+RUNNER_AUTOSCALE_MIN = 1
+RUNNER_AUTOSCALE_MAX = 8
+RUNNER_AUTOSCALE_INTERVAL = 5
+
+# The pool grows only if the 1-minute load average per CPU core is below
+# RUNNER_AUTOSCALE_LOAD_HIGH, and shrinks at once if it exceeds
+# RUNNER_AUTOSCALE_LOAD_CRITICAL
+RUNNER_AUTOSCALE_LOAD_HIGH = 1.0
+RUNNER_AUTOSCALE_LOAD_CRITICAL = 2.0
+
+# The pool grows only if the available memory is more than
+# RUNNER_AUTOSCALE_MEMORY_RESERVE plus RUNNER_AUTOSCALE_PROCESS_MEMORY (the
+# memory for one more submission), and shrinks at once if the available
+# memory is less than RUNNER_AUTOSCALE_MEMORY_RESERVE
+RUNNER_AUTOSCALE_MEMORY_RESERVE = 256 * 1024 * 1024
+RUNNER_AUTOSCALE_PROCESS_MEMORY = 512 * 1024 * 1024
+
+# RUNNER_AUTOSCALE_SHRINK_DELAY controls how many seconds the pool should
+# stay larger than the demand before a process is removed
+RUNNER_AUTOSCALE_SHRINK_DELAY = 60
+
+# While any homework is due within HOMEWORK_PREWARM_AHEAD seconds, the
+# "manage.py prewarm" task raises the minimum pool size of the runners to
+# RUNNER_PREWARM_MIN_CONCURRENCY, and sets it back to RUNNER_AUTOSCALE_MIN
+# afterwards.  Set to None to leave the pool size alone
+RUNNER_PREWARM_MIN_CONCURRENCY = 4
+
 # MAX_SUBMISSION_SIZE controls the maximum data size allowed for a student
 # to submit (in bytes)
 MAX_SUBMISSION_SIZE = 256 * 1024
@@ -200,6 +441,15 @@ MAX_SUBMISSION_SIZE = 256 * 1024
 # a student to submit
 MAX_SUBMISSION_FILE_COUNT = 100
 
+# MAX_SUBMISSION_UNCOMPRESSED_SIZE controls the maximum total size of the
+# files extracted from a submission archive (in bytes)
+MAX_SUBMISSION_UNCOMPRESSED_SIZE = 16 * 1024 * 1024
+
+# MAX_SUBMISSION_COMPRESSION_RATIO controls the maximum ratio of the
+# extracted size to the archive size.  Extracted files smaller than 1MB
+# are always allowed.
+MAX_SUBMISSION_COMPRESSION_RATIO = 100
+
 # MAX_USER_PENDING controls the maximum submissions of a single user that
 # is running or pending for a single homework.
 MAX_USER_PENDING_PER_HW = 1
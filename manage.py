@@ -62,6 +62,36 @@ class App(object):
         task.logflush()
         sys.stdout.write(io.getvalue())
 
+    def calibrate(self, argv, path):
+        """Calibrate the timeouts by the reference answers."""
+        from railgun.maintain.calibrate import HwCalibrateTask
+
+        io = StringIO()
+        task = HwCalibrateTask(logstream=io)
+        task.execute(path, int(argv[0]) if argv else None)
+        task.logflush()
+        sys.stdout.write(io.getvalue())
+
+    def prewarm(self, argv, path):
+        """Warm the runners for the homework due soon."""
+        from railgun.maintain.prewarm import HwPrewarmTask
+
+        io = StringIO()
+        task = HwPrewarmTask(logstream=io)
+        task.execute(path)
+        task.logflush()
+        sys.stdout.write(io.getvalue())
+
+    def reap(self, argv, path):
+        """Run again or reject the submissions of dead runners."""
+        from railgun.maintain.reaper import HandinReapTask
+
+        io = StringIO()
+        task = HandinReapTask(logstream=io)
+        task.execute(path)
+        task.logflush()
+        sys.stdout.write(io.getvalue())
+
     def runner_perm(self, argv):
         """Check the permissions of runner host."""
         from railgun.maintain.permissions import RunnerPermissionCheckTask
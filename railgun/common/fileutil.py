@@ -6,13 +6,103 @@
 # This file is released under BSD 2-clause license.
 
 import os
+import bz2
+import time
+import zlib
+import errno
+import fcntl
+import shutil
+import signal
 import zipfile
 import rarfile
 import tarfile
+import resource
+import tempfile
+import subprocess
+from io import BytesIO
+
+import config
+from .osutil import kill_process_group
 
 # set the global parameters of external modules
 rarfile.PATH_SEP = '/'
 
+#: The ioctl request number to clone a file (``FICLONE`` in linux/fs.h).
+#: Supported by copy-on-write file systems like btrfs and xfs.
+FICLONE = 0x40049409
+
+#: Size of each read when copying file contents.
+COPY_BUFSIZE = 1024 * 1024
+
+#: Size of each compressed chunk fed into the decompressors.  Small chunks
+#: bound the memory taken by each decompression step.
+DECOMPRESS_CHUNK = 64 * 1024
+
+#: Size of each compressed piece fed into the bzip2 decompressor, which
+#: cannot bound its output like zlib.  A bzip2 block of a few dozen bytes
+#: may expand to about 45 MB, so tiny pieces let at most a few blocks be
+#: inflated before the size is checked again.
+BZ2_FEED_SIZE = 64
+
+#: Seconds between two checks of the extracted size while `unrar` runs.
+UNRAR_POLL_INTERVAL = 0.05
+
+#: The compression ratio guard will not reject archives whose uncompressed
+#: size is below this value, since tiny archives of source code may have
+#: large ratios.
+RATIO_GUARD_MIN_SIZE = 1024 * 1024
+
+
+class ArchiveSizeExceeded(Exception):
+    """The uncompressed content of an archive exceeds the size budget."""
+
+
+def archive_size_budget(archive_size, max_size=None, max_ratio=None):
+    """Compute the uncompressed size budget of an archive.
+
+    :param archive_size: The size of the archive file.
+    :type archive_size: :class:`int`
+    :param max_size: Maximum total uncompressed size, :data:`None` if not
+        limited.
+    :type max_size: :class:`int`
+    :param max_ratio: Maximum ratio of the uncompressed size to the archive
+        size, :data:`None` if not limited.  Uncompressed sizes below
+        :data:`RATIO_GUARD_MIN_SIZE` are always allowed by this guard.
+    :type max_ratio: :class:`int`
+
+    :return: The budget in bytes, or :data:`None` if not limited.
+    """
+    budget = max_size
+    if max_ratio:
+        by_ratio = max(archive_size * max_ratio, RATIO_GUARD_MIN_SIZE)
+        budget = by_ratio if budget is None else min(budget, by_ratio)
+    return budget
+
+
+def copyfileobj_limited(fsrc, fdst, limit=None):
+    """Copy the content of `fsrc` to `fdst` in chunks, not more than `limit`
+    bytes.
+
+    :param fsrc: The source file object.
+    :param fdst: The destination file object.
+    :param limit: Maximum bytes to copy, :data:`None` if not limited.
+    :type limit: :class:`int`
+
+    :return: The number of bytes copied.
+    :raises: :class:`ArchiveSizeExceeded` as soon as the source contains
+        more than `limit` bytes.
+    """
+    copied = 0
+    while True:
+        buf = fsrc.read(COPY_BUFSIZE)
+        if not buf:
+            break
+        copied += len(buf)
+        if limit is not None and copied > limit:
+            raise ArchiveSizeExceeded()
+        fdst.write(buf)
+    return copied
+
 
 def file_get_contents(path):
     """Read the file contents of `path`.
@@ -71,6 +161,76 @@ def dirtree(parent):
     return F(os.path.realpath(parent), '')
 
 
+def clone_file(src, dst, mode=0644, owner=None):
+    """Copy the file `src` to a new file `dst`.
+
+    The file is first cloned with ``FICLONE`` (a reflink), so that the
+    new file shares data blocks with `src` until either of them is written.
+    If the file system does not support reflinks, the content will be copied
+    in chunks.
+
+    :param src: The source file path.
+    :type src: :class:`str`
+    :param dst: The destination file path.  Will be overwritten if exists.
+    :type dst: :class:`str`
+    :param mode: Unix file system mode of the new file.
+    :type mode: :class:`int`
+    :param owner: The (uid, gid) of the new file.  If :data:`None`, the
+        owner will not be changed.
+    :type owner: :class:`tuple`
+
+    :return: :data:`True` if the file is cloned, :data:`False` if the
+        content is copied.
+    """
+    with open(src, 'rb') as fsrc:
+        fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+        try:
+            os.fchmod(fd, mode)
+            if owner is not None:
+                os.fchown(fd, owner[0], owner[1])
+            try:
+                fcntl.ioctl(fd, FICLONE, fsrc.fileno())
+                return True
+            except (IOError, OSError):
+                pass
+            while True:
+                buf = fsrc.read(COPY_BUFSIZE)
+                if not buf:
+                    break
+                while buf:
+                    written = os.write(fd, buf)
+                    buf = buf[written:]
+            return False
+        finally:
+            os.close(fd)
+
+
+def link_or_clone(src, dst, mode=0644, owner=None):
+    """Create a hard link `dst` to `src`, or clone the file if hard link
+    is not possible (for example, across file systems).
+
+    .. note::
+        A hard link shares the inode with `src`, so any change to the
+        content, the owner or the mode of `dst` will also affect `src`.
+        Remove `dst` before writing it.
+
+    :param src: The source file path.
+    :type src: :class:`str`
+    :param dst: The destination file path.  Must not exist.
+    :type dst: :class:`str`
+    :param mode: Unix file system mode of the new file, if cloned.
+    :type mode: :class:`int`
+    :param owner: The (uid, gid) of the new file, if cloned.
+    :type owner: :class:`tuple`
+    """
+    try:
+        os.link(src, dst)
+    except OSError, ex:
+        if ex.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        clone_file(src, dst, mode, owner)
+
+
 def packzip(base_path, files, target, path_prefix=''):
     """Pack all entities in `files` under `base_path` into `target` zipfile.
 
@@ -103,6 +263,135 @@ def makezip(filename):
     return zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED)
 
 
+def detect_archive_format(head):
+    """Detect the archive format according to the leading bytes (the magic
+    number) of the file content.
+
+    :param head: The leading bytes of the archive file, at least 512 bytes
+        are required to recognize an uncompressed tar archive.
+    :type head: :class:`str`
+
+    :return: One of ``('zip', 'rar', 'tar')``, or :data:`None` if the format
+        is not recognized.
+    """
+    if head.startswith('PK\x03\x04') or head.startswith('PK\x05\x06'):
+        return 'zip'
+    if head.startswith('Rar!\x1a\x07'):
+        return 'rar'
+    # gzip, bzip2 compressed or uncompressed tar archives
+    if head.startswith('\x1f\x8b') or head.startswith('BZh') or \
+            head[257:262] == 'ustar':
+        return 'tar'
+
+
+class ArchiveMember(object):
+    """A file entity in an archive file.
+
+    :param name: The canonical name of this entity in the archive.
+    :type name: :class:`str`
+    :param size: The uncompressed size of this entity.
+    :type size: :class:`int`
+    :param info: The member object of the underlying archive library.
+    """
+
+    __slots__ = ('name', 'size', 'info', 'path')
+
+    def __init__(self, name, size, info):
+        #: The canonical name of this entity in the archive.
+        self.name = name
+        #: The uncompressed size of this entity.
+        self.size = size
+        #: The member object of the underlying archive library.
+        self.info = info
+        #: The relative path where this entity should be extracted to.
+        #: Set by :class:`ArchiveManifest`.
+        self.path = name
+
+    def __repr__(self):
+        return '<ArchiveMember(%s)>' % self.name
+
+
+class ArchiveManifest(object):
+    """The list of all file entities in an archive, gathered in one pass
+    over the archive.
+
+    The file count, the top-level directory analysis and the decisions of
+    which files to extract are all driven by this manifest, so that the
+    archive does not need to be scanned again.
+
+    :param members: The file entities in this archive.
+    :type members: :class:`list` of :class:`ArchiveMember`
+    """
+
+    def __init__(self, members):
+        #: The file entities in this archive.
+        self.members = members
+        #: Whether this archive contains only one top-level directory?
+        self.onedir = self._check_onedir()
+        # Set the extraction paths of all members
+        if self.onedir:
+            for m in self.members:
+                m.path = remove_firstdir(m.name)
+        # Cache of (should_skip, selected members)
+        self._selection = None
+
+    def __len__(self):
+        return len(self.members)
+
+    def __iter__(self):
+        return iter(self.members)
+
+    @property
+    def total_size(self):
+        """The total uncompressed size of all file entities."""
+        return sum(m.size for m in self.members)
+
+    def _check_onedir(self):
+        last_dname = None
+        for m in self.members:
+            # get the first directory name
+            slash_pos = m.name.find('/')
+            if slash_pos >= 0:
+                dname = m.name[: slash_pos]
+            else:
+                dname = m.name
+            # ignore some meta data directories
+            if dname == '__MACOSX':
+                # OS X will add a hidden directory named "__MACOSX" to archive
+                # even the user just wants to compress a single directory.
+                # So ignore this directory.
+                continue
+            # check whether one dir.
+            if last_dname is None:
+                last_dname = dname
+            if last_dname != dname:
+                return False
+        return True
+
+    def select(self, should_skip=None):
+        """Get the members that should be extracted.
+
+        The decisions are made on the extraction path (:attr:`ArchiveMember.
+        path`) of each member, and will be cached for the same `should_skip`
+        callback, so that the rules are evaluated only once per member.
+
+        :param should_skip: A callback to determine whether a given file
+            should be skipped.  Exceptions raised by the callback will be
+            propagated.
+        :type should_skip: method(fpath) -> bool
+
+        :return: :class:`list` of :class:`ArchiveMember`.
+        """
+        if should_skip is None:
+            return list(self.members)
+        if self._selection is None or self._selection[0] is not should_skip:
+            self._selection = (
+                should_skip,
+                [m for m in self.members if not should_skip(m.path)]
+            )
+        return self._selection[1]
+
+
 class Extractor(object):
     """The unique interface for archive file extractors.
 
@@ -116,6 +405,13 @@ class Extractor(object):
         >>> Extractor.open('a.rar')
         <RarExtractor instance>
 
+    An archive file already loaded in memory can be opened by
+    :meth:`open_buffer`, where the format is recognized according to the
+    magic number of the content::
+
+        >>> Extractor.open_buffer(data)
+        <ZipExtractor instance>
+
     Also, the :class:`Extractor` objects implements context manager, for
     example:
 
@@ -129,12 +425,21 @@ class Extractor(object):
 
     def __init__(self, fobj):
         self.fobj = fobj
+        #: The budget of the total uncompressed size in bytes, checked by
+        #: :meth:`~railgun.common.tempdir.TempDir.extract`.  :data:`None`
+        #: if not limited.
+        self.size_budget = None
+        self._manifest = None
 
     # support with statement
     def __enter__(self):
         return self
 
     def __exit__(self, type, value, tb):
+        self.close()
+
+    def close(self):
+        """Close the archive file."""
         if self.fobj:
             self.fobj.close()
             self.fobj = None
@@ -147,7 +452,56 @@ class Extractor(object):
     def _canonical_path(self, p):
         return p.replace('\\', '/')
 
-    # basic method to get next file from archive
+    # basic method to list the members in the archive
+    def _members(self):
+        """Get iterable :class:`ArchiveMember` of all files in the archive.
+        Derived classes must implement this."""
+        raise NotImplementedError()
+
+    # basic method to open a member in the archive
+    def open_member(self, member):
+        """Open the given member for reading.  Derived classes must implement
+        this.
+
+        :param member: The member object from :meth:`manifest`.
+        :type member: :class:`ArchiveMember`
+
+        :return: A file-like object.
+        """
+        raise NotImplementedError()
+
+    def prepare(self, members):
+        """Prepare to read the given members.
+
+        Derived classes may override this to extract many files at once,
+        and then provide them via :meth:`staged_path`.
+
+        :param members: The members to be read.
+        :type members: :class:`list` of :class:`ArchiveMember`
+        """
+
+    def staged_path(self, member):
+        """Get the path of a file prepared by :meth:`prepare` for `member`.
+
+        The caller takes the ownership of the returned file, and may move it
+        to elsewhere.
+
+        :param member: The member object from :meth:`manifest`.
+        :type member: :class:`ArchiveMember`
+
+        :return: The file path, or :data:`None` if the member is not staged.
+        """
+        return None
+
+    def manifest(self):
+        """Get the :class:`ArchiveManifest` of this archive.
+
+        The manifest is built on the first call, and cached for later calls.
+        """
+        if self._manifest is None:
+            self._manifest = ArchiveManifest(list(self._members()))
+        return self._manifest
+
     def extract(self):
         """Get iterable (fname, fobj) from the archive.
 
@@ -157,30 +511,23 @@ class Extractor(object):
         :return: list of tuple (fname, fobj), where `fname` is a :class:`str`,
             and `fobj` is a file-like object.
         """
-        raise NotImplementedError()
+        for m in self.manifest():
+            yield m.name, self.open_member(m)
 
-    # basic method to get names of all files
     def filelist(self):
         """Get iterable name lists in this archive file."""
-        raise NotImplementedError()
+        return [m.name for m in self.manifest()]
 
     def countfiles(self, maxcount=1048576):
         """Count all files in the archive.
 
         :param maxcount: maximum files to count.  If exceeds this limit,
-            the method will be interrupted, and ``maxcount + 1`` will be
-            returned.
+            ``maxcount + 1`` will be returned.
         :type maxcount: :class:`int`
 
         :return: the number of files in this archive.
         """
-
-        counter = 0
-        for fname in self.filelist():
-            counter += 1
-            if counter > maxcount:
-                break
-        return counter
+        return min(len(self.manifest()), maxcount + 1)
 
     def onedir(self):
         """Check whether this archive contains only one top-level directory?
@@ -195,26 +542,7 @@ class Extractor(object):
         :return: True if the archive file indeed contains only one top-level
             directory, while False otherwise.
         """
-        last_dname = None
-        for fname in self.filelist():
-            # get the first directory name
-            slash_pos = fname.find('/')
-            if slash_pos >= 0:
-                dname = fname[: slash_pos]
-            else:
-                dname = fname
-            # ignore some meta data directories
-            if dname == '__MACOSX':
-                # OS X will add a hidden directory named "__MACOSX" to archive
-                # even the user just wants to compress a single directory.
-                # So ignore this directory.
-                continue
-            # check whether one dir.
-            if last_dname is None:
-                last_dname = dname
-            if last_dname != dname:
-                return False
-        return True
+        return self.manifest().onedir
 
     @staticmethod
     def open(fpath):
@@ -237,58 +565,323 @@ class Extractor(object):
             return TarExtractor(fpath)
         raise ValueError('Archive file "%s" not recognized.')
 
+    @staticmethod
+    def open_buffer(data, fname=None, max_size=None, max_ratio=None):
+        """Open an extractor for the archive content in memory.
+
+        The format is recognized according to the magic number of `data`.
+        If the magic number is unknown, the extension of `fname` will be
+        used instead.  Zip and tar archives are read from memory directly,
+        while rar archives will be stored in a temporary file under
+        ``config.TEMPORARY_DIR``, since the external `unrar` program
+        requires a disk file.  The temporary file will be removed when the
+        extractor is closed.
+
+        :param data: The archive file content.
+        :type data: :class:`str`
+        :param fname: The original file name of the archive.
+        :type fname: :class:`str`
+        :param max_size: Maximum total uncompressed size of the archive.
+        :type max_size: :class:`int`
+        :param max_ratio: Maximum compression ratio of the archive.  See
+            :func:`archive_size_budget` for more details.
+        :type max_ratio: :class:`int`
+
+        :return: instance derived from :class:`Extractor`.
+        :raises: :class:`ValueError` if the format is not supported.
+        :raises: :class:`ArchiveSizeExceeded` if a compressed tar archive
+            exceeds the size budget.
+        """
+        budget = archive_size_budget(len(data), max_size, max_ratio)
+        fmt = detect_archive_format(data[:512])
+        if fmt is None and fname:
+            fext = os.path.splitext(fname)[1].lower()
+            if fext == '.zip':
+                fmt = 'zip'
+            elif fext in ('.tar', '.tgz', '.gz', '.bz2', '.tbz'):
+                fmt = 'tar'
+            elif fext == '.rar':
+                fmt = 'rar'
+        if fmt == 'zip':
+            ret = ZipExtractor(BytesIO(data))
+        elif fmt == 'tar':
+            ret = TarExtractor(BytesIO(data), size_budget=budget)
+        elif fmt == 'rar':
+            ret = RarExtractor.from_buffer(data)
+        else:
+            raise ValueError('Archive file "%s" not recognized.' % fname)
+        ret.size_budget = budget
+        return ret
+
 
 class ZipExtractor(Extractor):
 
     def __init__(self, fpath):
+        # `fpath` may be either a file path or a file-like object
         super(ZipExtractor, self).__init__(zipfile.ZipFile(fpath, 'r'))
 
-    def extract(self):
+    def _members(self):
         for mi in self.fobj.infolist():
             # ignore directory entries
-            print 'mi.filename ' + mi.filename
             if mi.filename[-1] == '/':
                 continue
-            f = self.fobj.open(mi)
-            yield self._canonical_path(mi.filename), f
+            yield ArchiveMember(self._canonical_path(mi.filename),
+                                mi.file_size, mi)
 
-    def filelist(self):
-        for mi in self.fobj.infolist():
-            if mi.filename[-1] == '/':
-                continue
-            yield self._canonical_path(mi.filename)
+    def open_member(self, member):
+        return self.fobj.open(member.info)
 
 
 class RarExtractor(Extractor):
+    """Extractor for rar archives.
+
+    :mod:`rarfile` spawns an external `unrar` process to read each member
+    of a compressed archive.  To avoid forking once per file, :meth:`prepare`
+    extracts all the requested members into a private staging directory
+    with a single `unrar` call.
+
+    The declared sizes of the members may be forged, so the size of the
+    staging directory is checked against :attr:`~Extractor.size_budget`
+    while `unrar` runs, and `unrar` is killed once it is exceeded.  Each
+    file written by `unrar` is also limited by `RLIMIT_FSIZE`, so that the
+    disk usage cannot run far beyond the budget between two checks.
+    """
 
-    def __init__(self, fpath):
+    def __init__(self, fpath, remove_on_close=False):
         super(RarExtractor, self).__init__(rarfile.RarFile(fpath, 'r'))
+        #: The archive file path.
+        self.fpath = fpath
+        #: Whether the archive file should be removed on close?
+        self.remove_on_close = remove_on_close
+        #: The staging directory created by :meth:`prepare`.
+        self.staging = None
+        # The staged file paths of the members
+        self._staged = {}
 
-    def extract(self):
-        for mi in self.fobj.infolist():
-            if mi.isdir():
-                continue
-            f = self.fobj.open(mi)
-            yield self._canonical_path(mi.filename), f
+    @staticmethod
+    def from_buffer(data):
+        """Store `data` into a temporary file and open it.
 
-    def filelist(self):
+        :param data: The rar archive content.
+        :type data: :class:`str`
+        :return: The :class:`RarExtractor` which removes the temporary file
+            on close.
+        """
+        fd, fpath = tempfile.mkstemp(suffix='.rar', dir=config.TEMPORARY_DIR)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            return RarExtractor(fpath, remove_on_close=True)
+        except Exception:
+            os.remove(fpath)
+            raise
+
+    def close(self):
+        super(RarExtractor, self).close()
+        if self.remove_on_close and os.path.isfile(self.fpath):
+            os.remove(self.fpath)
+            self.remove_on_close = False
+        if self.staging:
+            shutil.rmtree(self.staging, ignore_errors=True)
+            self.staging = None
+            self._staged = {}
+
+    def _members(self):
         for mi in self.fobj.infolist():
             if mi.isdir():
                 continue
-            yield self._canonical_path(mi.filename)
+            yield ArchiveMember(self._canonical_path(mi.filename),
+                                mi.file_size, mi)
+
+    def prepare(self, members):
+        if not members:
+            return
+        if self.staging is None:
+            self.staging = tempfile.mkdtemp(prefix='unrar-',
+                                            dir=config.TEMPORARY_DIR)
+        self._unrar([m.info.filename for m in members], self.staging,
+                    self.size_budget)
+
+        # Only accept regular files inside the staging directory, in case
+        # `unrar` does not sanitize the paths as expected.  Other members
+        # will be read by :meth:`open_member` from the archive.
+        root = os.path.realpath(self.staging) + os.path.sep
+        for m in members:
+            path = os.path.join(self.staging, m.info.filename)
+            if os.path.realpath(path).startswith(root) and \
+                    os.path.isfile(path) and not os.path.islink(path):
+                self._staged[m.name] = path
+
+    def _unrar(self, names, path, budget=None):
+        """Extract the members `names` into `path` by a single `unrar`
+        call, in the same way as :meth:`rarfile.RarFile.extractall`.
+
+        :raises: :class:`ArchiveSizeExceeded` if the extracted files exceed
+            `budget`.
+        :raises: :class:`rarfile.Error` if `unrar` fails.
+        """
+        cmd = [rarfile.UNRAR_TOOL] + list(rarfile.EXTRACT_ARGS)
+        rarfile.add_password_arg(cmd, None)
+        cmd.append('--')
+        cmd.append(self.fpath)
+        cmd.extend(names)
+        cmd.append(path + os.sep)
+
+        def preexec():
+            os.setsid()
+            if budget is not None:
+                # No single file may be larger than the whole budget.
+                resource.setrlimit(resource.RLIMIT_FSIZE,
+                                   (budget + 1, budget + 1))
+
+        with tempfile.TemporaryFile(dir=config.TEMPORARY_DIR) as output:
+            p = subprocess.Popen(cmd, stdout=output,
+                                 stderr=subprocess.STDOUT,
+                                 preexec_fn=preexec, close_fds=True)
+            try:
+                while p.poll() is None:
+                    if budget is not None and _tree_size(path) > budget:
+                        raise ArchiveSizeExceeded()
+                    time.sleep(UNRAR_POLL_INTERVAL)
+            finally:
+                if p.returncode is None:
+                    kill_process_group(p.pid)
+                    p.wait()
+            if budget is not None and (p.returncode == -signal.SIGXFSZ or
+                                       _tree_size(path) > budget):
+                raise ArchiveSizeExceeded()
+            output.seek(0)
+            rarfile.check_returncode(p, output.read())
+
+    def staged_path(self, member):
+        return self._staged.pop(member.name, None)
+
+    def open_member(self, member):
+        path = self._staged.get(member.name)
+        if path is not None:
+            return open(path, 'rb')
+        return self.fobj.open(member.info)
+
+
+def _tree_size(path):
+    """Get the total size of the files under `path`."""
+    total = 0
+    for dpath, _, fnames in os.walk(path):
+        for fn in fnames:
+            try:
+                total += os.lstat(os.path.join(dpath, fn)).st_size
+            except OSError:
+                pass
+    return total
 
 
 class TarExtractor(Extractor):
+    """Extractor for tar archives, which may be compressed by gzip or bzip2.
+
+    A compressed tar archive is a single compressed stream, so reading the
+    member list and then reading the members would decompress the stream
+    more than once.  We decompress the stream exactly once into a spooled
+    temporary file (in memory for small archives), and read the plain tar
+    archive from it.
+
+    :param fpath: The archive file path, or a file-like object.
+    :param size_budget: If specified, raise :class:`ArchiveSizeExceeded`
+        as soon as the decompressed stream is much larger than this size.
+    :type size_budget: :class:`int`
+    """
 
-    def __init__(self, fpath):
-        super(TarExtractor, self).__init__(tarfile.open(fpath, 'r'))
-
-    def extract(self):
-        for mi in self.fobj:
-            if not mi.isdir():
-                yield self._canonical_path(mi.name), self.fobj.extractfile(mi)
-
-    def filelist(self):
-        for mi in self.fobj:
-            if not mi.isdir():
-                yield self._canonical_path(mi.name)
+    def __init__(self, fpath, size_budget=None):
+        # The decompressed stream contains the headers and paddings of the
+        # members besides the file contents.
+        limit = None
+        if size_budget is not None:
+            limit = size_budget + TAR_STREAM_SLACK
+        # `fpath` may be either a file path or a file-like object
+        if isinstance(fpath, basestring):
+            with open(fpath, 'rb') as src:
+                self.stream = _decompress_tar(src, limit)
+        else:
+            self.stream = _decompress_tar(fpath, limit)
+        super(TarExtractor, self).__init__(
+            tarfile.open(fileobj=self.stream, mode='r:'))
+
+    def close(self):
+        super(TarExtractor, self).close()
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+    def _members(self):
+        for mi in self.fobj.getmembers():
+            # only regular files will be extracted
+            if mi.isfile():
+                yield ArchiveMember(self._canonical_path(mi.name), mi.size,
+                                    mi)
+
+    def open_member(self, member):
+        return self.fobj.extractfile(member.info)
+
+
+#: Maximum bytes of a decompressed tar archive kept in memory.  Larger
+#: archives are spooled to disk under ``config.TEMPORARY_DIR``.
+TAR_SPOOL_MEMORY = 8 * 1024 * 1024
+
+
+#: Extra bytes allowed for the headers and paddings in a tar stream, beyond
+#: the size budget of the file contents.
+TAR_STREAM_SLACK = 1024 * 1024
+
+
+def _decompress_tar(src, limit=None):
+    """Decompress the gzip or bzip2 compressed stream `src` into a spooled
+    temporary file.  Uncompressed stream will also be copied.
+
+    :param src: The source file object.
+    :param limit: Maximum size of the decompressed stream.
+    :type limit: :class:`int`
+
+    :return: The :class:`tempfile.SpooledTemporaryFile` object, at offset 0.
+    :raises: :class:`ArchiveSizeExceeded` if the decompressed stream is
+        larger than `limit`.
+    """
+    head = src.read(3)
+    if head.startswith('\x1f\x8b'):
+        # 16 + MAX_WBITS tells zlib to process the gzip header
+        zobj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+        def decompress(buf):
+            # `max_length` keeps a gzip bomb from inflating a whole chunk
+            # in memory at once
+            while buf:
+                yield zobj.decompress(buf, COPY_BUFSIZE)
+                buf = zobj.unconsumed_tail
+    elif head.startswith('BZh'):
+        bobj = bz2.BZ2Decompressor()
+
+        def decompress(buf):
+            # Python 2 `BZ2Decompressor` has no `max_length`, so feed the
+            # chunk in tiny pieces, and let the caller check the size of
+            # the output after each piece
+            for i in xrange(0, len(buf), BZ2_FEED_SIZE):
+                yield bobj.decompress(buf[i: i + BZ2_FEED_SIZE])
+    else:
+        def decompress(buf):
+            yield buf
+
+    out = tempfile.SpooledTemporaryFile(max_size=TAR_SPOOL_MEMORY,
+                                        dir=config.TEMPORARY_DIR)
+    try:
+        size = 0
+        buf = head
+        while buf:
+            for chunk in decompress(buf):
+                size += len(chunk)
+                if limit is not None and size > limit:
+                    raise ArchiveSizeExceeded()
+                out.write(chunk)
+            buf = src.read(DECOMPRESS_CHUNK)
+        out.seek(0)
+    except Exception:
+        out.close()
+        raise
+    return out
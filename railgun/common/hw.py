@@ -41,6 +41,17 @@ You may head over to read more about these classes.
 
 import re
 import os
+import json
+import math
+import struct
+import shutil
+import hashlib
+import zipfile
+import tempfile
+import threading
+import py_compile
+import subprocess
+from collections import OrderedDict
 from datetime import datetime
 from xml.etree import ElementTree
 from itertools import ifilter, chain
@@ -54,9 +65,20 @@ from . import fileutil
 from .fileutil import file_get_contents
 from .dateutil import utc_now, to_utc_date, from_plain_date
 from .lazy_i18n import lazystr_to_plain, plain_to_lazystr
+from .osutil import ResourceUsage
 from .url import reform_path, UrlMatcher
 from pymongo import MongoClient
 
+#: Regular expression features that prevent a file rule from being combined
+#: with others: numbered or named back references, and inline flags.
+COMBINE_UNSAFE = re.compile(r'\\[1-9]|\(\?P=|\(\?[iLmsux]+\)')
+
+#: Format version of the precompiled artifacts.  Increase it whenever the
+#: layout of :class:`HwArtifacts` is changed, so that the old artifacts
+#: will be ignored.
+ARTIFACT_FORMAT = 1
+
+
 def parse_bool(s):
     """Convert a string literal into its boolean value.
 
@@ -109,16 +131,97 @@ class FileRules(object):
     #: containing these files will be `REJECTED` immediately.
     DENY = 3
 
+    #: Maximum number of decisions cached in each rule set.
+    CACHE_SIZE = 4096
+
+    #: The :mod:`re` module supports at most 100 groups in a pattern.
+    MAX_GROUPS = 99
+
     def __init__(self):
         # list of (action, pattern)
         self.data = []
+        # the compiled rules and the cached decisions, built on demand and
+        # dropped when the rule list changes
+        self._compiled = None
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
 
     def __repr__(self):
         return repr(self.data)
 
+    def _compile(self):
+        """Compile the rule list into a few combined regular expressions.
+
+        Each rule is wrapped in a named group ``r<index>``, and the rules are
+        joined as alternatives.  Since the alternatives are tried in order,
+        one match of the combined expression gives the first matching rule.
+
+        :return: :class:`list` of (index offset, compiled pattern or
+            :data:`None`).  A pattern of :data:`None` means the rule at the
+            offset should be matched on its own.
+        """
+        ret = []
+        chunk = []
+        groups = 0
+
+        def flush():
+            if chunk:
+                offset = chunk[0][0]
+                combined = '|'.join(
+                    '(?P<r%d>%s)' % (i - offset, p.pattern) for i, p in chunk
+                )
+                try:
+                    ret.append((offset, re.compile(combined)))
+                except re.error:
+                    # e.g., the rules define named groups of the same name
+                    ret.extend((i, None) for i, _ in chunk)
+                del chunk[:]
+
+        for i, (a, p) in enumerate(self.data):
+            # Rules with back references or inline flags cannot be combined,
+            # since these features would change meaning in the alternation.
+            if p.flags & ~re.UNICODE or COMBINE_UNSAFE.search(p.pattern):
+                flush()
+                groups = 0
+                ret.append((i, None))
+                continue
+            if groups + p.groups + 1 > self.MAX_GROUPS:
+                flush()
+                groups = 0
+            chunk.append((i, p))
+            groups += p.groups + 1
+        flush()
+        return ret
+
+    def _match_index(self, filename):
+        """Get the index of the first rule matching `filename`, or
+        :data:`None` if no rule matches."""
+        compiled = self._compiled
+        if compiled is None:
+            compiled = self._compiled = self._compile()
+        for offset, pattern in compiled:
+            if pattern is None:
+                if self.data[offset][1].match(filename):
+                    return offset
+                continue
+            m = pattern.match(filename)
+            if m:
+                # the named group of the rule encloses any inner groups, so
+                # it is always the last closed group
+                return offset + int(m.lastgroup[1:])
+        return None
+
+    def _invalidate(self):
+        with self._lock:
+            self._compiled = None
+            self._cache.clear()
+
     def get_action(self, filename, default_action=LOCK):
         """Get the action to take on given file.
 
+        The decisions are cached, so repeated queries on the same file are
+        cheap.
+
         :param filename: The name of the file.
         :type filename: :class:`str`
         :param default_action: If no rule in this set is matched, what action
@@ -126,13 +229,32 @@ class FileRules(object):
 
         :return: One action out of ``(ACCEPT, LOCK, HIDE, DENY)``.
         """
-
-        for a, p in self.data:
-            if p.match(filename):
-                return a
+        cache = self._cache
+        with self._lock:
+            index = cache.pop(filename, -1)
+            if index == -1:
+                index = self._match_index(filename)
+            cache[filename] = index
+            if len(cache) > self.CACHE_SIZE:
+                cache.popitem(last=False)
 
         # if no rule matches, default takes lock action
-        return default_action
+        if index is None:
+            return default_action
+        return self.data[index][0]
+
+    def classify(self, files, default_action=LOCK):
+        """Get the actions to take on a batch of files.
+
+        :param files: The input file name iterator.
+        :type files: Iterable file names
+        :param default_action: If no rule in this set is matched, what action
+            should a given file take?
+
+        :return: An iterator of tuple (file name, action).
+        """
+        for f in files:
+            yield f, self.get_action(f, default_action)
 
     def _make_action(self, action, pattern):
         act = None
@@ -156,6 +278,7 @@ class FileRules(object):
         :type pattern: Regular expression :class:`str`
         """
         self.data.append(self._make_action(action, pattern))
+        self._invalidate()
 
     def prepend_action(self, action, pattern):
         """Prepend a file rule (action, pattern) to the front of rule list.
@@ -166,6 +289,7 @@ class FileRules(object):
         :type pattern: Regular expression :class:`str`
         """
         self.data.insert(0, self._make_action(action, pattern))
+        self._invalidate()
 
     def filter(self, files, allow_actions, default_action=LOCK):
         """Return a new iterator on given file iterator, where files not
@@ -191,9 +315,9 @@ class FileRules(object):
         :return: The new file name iterator.
         """
 
-        return ifilter(
-            lambda f: self.get_action(f) in allow_actions,
-            files
+        return (
+            f for f, a in self.classify(files, default_action)
+            if a in allow_actions
         )
 
     @staticmethod
@@ -352,6 +476,226 @@ class HwScorerSetting(object):
         return ret
 
 
+class HwArtifacts(object):
+    """Precompiled artifacts of a :class:`HwCode`, built once by
+    :meth:`HwCode.build_artifacts` when the homework cache is built, so
+    that the runner does not need to compile the homework code for every
+    submission.
+
+    The artifacts are stored in a directory named by
+    :meth:`HwCode.artifact_version`, which contains:
+
+    *   ``python/[path]c``: the compiled bytecode of each locked Python file.
+    *   ``classes.jar``: the classes compiled from the Java sources in the
+        `buildDir` of ``<compiler>``, except for the `sources` written by
+        the students.
+    *   ``calibration.json``: the :class:`HwCalibration` of the reference
+        answer, if measured by ``manage.py calibrate``.
+
+    :param path: The directory of the artifacts.
+    :type path: :class:`str`
+    """
+
+    #: File name of the Java classes jar.
+    JAR_NAME = 'classes.jar'
+
+    def __init__(self, path):
+        #: The directory of the artifacts.
+        self.path = path
+
+    def __repr__(self):
+        return '<HwArtifacts(%s)>' % self.path
+
+    def get_pyc(self, path):
+        """Get the compiled bytecode file of a Python file.
+
+        :param path: The relative path of the Python file.
+        :type path: :class:`str`
+        :return: The path of the bytecode file, or :data:`None` if not
+            compiled.
+        """
+        pyc = os.path.join(self.path, 'python', path + 'c')
+        if os.path.isfile(pyc):
+            return pyc
+
+    @staticmethod
+    def read_pyc_mtime(pyc):
+        """Read the modification time of the source file recorded in the
+        compiled bytecode file `pyc`.
+
+        The source file should be given this modification time, otherwise
+        the bytecode will be considered out of date by the interpreter.
+        """
+        with open(pyc, 'rb') as f:
+            return struct.unpack('<I', f.read(8)[4:])[0]
+
+    @property
+    def jar(self):
+        """The path of the Java classes jar, or :data:`None` if not built."""
+        jar = os.path.join(self.path, self.JAR_NAME)
+        if os.path.isfile(jar):
+            return jar
+
+    @staticmethod
+    def build(hw, code, path):
+        """Build the artifacts of `code` into directory `path`.
+
+        The artifacts are built in a temporary directory, and then renamed
+        to `path`, so that the runner would never see incomplete artifacts.
+
+        :param hw: The homework object.
+        :type hw: :class:`Homework`
+        :param code: The code package object.
+        :type code: :class:`HwCode`
+        :param path: The directory of the artifacts.
+        :type path: :class:`str`
+
+        :return: A list of error messages of the files failed to compile.
+            These files are left to be compiled by the runner.
+        """
+        # The artifacts of the same version are built from the same files.
+        if os.path.isdir(path):
+            return []
+        parent = os.path.dirname(path)
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        building = tempfile.mkdtemp(prefix='.building-', dir=parent)
+        errors = []
+        try:
+            files = [f for f in fileutil.dirtree(code.path)
+                     if os.path.isfile(os.path.join(code.path, f))]
+
+            # Compile the Python files which students cannot overwrite.
+            for f in files:
+                if f.endswith('.py') and not hw.is_overwritable(code, f):
+                    pyc = os.path.join(building, 'python', f + 'c')
+                    if not os.path.isdir(os.path.dirname(pyc)):
+                        os.makedirs(os.path.dirname(pyc))
+                    try:
+                        py_compile.compile(os.path.join(code.path, f),
+                                           cfile=pyc, dfile=f, doraise=True)
+                    except py_compile.PyCompileError, ex:
+                        errors.append(ex.msg)
+
+            # Compile the Java sources of the homework.
+            params = code.compiler_params
+            build_dir = params.get('buildDir') if params is not None else None
+            if build_dir:
+                error = HwArtifacts._build_jar(
+                    hw, code, build_dir, params.get('sources'),
+                    os.path.join(building, HwArtifacts.JAR_NAME)
+                )
+                if error:
+                    errors.append(error)
+
+            os.chmod(building, 0755)
+            os.rename(building, path)
+        finally:
+            if os.path.isdir(building):
+                shutil.rmtree(building)
+        return errors
+
+    @staticmethod
+    def _build_jar(hw, code, build_dir, sources, jar):
+        sources = set(s.strip() for s in (sources or '').split(',')
+                      if s.strip())
+        prefix = build_dir.rstrip('/') + '/'
+        files = []
+        libs = []
+        for f in fileutil.dirtree(code.path):
+            if not f.startswith(prefix):
+                continue
+            if f.endswith('.jar') and f[len(prefix):].startswith('lib/'):
+                libs.append(os.path.join(code.path, f))
+            elif f.endswith('.java') and f[len(prefix):] not in sources and \
+                    not hw.is_overwritable(code, f):
+                files.append(os.path.join(code.path, f))
+        if not files:
+            return
+
+        classes = tempfile.mkdtemp(prefix='.classes-',
+                                   dir=os.path.dirname(jar))
+        try:
+            cmd = [config.HOMEWORK_JAVAC, '-g', '-d', classes]
+            if libs:
+                cmd += ['-classpath', os.path.pathsep.join(libs)]
+            p = subprocess.Popen(cmd + files, stdout=subprocess.PIPE,
+                                 stderr=subprocess.STDOUT)
+            output = p.communicate()[0]
+            if p.returncode != 0:
+                # The homework classes may depend on the student sources, so
+                # they can only be compiled by the runner.
+                return 'Cannot compile Java classes of %s:\n%s' % \
+                    (code.path, output)
+            with zipfile.ZipFile(jar, 'w', zipfile.ZIP_DEFLATED) as z:
+                for f in sorted(fileutil.dirtree(classes)):
+                    if os.path.isfile(os.path.join(classes, f)):
+                        z.write(os.path.join(classes, f), f)
+        finally:
+            shutil.rmtree(classes)
+
+
+class HwCalibration(object):
+    """The running time of the reference answer of a :class:`HwCode`,
+    measured by :class:`~railgun.maintain.calibrate.HwCalibrateTask`.
+
+    The timeout in ``code.xml`` is usually chosen by guesswork.  Instead,
+    the runner may use the slowest run of the reference answer multiplied
+    by ``config.HOMEWORK_TIMEOUT_FACTOR``, plus
+    ``config.HOMEWORK_TIMEOUT_SLACK`` seconds, as the timeout.
+
+    The calibration is stored in the directory of :class:`HwArtifacts`, so
+    it is discarded once the code files of the homework are changed.
+
+    :param runs: The wall clock seconds of each run.
+    :type runs: :class:`list` of :class:`float`
+    """
+
+    #: File name of the calibration in the artifacts directory.
+    FILE_NAME = 'calibration.json'
+
+    def __init__(self, runs):
+        #: The wall clock seconds of each run.
+        self.runs = sorted(runs)
+
+    def __repr__(self):
+        return '<HwCalibration(baseline=%r)>' % self.baseline
+
+    @property
+    def baseline(self):
+        """The baseline running time, i.e., the slowest run."""
+        return self.runs[-1] if self.runs else None
+
+    def timeout(self, limit):
+        """Derive the timeout of the submissions from the baseline.
+
+        :param limit: The timeout in ``code.xml``, which is never exceeded.
+        :type limit: :class:`int`
+        :return: The timeout in seconds.
+        :rtype: :class:`int`
+        """
+        if self.baseline is None or config.HOMEWORK_TIMEOUT_FACTOR is None:
+            return limit
+        timeout = int(math.ceil(
+            self.baseline * config.HOMEWORK_TIMEOUT_FACTOR +
+            config.HOMEWORK_TIMEOUT_SLACK
+        ))
+        return min(limit, max(config.HOMEWORK_TIMEOUT_MIN, timeout))
+
+    def save(self, path):
+        """Save the calibration to file `path`."""
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'wb') as f:
+            json.dump({'runs': self.runs}, f)
+        os.rename(tmp, path)
+
+    @staticmethod
+    def load(path):
+        """Load the calibration from file `path`."""
+        with open(path, 'rb') as f:
+            return HwCalibration(json.load(f)['runs'])
+
+
 class HwCode(object):
     """Store the definition of a particular programming language in a
     homework assignment.
@@ -407,6 +751,9 @@ class HwCode(object):
         #: Store the specialized settings for various scorers.
         self.scorers = {}
 
+        # The cached result of :meth:`artifact_version`
+        self._artifact_version = None
+
     def __repr__(self):
         return '<HwCode(%s)>' % self.path
 
@@ -436,6 +783,79 @@ class HwCode(object):
             typeName = typeName[rpos+1:]
             return self.scorers.get(typeName, None)
 
+    def artifact_version(self):
+        """Get the version of the precompiled artifacts of this code package.
+
+        The version is computed from the paths and contents of all the code
+        files, so the artifacts built on another machine can be used as
+        long as the files are identical.  The result is cached, since the
+        :class:`HwCode` object is replaced when the homework is reloaded.
+
+        :rtype: :class:`str`
+        """
+        if self._artifact_version is None:
+            h = hashlib.md5()
+            h.update('%d\0' % ARTIFACT_FORMAT)
+            for f in sorted(fileutil.dirtree(self.path)):
+                fpath = os.path.join(self.path, f)
+                if os.path.isfile(fpath):
+                    with open(fpath, 'rb') as fsrc:
+                        digest = hashlib.md5(fsrc.read()).hexdigest()
+                    h.update('%s\0%s\0' % (f, digest))
+            self._artifact_version = h.hexdigest()
+        return self._artifact_version
+
+    def artifact_path(self, hwid):
+        """Get the directory of the precompiled artifacts of this code
+        package, which is
+        ``config.HOMEWORK_ARTIFACT_DIR/[hwid]/[lang]/[version]``.
+
+        :param hwid: The uuid of the homework.
+        :type hwid: :class:`str`
+        """
+        return os.path.join(config.HOMEWORK_ARTIFACT_DIR, hwid, self.lang,
+                            self.artifact_version())
+
+    def get_artifacts(self, hwid):
+        """Get the precompiled artifacts of this code package.
+
+        :param hwid: The uuid of the homework.
+        :type hwid: :class:`str`
+        :return: The :class:`HwArtifacts`, or :data:`None` if the artifacts
+            of current version have not been built.
+        """
+        path = self.artifact_path(hwid)
+        if os.path.isdir(path):
+            return HwArtifacts(path)
+
+    def get_calibration(self, hwid):
+        """Get the calibrated running time of the reference answer.
+
+        :param hwid: The uuid of the homework.
+        :type hwid: :class:`str`
+        :return: The :class:`HwCalibration`, or :data:`None` if the current
+            version has not been calibrated.
+        """
+        path = os.path.join(self.artifact_path(hwid), HwCalibration.FILE_NAME)
+        if os.path.isfile(path):
+            return HwCalibration.load(path)
+
+    def build_artifacts(self, hw):
+        """Build the precompiled artifacts of this code package, and remove
+        the artifacts of other versions.
+
+        :param hw: The homework object.
+        :type hw: :class:`Homework`
+        :return: A list of error messages of the files failed to compile.
+        """
+        path = self.artifact_path(hw.uuid)
+        errors = HwArtifacts.build(hw, self, path)
+        parent = os.path.dirname(path)
+        for name in os.listdir(parent):
+            if name != os.path.basename(path):
+                shutil.rmtree(os.path.join(parent, name), ignore_errors=True)
+        return errors
+
     @staticmethod
     def load(path):
         """Load the definitions as a code package under `path`.
@@ -698,6 +1118,25 @@ class Homework(object):
             fileutil.packzip(self.path, root_files, zipf, path_prefix)
             fileutil.packzip(code.path, code_files, zipf, path_prefix)
 
+    def is_overwritable(self, code, path):
+        """Check whether the students may overwrite the file at `path` in
+        the code package with their submissions.
+
+        The rules in `code` take precedence, and the rules in this homework
+        are only checked if no rule in `code` matches `path`.
+
+        :param code: The code package object.
+        :type code: :class:`HwCode`
+        :param path: The relative path of the file.
+        :type path: :class:`str`
+        """
+        action = code.file_rules.get_action(path, default_action=-1)
+        if action != -1:
+            return action == FileRules.ACCEPT
+        action = self.file_rules.get_action(path,
+                                            default_action=FileRules.LOCK)
+        return action == FileRules.ACCEPT
+
     def list_files(self, lang):
         """List all runtime files for given programming language.
 
@@ -879,6 +1318,22 @@ class HwSet(object):
         """Iterate over :class:`Homework` objects."""
         return iter(self.items)
 
+    def get_due_within(self, seconds, now=None):
+        """Get the :class:`Homework` objects having a deadline within the
+        next `seconds` seconds.
+
+        :param seconds: Length of the time window.
+        :type seconds: :class:`int`
+        :param now: The current UTC time, or :data:`None` to use
+            :func:`~railgun.common.dateutil.utc_now`.
+        :type now: :class:`~datetime.datetime`
+        :rtype: :class:`list` of :class:`Homework`
+        """
+        now = now or utc_now()
+        until = now + timedelta(seconds=seconds)
+        return [hw for hw in self.items
+                if any(now <= ddl[0] <= until for ddl in hw.deadlines)]
+
     def get_by_uuid(self, uuid):
         """Get the :class:`Homework` object with given `uuid`."""
         return self.__uuid_to_hw.get(uuid, None)
@@ -998,10 +1453,12 @@ class HwScore(object):
         or :class:`basestring`
     :param partials: The :class:`HwPartialScore` objects.
     :type partials: :class:`list` of :class:`HwPartialScore`
+    :param usage: The resource usage of the submission processes.
+    :type usage: :class:`~railgun.common.osutil.ResourceUsage`
     """
 
     def __init__(self, accepted, result=None, compile_error=None,
-                 partials=None):
+                 partials=None, usage=None):
         # Whether the state of the submission is accepted?
         self.accepted = accepted
         #: A brief comment on the submission.
@@ -1014,6 +1471,10 @@ class HwScore(object):
         #: The :class:`HwPartialScore` objects.
         #: (:class:`list` of :class:`HwPartialScore`)
         self.partials = partials or []
+        #: The resource usage of the submission processes, or :data:`None`
+        #: if not collected.
+        #: (:class:`~railgun.common.osutil.ResourceUsage`)
+        self.usage = usage
 
     def get_score(self):
         """Sum up the final score."""
@@ -1035,6 +1496,7 @@ class HwScore(object):
             'result': lazystr_to_plain(self.result),
             'compile_error': lazystr_to_plain(self.compile_error),
             'partials': [p.to_plain() for p in self.partials],
+            'usage': self.usage.to_plain() if self.usage else None,
         }
 
     @staticmethod
@@ -1048,4 +1510,6 @@ class HwScore(object):
                       plain_to_lazystr(obj['compile_error']))
         for p in obj['partials']:
             ret.partials.append(HwPartialScore.from_plain(p))
+        if obj.get('usage'):
+            ret.usage = ResourceUsage.from_plain(obj['usage'])
         return ret
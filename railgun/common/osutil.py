@@ -7,9 +7,11 @@
 
 import os
 import time
-import math
+import errno
+import select
 import signal
 import subprocess
+from collections import deque
 
 
 class ProcessTimeout(Exception):
@@ -17,6 +19,43 @@ class ProcessTimeout(Exception):
     pass
 
 
+class ProcessOutputExceeded(Exception):
+    """Indicate that the process has produced more output than allowed.
+
+    :param message: The error message.
+    :type message: :class:`str`
+    :param stdout: The truncated standard output of the process.
+    :type stdout: :class:`str`
+    :param stderr: The truncated standard error output of the process.
+    :type stderr: :class:`str`
+    """
+
+    def __init__(self, message, stdout=None, stderr=None):
+        super(ProcessOutputExceeded, self).__init__(message)
+        #: The truncated standard output of the process.
+        self.stdout = stdout
+        #: The truncated standard error output of the process.
+        self.stderr = stderr
+
+
+#: Size of each read from the process output pipes.
+PIPE_READ_SIZE = 65536
+
+#: The longest interval (in seconds) between two checks on the process
+#: state.  Pipe activities and process exit will normally wake us up
+#: immediately, so this interval only bounds the latency of rare situations,
+#: for example, the process has closed its output pipes but not exited yet.
+EXIT_CHECK_INTERVAL = 0.05
+
+#: The marker inserted between the head and the tail of a truncated output.
+TRUNCATE_MARKER = '\n\n... (%(skipped)d bytes truncated) ...\n\n'
+
+#: The first interval (in seconds) to check the process state once all its
+#: output pipes are closed.  The interval is doubled after each check until
+#: it reaches :data:`EXIT_CHECK_INTERVAL`.
+EXIT_CHECK_MIN_INTERVAL = 0.0005
+
+
 def is_running(pid):
     """Check whether the process with given `pid` is still running.
 
@@ -33,51 +72,455 @@ def is_running(pid):
         return False
 
 
-def execute(cmd, timeout=None, **kwargs):
+def kill_process_group(pid, sig=signal.SIGKILL):
+    """Send `sig` to the process group led by `pid`, or to the process itself
+    if it is not a group leader.
+
+    :param pid: The process id of the group leader.
+    :type pid: :class:`int`
+    :param sig: The signal to be sent.
+    :type sig: :class:`int`
+    """
+    try:
+        os.killpg(pid, sig)
+    except OSError:
+        try:
+            os.kill(pid, sig)
+        except OSError:
+            pass
+
+
+def _wait_readable(fds, timeout):
+    """Wait until some of `fds` is readable, or `timeout` seconds elapsed.
+
+    :return: List of readable file descriptors.
+    """
+    if hasattr(select, 'poll'):
+        poller = select.poll()
+        for fd in fds:
+            poller.register(fd, select.POLLIN | select.POLLPRI |
+                            select.POLLHUP | select.POLLERR)
+        while True:
+            try:
+                return [fd for fd, _ in poller.poll(timeout * 1000.0)]
+            except select.error, ex:
+                if ex.args[0] != errno.EINTR:
+                    raise
+    while True:
+        try:
+            return select.select(fds, [], [], timeout)[0]
+        except select.error, ex:
+            if ex.args[0] != errno.EINTR:
+                raise
+
+
+class OutputBuffer(object):
+    """Capture an output stream of a process, keeping at most `head_size`
+    bytes from the beginning and `tail_size` bytes from the end.
+
+    The bytes in the middle are dropped as soon as they are read, so the
+    memory used by the buffer is bounded no matter how much the process
+    writes.  The total number of bytes is still recorded in :attr:`total`.
+
+    :param head_size: Maximum bytes to keep from the beginning of the
+        stream.  :data:`None` to keep everything.
+    :type head_size: :class:`int`
+    :param tail_size: Maximum bytes to keep from the end of the stream.
+    :type tail_size: :class:`int`
+    """
+
+    def __init__(self, head_size=None, tail_size=0):
+        self.head_size = head_size
+        self.tail_size = tail_size or 0
+        #: Total bytes written into this buffer.
+        self.total = 0
+        self._head = []
+        self._head_len = 0
+        self._tail = deque()
+        self._tail_len = 0
+
+    @property
+    def truncated(self):
+        """Whether some bytes have been dropped from this buffer?"""
+        return self.total > self._head_len + self._tail_len
+
+    def write(self, data):
+        """Append `data` to the buffer."""
+        self.total += len(data)
+        # Fill the head first.
+        if self.head_size is None:
+            self._head.append(data)
+            self._head_len += len(data)
+            return
+        if self._head_len < self.head_size:
+            room = self.head_size - self._head_len
+            self._head.append(data[:room])
+            self._head_len += min(room, len(data))
+            data = data[room:]
+        if not data or self.tail_size <= 0:
+            return
+        # Then the tail ring buffer, dropping the oldest chunks, and the
+        # oldest bytes of the first chunk kept.
+        self._tail.append(data)
+        self._tail_len += len(data)
+        while self._tail_len - len(self._tail[0]) >= self.tail_size:
+            self._tail_len -= len(self._tail.popleft())
+        excess = self._tail_len - self.tail_size
+        if excess > 0:
+            self._tail[0] = self._tail[0][excess:]
+            self._tail_len -= excess
+
+    def getvalue(self):
+        """Get the captured content.
+
+        If some bytes have been dropped, a :data:`TRUNCATE_MARKER` will be
+        inserted between the head and the tail.  Incomplete UTF-8 sequences
+        at the truncation points are removed as well, so that the result
+        can still be decoded if the original output is valid UTF-8.
+
+        :rtype: :class:`str`
+        """
+        head = ''.join(self._head)
+        tail = ''.join(self._tail)
+        if not self.truncated:
+            return head + tail
+        head = _strip_utf8_end(head)
+        tail = _strip_utf8_start(tail)
+        skipped = self.total - len(head) - len(tail)
+        return head + TRUNCATE_MARKER % {'skipped': skipped} + tail
+
+
+def _strip_utf8_end(s):
+    """Remove the incomplete UTF-8 sequence at the end of `s`."""
+    # Look back for the leading byte of the last character.
+    for i in xrange(1, min(4, len(s)) + 1):
+        c = ord(s[-i])
+        if c & 0xC0 == 0x80:
+            continue
+        if c & 0x80 == 0:
+            return s
+        # Count the expected length of the sequence by the leading byte.
+        if c & 0xE0 == 0xC0:
+            size = 2
+        elif c & 0xF0 == 0xE0:
+            size = 3
+        else:
+            size = 4
+        return s if size == i else s[:-i]
+    return s
+
+
+def _strip_utf8_start(s):
+    """Remove the continuation bytes at the beginning of `s`."""
+    i = 0
+    while i < min(3, len(s)) and ord(s[i]) & 0xC0 == 0x80:
+        i += 1
+    return s[i:]
+
+
+class ResourceUsage(object):
+    """Resource usage of the processes of a submission.
+
+    The usage of each process is collected by :func:`os.wait4` when the
+    process is reaped, which includes the usage of all the descendants
+    waited by that process.  The usage of all the processes spawned for a
+    submission is summed up by :meth:`add`.
+
+    :param kwargs: The initial values of the fields.
+    """
+
+    #: Fields summed up by :meth:`add`, named after `struct rusage`.
+    SUM_FIELDS = ('utime', 'stime', 'minflt', 'majflt', 'inblock', 'oublock',
+                  'nvcsw', 'nivcsw')
+
+    #: Fields of which the maximum is kept by :meth:`add`.
+    MAX_FIELDS = ('maxrss',)
+
+    def __init__(self, **kwargs):
+        for k in self.SUM_FIELDS + self.MAX_FIELDS:
+            setattr(self, k, kwargs.get(k, 0))
+        #: The wall clock seconds spent on the processes.
+        self.wall = kwargs.get('wall', 0.0)
+        #: The number of processes reaped.
+        self.processes = kwargs.get('processes', 0)
+
+    def __repr__(self):
+        return '<ResourceUsage(cpu=%.3f, wall=%.3f, maxrss=%d)>' % (
+            self.cpu_time, self.wall, self.maxrss)
+
+    @property
+    def cpu_time(self):
+        """The user and system CPU seconds."""
+        return self.utime + self.stime
+
+    def add(self, other):
+        """Add the usage of `other` to this object.
+
+        :param other: The usage to be added.
+        :type other: :class:`ResourceUsage`
+        """
+        for k in self.SUM_FIELDS:
+            setattr(self, k, getattr(self, k) + getattr(other, k))
+        for k in self.MAX_FIELDS:
+            setattr(self, k, max(getattr(self, k), getattr(other, k)))
+        self.wall += other.wall
+        self.processes += other.processes
+
+    @staticmethod
+    def from_rusage(rusage):
+        """Make a :class:`ResourceUsage` of one process from the
+        :class:`resource.struct_rusage` returned by :func:`os.wait4`.
+        """
+        kwargs = {
+            k: getattr(rusage, 'ru_' + k)
+            for k in ResourceUsage.SUM_FIELDS + ResourceUsage.MAX_FIELDS
+        }
+        return ResourceUsage(processes=1, **kwargs)
+
+    def to_plain(self):
+        """Convert this object to a plain :class:`dict`, whose keys are
+        the field names.
+        """
+        ret = {k: getattr(self, k)
+               for k in self.SUM_FIELDS + self.MAX_FIELDS}
+        ret['wall'] = self.wall
+        ret['processes'] = self.processes
+        return ret
+
+    @staticmethod
+    def from_plain(obj):
+        """Make a :class:`ResourceUsage` from a plain :class:`dict`.
+        Missing fields are regarded as zero.
+        """
+        return ResourceUsage(**dict(
+            (str(k), v) for k, v in obj.iteritems()
+        ))
+
+
+def _reap(p, block):
+    """Check whether the process `p` has exited, and reap it by
+    :func:`os.wait4` so that its resource usage is stored in `p.rusage`.
+
+    Process objects other than :class:`subprocess.Popen` should store
+    `rusage` themselves in `poll()` and `wait()`.
+
+    :param p: The process object.
+    :param block: Whether to wait until the process exits?
+    :type block: :class:`bool`
+    :return: The exit code, or :data:`None` if still running.
+    """
+    if p.returncode is not None or not isinstance(p, subprocess.Popen):
+        return p.wait() if block else p.poll()
+    while True:
+        try:
+            pid, status, rusage = os.wait4(p.pid, 0 if block else os.WNOHANG)
+            break
+        except OSError, ex:
+            if ex.errno == errno.EINTR:
+                continue
+            if ex.errno == errno.ECHILD:
+                # The process has been reaped by someone else.
+                return p.wait() if block else p.poll()
+            raise
+    if pid == p.pid:
+        p._handle_exitstatus(status)
+        p.rusage = ResourceUsage.from_rusage(rusage)
+    return p.returncode
+
+
+def _supervise(p, deadline, buffers, output_limit=None):
+    """Read the output pipes of `p` until the process has exited, until
+    `deadline` is reached, or until the process has written more than
+    `output_limit` bytes.
+
+    The process exit and the pipe activities are waited together, so that
+    we are waken up as soon as anything happens, instead of polling the
+    process state at a fixed interval.
+
+    :param p: The process object, with both stdout and stderr piped.
+    :type p: :class:`subprocess.Popen`
+    :param deadline: The :func:`time.time` value after which the process
+        should be regarded as timeout, or :data:`None` to wait forever.
+    :type deadline: :class:`float`
+    :param buffers: (stdout buffer, stderr buffer)
+    :type buffers: :class:`tuple` of :class:`OutputBuffer`
+    :param output_limit: Maximum total bytes of stdout and stderr, or
+        :data:`None` if not limited.
+    :type output_limit: :class:`int`
+
+    :return: :data:`None` if the process exited, ``'timeout'`` if the
+        deadline was reached, or ``'output'`` if the output limit was
+        exceeded.
+    """
+    sinks = {p.stdout.fileno(): buffers[0], p.stderr.fileno(): buffers[1]}
+    opened = set(sinks.iterkeys())
+
+    def read_pipe(fd):
+        try:
+            data = os.read(fd, PIPE_READ_SIZE)
+        except OSError, ex:
+            if ex.errno in (errno.EINTR, errno.EAGAIN):
+                return
+            raise
+        if data:
+            sinks[fd].write(data)
+        else:
+            opened.discard(fd)
+
+    def output_exceeded():
+        return (output_limit is not None and
+                buffers[0].total + buffers[1].total > output_limit)
+
+    backoff = EXIT_CHECK_MIN_INTERVAL
+    while True:
+        exited = _reap(p, False) is not None
+
+        # Compute how long we can wait before the deadline.
+        remaining = None
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0 and not exited:
+                return 'timeout'
+
+        if exited:
+            # The process has exited.  Collect whatever remains in the pipes
+            # without blocking, since some descendant may still hold them.
+            ready = _wait_readable(list(opened), 0) if opened else None
+            if not ready or (remaining is not None and remaining <= 0):
+                return None
+            for fd in ready:
+                read_pipe(fd)
+        elif opened:
+            # The pipes reach EOF at the same moment the process exits in
+            # most situations, so waiting on the pipes also waits the exit.
+            wait = EXIT_CHECK_INTERVAL
+            if remaining is not None and remaining < wait:
+                wait = remaining
+            for fd in _wait_readable(list(opened), wait):
+                read_pipe(fd)
+        elif remaining is None:
+            # All pipes are closed, and we have no deadline.
+            _reap(p, True)
+        else:
+            # All pipes are closed, the process is likely to be exiting.
+            time.sleep(min(remaining, backoff))
+            backoff = min(backoff * 2, EXIT_CHECK_INTERVAL)
+
+        if output_exceeded():
+            return 'output'
+
+
+def execute(cmd, timeout=None, output_limit=None, head_size=None,
+            tail_size=None, usage=None, on_start=None, **kwargs):
     """Execute a command, read the output and return it back.
 
+    The command is launched as the leader of a new process group, so that
+    all its descendants can be killed together when the timeout is reached.
+    The method returns as soon as the process exits, and the timeout is
+    checked precisely rather than rounded to seconds.
+
+    The output is read as a stream.  If `head_size` is given, only the first
+    `head_size` and the last `tail_size` bytes of each stream are kept, and
+    a marker is inserted in place of the dropped bytes.
+
     :param cmd: Command to execute.
     :type cmd: :class:`str`
     :param timeout: Process timeout in seconds.
-    :type timeout: :class:`int`
+    :type timeout: :class:`float`
+    :param output_limit: Maximum total bytes of stdout and stderr.  The
+        process group will be killed once it is exceeded.
+    :type output_limit: :class:`int`
+    :param head_size: Bytes to keep from the beginning of each stream, or
+        :data:`None` to keep the whole output.
+    :type head_size: :class:`int`
+    :param tail_size: Bytes to keep from the end of each stream.
+    :type tail_size: :class:`int`
+    :param usage: If given, the resource usage of the process is added
+        to this object, even if a limit is reached.
+    :type usage: :class:`ResourceUsage`
+    :param on_start: If given, called with the :class:`subprocess.Popen`
+        object once the process has started.
     :param kwargs: Named arguments for `subprocess.Popen`.
-    :return: (stdout, stderr, exit code)
+    :return: (exit code, stdout, stderr)
     :rtype: :class:`tuple`
 
     :raises: :class:`OSError` on missing command or any other OS errors.
     :raises: :class:`ProcessTimeout` if a timeout was reached.
+    :raises: :class:`ProcessOutputExceeded` if the output limit was reached.
     """
 
-    ph_out = None   # process output
-    ph_err = None   # stderr
-    ph_ret = None   # return code
-
-    #print **kwargs
-
+    kwargs.setdefault('preexec_fn', os.setsid)
     p = subprocess.Popen(cmd, shell=True,
                          stdout=subprocess.PIPE,
                          stderr=subprocess.PIPE,
                          **kwargs)
-    # if timeout is not set wait for process to complete
-    if not timeout:
-        ph_ret = p.wait()
-    else:
-        fin_time = math.ceil(time.time() + timeout)
-        while p.poll() is None and fin_time > time.time():
-            time.sleep(1)
-
-        # if timeout reached, raise an exception
-        if fin_time < time.time():
-
-            # starting 2.6 subprocess has a kill() method which is preferable
-            # p.kill()
-            if is_running(p.pid):
-                os.kill(p.pid, signal.SIGKILL)
-                raise ProcessTimeout("Process timeout has been reached.")
+    if on_start is not None:
+        on_start(p)
+    return supervise(p, timeout, output_limit, head_size, tail_size, usage)
+
+
+def supervise(p, timeout=None, output_limit=None, head_size=None,
+              tail_size=None, usage=None):
+    """Read the output of a started process until it exits, and return it
+    back.  This is the second half of :func:`execute`.
 
-        ph_ret = p.returncode
+    `p` may be a :class:`subprocess.Popen` object, or any object having
+    the same `pid`, `returncode`, `stdout`, `stderr`, `poll()` and `wait()`
+    members, and optionally `rusage` (a :class:`ResourceUsage`) once it
+    has exited.  The process must be the leader of its process group, so that
+    all its descendants can be killed together.
+
+    :param p: The process object, with both stdout and stderr piped.
+    :param timeout: Process timeout in seconds.
+    :type timeout: :class:`float`
+    :param output_limit: Maximum total bytes of stdout and stderr.
+    :type output_limit: :class:`int`
+    :param head_size: Bytes to keep from the beginning of each stream.
+    :type head_size: :class:`int`
+    :param tail_size: Bytes to keep from the end of each stream.
+    :type tail_size: :class:`int`
+    :param usage: If given, the resource usage of the process is added
+        to this object.
+    :type usage: :class:`ResourceUsage`
+    :return: (exit code, stdout, stderr)
+    :rtype: :class:`tuple`
+
+    :raises: :class:`ProcessTimeout` if a timeout was reached.
+    :raises: :class:`ProcessOutputExceeded` if the output limit was reached.
+    """
+    deadline = time.time() + timeout if timeout else None
+    buffers = (OutputBuffer(head_size, tail_size),
+               OutputBuffer(head_size, tail_size))
+
+    try:
+        try:
+            reason = _supervise(p, deadline, buffers, output_limit)
+        except BaseException:
+            # Do not leave the process running if we are interrupted.
+            if p.returncode is None:
+                kill_process_group(p.pid)
+                _reap(p, True)
+            raise
+        finally:
+            p.stdout.close()
+            p.stderr.close()
+
+        # if some limit is reached, kill the whole process group and raise
+        if reason is not None:
+            if p.returncode is None:
+                kill_process_group(p.pid)
+                _reap(p, True)
+            if reason == 'timeout':
+                raise ProcessTimeout("Process timeout has been reached.")
+            raise ProcessOutputExceeded(
+                "Process output limit has been reached.",
+                buffers[0].getvalue(),
+                buffers[1].getvalue()
+            )
+    finally:
+        # The usage of killed processes is counted as well, otherwise the
+        # runaway submissions would never show up.
+        if usage is not None and getattr(p, 'rusage', None) is not None:
+            usage.add(p.rusage)
 
-    ph_out, ph_err = p.communicate()
-    print "stdout" + str(ph_out)
-    print "stderr" + str(ph_err)
-    return (ph_ret, ph_out, ph_err)
+    return (p.returncode, buffers[0].getvalue(), buffers[1].getvalue())
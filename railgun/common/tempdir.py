@@ -7,11 +7,12 @@
 
 import os
 import uuid
+import errno
 import config
 import shutil
 
-from .fileutil import remove_firstdir
 
+from .fileutil import ArchiveSizeExceeded, copyfileobj_limited
 import sys
 reload(sys)
 sys.setdefaultencoding('utf8')
@@ -32,14 +33,24 @@ class TempDir(object):
     :param name: The name of this temporary directory.  If not given,
         it will generate a randomized name by ``uuid.uuid4().get_hex()``.
     :type name: :class:`str`
+    :param root: The parent directory of this temporary directory.  If not
+        given, ``config.TEMPORARY_DIR`` will be used.
+    :type root: :class:`str`
     """
 
-    def __init__(self, name=None):
+    def __init__(self, name=None, root=None):
         #: Hold the name of this temporary directory.
         self.name = name if name else uuid.uuid4().get_hex()
 
         #: Hold the path of this temporary directory.
-        self.path = os.path.join(config.TEMPORARY_DIR, self.name)
+        self.path = os.path.join(root or config.TEMPORARY_DIR, self.name)
+
+        #: The (uid, gid) of all entries in this directory, set by
+        #: :meth:`set_owner`.  New entries are created with this owner.
+        self.owner = None
+
+        #: The mode of all entries in this directory, set by :meth:`set_owner`.
+        self.mode = None
 
     def open(self, mode=0700):
         """Create the temporary directory.
@@ -69,6 +80,125 @@ class TempDir(object):
         """
         return os.path.join(self.path, subpath)
 
+    def entry_mode(self, mode):
+        """Get the mode for a new entry.  If :meth:`set_owner` has been
+        called, the owner's mode takes the place of `mode`."""
+        if self.owner is not None:
+            return self.mode
+        return mode
+
+    def own(self, fpath, fd=None):
+        """Give a new entry to the owner set by :meth:`set_owner`.
+
+        :param fpath: The path of the entry.
+        :type fpath: :class:`str`
+        :param fd: The opened file descriptor of the entry, if any.
+        :type fd: :class:`int`
+        """
+        if self.owner is not None:
+            if fd is not None:
+                os.fchown(fd, self.owner[0], self.owner[1])
+            else:
+                os.chown(fpath, self.owner[0], self.owner[1])
+
+    def makedirs(self, dpath, mode=0700):
+        """Create the directory `dpath` under this directory, as well as all
+        the missing parent directories.  New directories are given to the
+        owner set by :meth:`set_owner`.
+
+        :param dpath: The absolute path of the directory.
+        :type dpath: :class:`str`
+        :param mode: Unix file system mode for new directories.
+        :type mode: :class:`int`
+        """
+        if os.path.isdir(dpath):
+            return
+        parent = os.path.dirname(dpath)
+        if parent != dpath:
+            self.makedirs(parent, mode)
+        mode = self.entry_mode(mode)
+        os.mkdir(dpath, mode)
+        # the umask may have masked some bits of `mode`
+        os.chmod(dpath, mode)
+        self.own(dpath)
+
+    def write_file(self, subpath, data, mode=0700):
+        """Create a file under this directory with the given content.  The
+        new file is given to the owner set by :meth:`set_owner` before any
+        content is written.
+
+        :param subpath: Relative path of the file.
+        :type subpath: :class:`str`
+        :param data: The file content.
+        :type data: :class:`str`
+        :param mode: Unix file system mode for the new file and its new
+            parent directories.
+        :type mode: :class:`int`
+        """
+        fpath = self.fullpath(subpath)
+        self.makedirs(os.path.dirname(fpath), mode)
+        # the existing file may be a hard link to a workspace template
+        if os.path.lexists(fpath):
+            os.remove(fpath)
+        fd = os.open(fpath, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0600)
+        with os.fdopen(fd, 'wb') as f:
+            os.fchmod(fd, self.entry_mode(mode))
+            self.own(fpath, fd)
+            f.write(data)
+
+    def set_owner(self, uid, gid, mode=0700, skip_links=False):
+        """Set the owner and the mode of this directory and all its
+        children.
+
+        Entries created after this call are owned by the given user at
+        creation, so the ownership should be set before writing the files
+        whenever possible.  The existing entries will be changed by one
+        walk over the directory, unless the owner is not changed.
+
+        :param uid: The owner user id.
+        :type uid: :class:`int`
+        :param gid: The owner group id.
+        :type gid: :class:`int`
+        :param mode: File system mode for all entries.
+        :type mode: :class:`int`
+        :param skip_links: Whether or not to skip the existing files with
+            more than one hard links?  Such files are likely to be shared
+            with a workspace template, and must not be changed.
+        :type skip_links: :class:`bool`
+
+        :return: :data:`True` if the existing entries are walked and changed,
+            :data:`False` otherwise.
+        """
+        if self.owner == (uid, gid) and self.mode == mode:
+            return False
+        self.owner = (uid, gid)
+        self.mode = mode
+        if not os.path.isdir(self.path):
+            return False
+        for fpath in self._walk(skip_links):
+            os.chown(fpath, uid, gid)
+            os.chmod(fpath, mode)
+        return True
+
+    def verify_owner(self, skip_links=False):
+        """Check whether all the entries are owned by the owner set by
+        :meth:`set_owner`.
+
+        :param skip_links: Whether or not to skip the files with more than
+            one hard links?
+        :type skip_links: :class:`bool`
+
+        :return: :class:`list` of the paths of mismatched entries.
+        """
+        ret = []
+        if self.owner is None:
+            return ret
+        for fpath in self._walk(skip_links):
+            st = os.lstat(fpath)
+            if (st.st_uid, st.st_gid) != self.owner:
+                ret.append(fpath)
+        return ret
+
     def copyfiles(self, srcdir, filelist, mode=0700):
         """Copy all files from source directory into this.
 
@@ -77,8 +207,8 @@ class TempDir(object):
         :param filelist: Iterable relative paths of file entities.
         :type filelist: iterable object
         :param mode: Unix file system mode for all files and directories.
-            This parameter will not affect existing directories.  Call
-            `chown` to ensure it.
+            This parameter will not affect existing directories, and will
+            be replaced by the mode given to :meth:`set_owner`.
         :type mode: :class:`int`
         """
 
@@ -95,12 +225,12 @@ class TempDir(object):
                 parent_path = os.path.dirname(dstpath)
 
                 # Create the container directory for this file if necessary
-                if not os.path.isdir(parent_path):
-                    os.makedirs(parent_path, mode)
+                self.makedirs(parent_path, mode)
 
                 # Copy the file and set the mode
                 shutil.copyfile(srcpath, dstpath)
-                os.chmod(dstpath, mode)
+                os.chmod(dstpath, self.entry_mode(mode))
+                self.own(dstpath)
 
     def extract(self, extractor, should_skip=None, mode=0700):
         """Extract files into this directory.
@@ -108,36 +238,86 @@ class TempDir(object):
         :param extractor: An extractor object.
         :type extractor: :class:`railgun.common.fsutil.Extractor`
         :param should_skip: A callback to determine whether a given file
-            should be skipped.
+            should be skipped.  It receives the path relative to this
+            directory, with the top-level directory already removed if the
+            archive contains only one.
         :type should_skip: method(fpath) -> bool
         :param mode: Unix file system mode for all new directories and files.
-            This parameter will not affect existing directories.  Call
-            `chown` to ensure it.
+            This parameter will not affect existing directories, and will
+            be replaced by the mode given to :meth:`set_owner`.
         :type mode: :class:`int`
+
+        :raises: :class:`~railgun.common.fileutil.ArchiveSizeExceeded` if the
+            extracted files exceed :attr:`Extractor.size_budget`.
         """
-        # check the arguments
-        should_skip = should_skip or (lambda p: False)
-        canonical_path = remove_firstdir \
-            if extractor.onedir() else (lambda p: p)
+        # Decide which files to extract before writing anything, so that
+        # a denied file would not leave a half-extracted directory.
+        members = extractor.manifest().select(should_skip)
 
-        for fname, fobj in extractor.extract():
-            fpath = canonical_path(fname)
-            dstpath = os.path.join(self.path, fpath)
+        # Reject the archive early if the declared sizes already exceed the
+        # budget.  The declared sizes may be forged, so the real sizes are
+        # counted again during the extraction.
+        budget = extractor.size_budget
+        if budget is not None and sum(m.size for m in members) > budget:
+            raise ArchiveSizeExceeded()
+        extractor.prepare(members)
 
-            # check whether the file should skip
-            if should_skip(fpath):
-                continue
+        for member in members:
+            dstpath = os.path.join(self.path, member.path)
 
             # create the parent directory if not exist
-            parent_path = os.path.dirname(dstpath)
-            if not os.path.isdir(parent_path):
-                os.makedirs(parent_path, mode)
-
-            with open(dstpath, 'wb') as f:
-                f.write(fobj.read())
-            os.chmod(dstpath, mode)
-
-    def chown(self, uid, gid=None, recursive=False):
+            self.makedirs(os.path.dirname(dstpath), mode)
+
+            # the existing file may be a hard link to a workspace template,
+            # so we must break the link instead of writing through it
+            if os.path.lexists(dstpath):
+                os.remove(dstpath)
+
+            # the extractor may have staged the file on disk, then we can
+            # move it instead of copying the content
+            staged = extractor.staged_path(member)
+            if staged is not None:
+                if budget is not None:
+                    budget -= os.path.getsize(staged)
+                    if budget < 0:
+                        raise ArchiveSizeExceeded()
+                try:
+                    os.rename(staged, dstpath)
+                except OSError as ex:
+                    if ex.errno != errno.EXDEV:
+                        raise
+                    shutil.copyfile(staged, dstpath)
+                os.chmod(dstpath, self.entry_mode(mode))
+                self.own(dstpath)
+            else:
+                fobj = extractor.open_member(member)
+                try:
+                    # set the owner and the mode on the opened file, before
+                    # any content is written
+                    fd = os.open(dstpath, os.O_WRONLY | os.O_CREAT |
+                                 os.O_EXCL, 0600)
+                    with os.fdopen(fd, 'wb') as f:
+                        os.fchmod(fd, self.entry_mode(mode))
+                        self.own(dstpath, fd)
+                        copied = copyfileobj_limited(fobj, f, budget)
+                    if budget is not None:
+                        budget -= copied
+                finally:
+                    fobj.close()
+
+    def _walk(self, skip_links):
+        """Iterate over all the directories and files under this directory.
+        Files having more than one hard links are skipped if `skip_links`
+        is True."""
+        for dpath, _, fnames in os.walk(self.path):
+            yield dpath
+            for fn in fnames:
+                fpath = os.path.join(dpath, fn)
+                if skip_links and os.lstat(fpath).st_nlink > 1:
+                    continue
+                yield fpath
+
+    def chown(self, uid, gid=None, recursive=False, skip_links=False):
         """Change the owner uid and gid of this directory.
 
         :param uid: Name or id of owner user.
@@ -147,30 +327,33 @@ class TempDir(object):
         :type uid: :class:`str` or :class:`int`
         :param recursive: Whether or not to chown all children?
         :type recursive: :class:`bool`
+        :param skip_links: Whether or not to skip the files with more than
+            one hard links?  Such files are likely to be shared with
+            a workspace template, and must not be changed.
+        :type skip_links: :class:`bool`
         """
         if gid is None:
             gid = os.stat(self.path).st_gid
         if recursive:
-            for dpath, _, fnames in os.walk(self.path):
-                os.chown(dpath, uid, gid)
-                for fn in fnames:
-                    os.chown(os.path.join(dpath, fn), uid, gid)
+            for fpath in self._walk(skip_links):
+                os.chown(fpath, uid, gid)
         else:
             os.chown(self.path, uid, gid)
 
-    def chmod(self, mode, recursive=False):
+    def chmod(self, mode, recursive=False, skip_links=False):
         """Change the Unix file system mode of this directory.
 
         :param mode: File system mode number.
         :type mode: :class:`int`
         :param recursive: Whether or not to chmod all children?
         :type recursive: :class:`bool`
+        :param skip_links: Whether or not to skip the files with more than
+            one hard links?
+        :type skip_links: :class:`bool`
         """
         if recursive:
-            for dpath, _, fnames in os.walk(self.path):
-                os.chmod(dpath, mode)
-                for fn in fnames:
-                    os.chmod(os.path.join(dpath, fn), mode)
+            for fpath in self._walk(skip_links):
+                os.chmod(fpath, mode)
         else:
             os.chmod(self.path, mode)
 
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# @file: railgun/maintain/calibrate.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# This file is released under BSD 2-clause license.
+
+import os
+import time
+import uuid
+
+import config
+from railgun.common.hw import Homework, HwCalibration
+from railgun.common.fileutil import Extractor
+from .base import Task, tasks
+
+
+class HwCalibrateTask(Task):
+    """Task to run the reference answer of each homework on this runner,
+    and store the :class:`~railgun.common.hw.HwCalibration` with the
+    precompiled artifacts of the homework.
+
+    The reference answer of a code package is ``answer/[lang].zip`` under
+    the homework directory, or ``answer.zip`` beside ``hw.xml``.  Only the
+    Python and Java code packages are calibrated.
+    """
+
+    def get_answer(self, hw, lang):
+        """Get the path of the reference answer of `lang` in `hw`, or
+        :data:`None` if not provided."""
+        for path in (os.path.join(hw.path, 'answer', '%s.zip' % lang),
+                     os.path.join(hw.path, 'answer.zip')):
+            if os.path.isfile(path):
+                return path
+
+    def run_answer(self, hw, lang, data):
+        """Run the reference answer once.
+
+        :return: The wall clock seconds of the run.
+        :raises: :class:`RuntimeError` if the answer does not exit normally.
+        """
+        # Import the runner here, so that the other tasks can be executed on
+        # the website host.
+        from railgun.runner.host import PythonHost, JavaHost
+
+        host_class = {'python': PythonHost, 'java': JavaHost}[lang]
+        with host_class('calibrate-%s' % uuid.uuid4().hex, hw) as host:
+            # The answer must not be limited by an earlier calibration.
+            host.timeout = host.timeout_limit
+            with Extractor.open_buffer(data, 'answer.zip') as extractor:
+                host.prepare_hwcode()
+                host.extract_handin(extractor)
+            if lang == 'java':
+                exitcode, _, stderr = host.compile()
+                if exitcode != 0:
+                    raise RuntimeError('Compile error: %s' % stderr)
+            begin = time.time()
+            exitcode, _, stderr = host.run()
+            elapsed = time.time() - begin
+            if exitcode != 0:
+                raise RuntimeError('Exitcode %s != 0: %s' % (exitcode, stderr))
+            return elapsed
+
+    def calibrate(self, hw, runs):
+        """Calibrate all the code packages of `hw`."""
+        for lang in hw.get_code_languages():
+            code = hw.get_code(lang)
+            answer = self.get_answer(hw, lang)
+            if lang not in ('python', 'java') or answer is None:
+                continue
+            # The calibration is stored with the artifacts of this version.
+            for error in code.build_artifacts(hw):
+                self.logger.warning(error)
+            with open(answer, 'rb') as f:
+                data = f.read()
+
+            timings = []
+            for i in xrange(runs):
+                try:
+                    timings.append(self.run_answer(hw, lang, data))
+                except Exception:
+                    self.logger.exception(
+                        'hwcalibrate "%s": answer failed.' % code.path)
+                    break
+            else:
+                calibration = HwCalibration(timings)
+                calibration.save(os.path.join(code.artifact_path(hw.uuid),
+                                              HwCalibration.FILE_NAME))
+                params = code.runner_params
+                limit = int((params is not None and params.get('timeout')) or
+                            config.RUNNER_DEFAULT_TIMEOUT)
+                self.logger.info(
+                    'hwcalibrate "%s": baseline %.3fs, timeout %ds (limit '
+                    '%ds).' % (code.path, calibration.baseline,
+                               calibration.timeout(limit), limit)
+                )
+
+    def execute(self, hw_root_path, runs=None):
+        runs = runs or config.HOMEWORK_CALIBRATION_RUNS
+        self.logger.info('start calibrating homework timeouts ...')
+        for hw_type in os.listdir(hw_root_path):
+            if hw_type not in config.HOMEWORK_TYPE_SET:
+                continue
+            hw_subroot_path = os.path.join(hw_root_path, hw_type)
+            for hw_name in os.listdir(hw_subroot_path):
+                hw_path = os.path.join(hw_subroot_path, hw_name)
+                if not os.path.isfile(os.path.join(hw_path, 'hw.xml')):
+                    continue
+                try:
+                    self.calibrate(Homework.load(hw_path), runs)
+                except Exception:
+                    self.logger.exception(
+                        'Calibrate homework "%s" failed.' % hw_path)
+
+
+tasks.add('hwcalibrate', HwCalibrateTask)
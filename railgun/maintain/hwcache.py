@@ -14,7 +14,17 @@ from .base import Task, tasks
 
 
 class HwCacheTask(Task):
-    """Task to generate hwpack and hwstatic cache."""
+    """Task to generate hwpack, hwstatic and hwartifact cache."""
+
+    def make_artifacts(self, hw):
+        """Build the precompiled artifacts of each code package in `hw`.
+        See :class:`~railgun.common.hw.HwArtifacts` for more details."""
+        for lang in hw.get_code_languages():
+            code = hw.get_code(lang)
+            for error in code.build_artifacts(hw):
+                self.logger.warning(error)
+            self.logger.info('hwartifact "%s": ok.' %
+                             code.artifact_path(hw.uuid))
 
     def make_single_cache(self,hw_path,hw_name):
 
@@ -49,6 +59,9 @@ class HwCacheTask(Task):
                 shutil.rmtree(hw_static_path)
             shutil.copytree(hw_desc, hw_static_path)
             self.logger.info('hwstatic "%s": ok.' % hw_static_path)
+
+            # build the precompiled artifacts
+            self.make_artifacts(hw)
             
             
     def make_cache(self,hw_root_path):
@@ -100,6 +113,9 @@ class HwCacheTask(Task):
                         shutil.copytree(hw_desc, hw_static_path)
                         self.logger.info('hwstatic "%s": ok.' % hw_static_path)
 
+                        # build the precompiled artifacts
+                        self.make_artifacts(hw)
+
     def execute(self,hw_root_path):
         try:
             self.make_cache(hw_root_path)
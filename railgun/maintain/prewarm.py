@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# @file: railgun/maintain/prewarm.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# This file is released under BSD 2-clause license.
+
+import redis
+
+import config
+from railgun.common.hw import HwSet
+from .base import Task, tasks
+
+
+class HwPrewarmTask(Task):
+    """Task to warm the runner caches of the homework whose deadline comes
+    within ``config.HOMEWORK_PREWARM_AHEAD`` seconds.  It is supposed to be
+    executed by cron every few minutes.
+
+    For each of such homework, the precompiled artifacts are built, and
+    ``config.HOMEWORK_PREWARM_COPIES`` tasks of
+    :func:`~railgun.runner.tasks.prewarm_homework` are sent to each runner
+    queue which the submissions of the homework are routed to (see
+    :mod:`railgun.runner.affinity`).
+
+    If ``config.RUNNER_AUTOSCALE`` is enabled, the minimum pool size of the
+    runners is raised to ``config.RUNNER_PREWARM_MIN_CONCURRENCY`` while
+    any homework is due soon, and set back to
+    ``config.RUNNER_AUTOSCALE_MIN`` afterwards.
+    """
+
+    def target_queues(self, hwid):
+        """Get the runner queues to warm for homework `hwid`."""
+        from railgun.runner import runconfig
+        from railgun.runner.affinity import homework_shards
+
+        queue = runconfig.CELERY_DEFAULT_QUEUE
+        try:
+            client = redis.StrictRedis.from_url(runconfig.BROKER_URL)
+            return homework_shards(client, queue, hwid) or [queue]
+        except Exception:
+            self.logger.exception('Cannot get the shard queues of "%s".' %
+                                  hwid)
+            return [queue]
+
+    def prewarm(self, hw):
+        """Build the artifacts of `hw`, and warm the runners for it."""
+        # Import the runner here, so that the other tasks need not connect
+        # to the broker.
+        from railgun.runner.tasks import prewarm_homework
+
+        for lang in hw.get_code_languages():
+            code = hw.get_code(lang)
+            for error in code.build_artifacts(hw):
+                self.logger.warning(error)
+        for queue in self.target_queues(hw.uuid):
+            for i in xrange(config.HOMEWORK_PREWARM_COPIES):
+                prewarm_homework.apply_async((hw.uuid, ), queue=queue)
+            self.logger.info('hwprewarm "%s": sent to queue %s.' %
+                             (hw.path, queue))
+
+    def scale(self, busy):
+        """Raise or restore the minimum pool size of the runners."""
+        if not config.RUNNER_AUTOSCALE or \
+                config.RUNNER_PREWARM_MIN_CONCURRENCY is None:
+            return
+        from railgun.runner.context import app
+
+        min_size = (config.RUNNER_PREWARM_MIN_CONCURRENCY if busy
+                    else config.RUNNER_AUTOSCALE_MIN)
+        min_size = min(min_size, config.RUNNER_AUTOSCALE_MAX)
+        app.control.autoscale(config.RUNNER_AUTOSCALE_MAX, min_size)
+        self.logger.info('runner pool: %d ~ %d processes.' %
+                         (min_size, config.RUNNER_AUTOSCALE_MAX))
+
+    def execute(self, hw_root_path, now=None):
+        try:
+            homeworks = HwSet(hw_root_path)
+            due = homeworks.get_due_within(config.HOMEWORK_PREWARM_AHEAD, now)
+            if not due:
+                self.logger.info('no homework is due soon.')
+            for hw in due:
+                try:
+                    self.prewarm(hw)
+                except Exception:
+                    self.logger.exception('Prewarm homework "%s" failed.' %
+                                          hw.path)
+            self.scale(bool(due))
+        except Exception:
+            self.logger.exception('Prewarm homework failed.')
+
+
+tasks.add('hwprewarm', HwPrewarmTask)
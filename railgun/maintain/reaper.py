@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# @file: railgun/maintain/reaper.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# This file is released under BSD 2-clause license.
+
+import redis
+
+import config
+from railgun.common.hw import HwSet
+from .base import Task, tasks
+
+
+#: The Redis hash counting the reaped submissions by the outcome
+#: (``requeued`` or ``rejected``).
+STATS_KEY = 'railgun.reaper'
+
+#: Seconds to remember how many times a submission has been reaped.
+RETRY_TTL = 24 * 3600
+
+
+def retry_key(handid):
+    """Get the Redis key counting how many times `handid` is reaped."""
+    return 'railgun.reaped.%s' % handid
+
+
+class HandinReapTask(Task):
+    """Task to find the `Running` submissions whose runners have died, i.e.,
+    whose leases have expired (see :mod:`railgun.runner.lease`).  It is
+    supposed to be executed by cron every few minutes on the website host.
+
+    Each of such submissions is put into the runner queue again, at most
+    ``config.HANDIN_REAP_RETRIES`` times, if its upload is stored.
+    Otherwise it is rejected, so that the user can submit again.  The
+    numbers of the submissions put back and rejected are logged, and added
+    to the Redis hash :data:`STATS_KEY`.
+    """
+
+    def reject(self, handin):
+        """Reject the submission whose runner has died."""
+        # We must not use flask.ext.babel.lazy_gettext, because we're going
+        # to store it in the database!
+        from railgun.common.lazy_i18n import lazy_gettext
+        from railgun.website.context import db
+        from railgun.website.models import Handin
+
+        # A late report of the runner may have finished the submission.
+        db.session.query(Handin) \
+            .filter(Handin.id == handin.id) \
+            .filter(Handin.state.in_(['Pending', 'Running'])) \
+            .update({
+                'state': 'Rejected',
+                'result': lazy_gettext('The runner of this submission has '
+                                       'stopped unexpectedly.'),
+                'partials': [],
+                'score': 0.0,
+            }, synchronize_session=False)
+        db.session.commit()
+
+    def reap(self, client, handin, homeworks):
+        """Put the submission into the runner queue again, or reject it.
+
+        :return: ``'requeued'`` or ``'rejected'``.
+        """
+        from railgun.website.codelang import languages
+
+        key = retry_key(handin.uuid)
+        retries = client.incr(key)
+        client.expire(key, RETRY_TTL)
+        hw = homeworks.get_by_uuid(handin.hwid)
+        if retries <= config.HANDIN_REAP_RETRIES and hw is not None and \
+                handin.lang in languages:
+            try:
+                if languages[handin.lang].rerun(handin.uuid, hw):
+                    return 'requeued'
+            except Exception:
+                # `rerun` has rejected the submission.
+                self.logger.exception(
+                    'Cannot put submission %s into the queue again.' %
+                    handin.uuid)
+                return 'rejected'
+        self.reject(handin)
+        return 'rejected'
+
+    def execute(self, hw_root_path):
+        from railgun.runner import runconfig
+        from railgun.runner.lease import live_leases
+        from railgun.website.context import app
+        from railgun.website.models import Handin
+
+        counts = {'requeued': 0, 'rejected': 0}
+        try:
+            client = redis.StrictRedis.from_url(runconfig.BROKER_URL)
+            with app.app_context():
+                running = Handin.query.filter(Handin.state == 'Running').all()
+                alive = live_leases([h.uuid for h in running], client)
+                stale = [h for h in running if h.uuid not in alive]
+                homeworks = HwSet(hw_root_path) if stale else None
+                for handin in stale:
+                    try:
+                        outcome = self.reap(client, handin, homeworks)
+                    except Exception:
+                        self.logger.exception(
+                            'Reap submission %s failed.' % handin.uuid)
+                        continue
+                    counts[outcome] += 1
+                    self.logger.warning(
+                        'handinreap: submission %s of homework %s is %s.' %
+                        (handin.uuid, handin.hwid, outcome))
+            for outcome, count in counts.iteritems():
+                if count:
+                    client.hincrby(STATS_KEY, outcome, count)
+            self.logger.info(
+                'handinreap: %d running, %d requeued, %d rejected.' %
+                (len(running), counts['requeued'], counts['rejected']))
+        except Exception:
+            self.logger.exception('Reap stale submissions failed.')
+        return counts
+
+
+tasks.add('handinreap', HandinReapTask)
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# @file: railgun/runner/affinity.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# This file is released under BSD 2-clause license.
+
+"""Route the submissions of a homework to the workers which are warm.
+
+A runner worker keeps some state of the homework it has run: the loaded
+homework set, the workspace templates, the preloaded interpreters and the
+compiled homework artifacts.  If any submission could go to any worker,
+every worker would have to warm every homework.
+
+So a worker may be started with a shard name (``runner.py default 3``),
+and then it consumes its own shard queue (``default.3``) besides the
+shared queue.  :class:`AffinityMembership` registers the shard queue in
+Redis while the worker is alive, and :class:`AffinityRouter` (enabled by
+``CELERY_ROUTES`` in :mod:`~railgun.runner.runconfig`) sends each
+submission to one of the ``config.RUNNER_AFFINITY_REPLICAS`` live shards
+chosen for the homework by consistent hashing, so adding or removing a
+worker only moves the homework of that worker.
+
+The shard with the fewest waiting messages among the chosen ones is used.
+If all of them have at least ``config.RUNNER_AFFINITY_SPILL`` waiting
+messages, the submission spills over to the shared queue, which is
+consumed by all the workers.  Without any live shard, all the submissions
+go to the shared queue as before.
+
+If a worker dies, nobody consumes its shard queue anymore.  So each worker
+moves the messages waiting in the shard queues which have expired back to
+the shared queue by :func:`drain_shards` on every heartbeat, and a worker
+stopping normally moves the messages of its own shard queue at once.
+"""
+
+import time
+import bisect
+import hashlib
+
+import redis
+from celery import bootsteps
+
+from . import runconfig
+from .context import logger
+from .priority import queue_keys
+
+
+#: The names of the tasks which run a submission, with the homework uuid as
+#: the second positional argument.
+SUBMISSION_TASKS = (
+    'railgun.runner.tasks.run_python',
+    'railgun.runner.tasks.run_java',
+    'railgun.runner.tasks.run_netapi',
+    'railgun.runner.tasks.run_input',
+)
+
+#: The separator between the shared queue name and the shard name.
+SHARD_SEP = '.'
+
+
+def shard_queue(queue, shard):
+    """Get the name of the queue of `shard`, e.g., ``default.3``."""
+    return '%s%s%s' % (queue, SHARD_SEP, shard)
+
+
+def members_key(queue):
+    """Get the Redis key of the live shard queues of `queue`."""
+    return 'railgun.affinity.%s' % queue
+
+
+def _hash(value):
+    return int(hashlib.md5(value).hexdigest()[:8], 16)
+
+
+class HashRing(object):
+    """A consistent hash ring of the nodes.
+
+    Each node is put onto the ring ``config.RUNNER_AFFINITY_VNODES`` times,
+    so the keys are evenly spread among the nodes.
+
+    :param nodes: The names of the nodes.
+    :type nodes: :class:`list` of :class:`str`
+    """
+
+    def __init__(self, nodes):
+        self.nodes = sorted(set(nodes))
+        ring = []
+        for node in self.nodes:
+            for i in xrange(runconfig.RUNNER_AFFINITY_VNODES):
+                ring.append((_hash('%s#%d' % (node, i)), node))
+        ring.sort()
+        self._hashes = [h for h, n in ring]
+        self._nodes = [n for h, n in ring]
+
+    def lookup(self, key, count=1):
+        """Get at most `count` distinct nodes for `key`, in the order of
+        preference.
+
+        :param key: The key to be placed.
+        :type key: :class:`str`
+        :param count: The number of nodes.
+        :type count: :class:`int`
+        :rtype: :class:`list` of :class:`str`
+        """
+        ret = []
+        if not self._nodes:
+            return ret
+        count = min(count, len(self.nodes))
+        start = bisect.bisect(self._hashes, _hash(key))
+        for i in xrange(len(self._nodes)):
+            node = self._nodes[(start + i) % len(self._nodes)]
+            if node not in ret:
+                ret.append(node)
+                if len(ret) >= count:
+                    break
+        return ret
+
+
+def live_shards(client, queue, now=None):
+    """Get the shard queues of `queue` whose workers are alive.
+
+    :param client: The Redis client.
+    :type client: :class:`redis.StrictRedis`
+    :param queue: The name of the shared queue.
+    :type queue: :class:`str`
+    """
+    now = now if now is not None else time.time()
+    return client.zrangebyscore(members_key(queue),
+                                now - runconfig.RUNNER_AFFINITY_EXPIRES,
+                                '+inf')
+
+
+def drain_queue(client, source, target):
+    """Move all the messages waiting in `source` to `target`, keeping
+    their priority lanes.
+
+    The messages are moved one by one by ``RPOPLPUSH``, so each message is
+    moved exactly once even if several workers drain the same queue.
+
+    :param client: The Redis client.
+    :type client: :class:`redis.StrictRedis`
+    :param source: The name of the queue to be drained.
+    :type source: :class:`str`
+    :param target: The name of the queue to receive the messages.
+    :type target: :class:`str`
+    :return: The number of moved messages.
+    """
+    moved = 0
+    for src, dst in zip(queue_keys(source), queue_keys(target)):
+        while client.rpoplpush(src, dst) is not None:
+            moved += 1
+    return moved
+
+
+def drain_shards(client, queue, now=None):
+    """Move the messages waiting in the expired shard queues of `queue`
+    back to `queue`.
+
+    The expired shard queues are never unregistered, because Kombu may
+    still restore the unacknowledged messages of a dead worker to its shard
+    queue long after the worker died.  The number of them is bounded by the
+    number of shard names ever used.
+
+    :param client: The Redis client.
+    :type client: :class:`redis.StrictRedis`
+    :param queue: The name of the shared queue.
+    :type queue: :class:`str`
+    :return: The number of moved messages.
+    """
+    now = now if now is not None else time.time()
+    cutoff = now - runconfig.RUNNER_AFFINITY_EXPIRES
+    moved = 0
+    for shard in client.zrangebyscore(members_key(queue), '-inf',
+                                      '(%r' % cutoff):
+        count = drain_queue(client, shard, queue)
+        if count:
+            logger.warning('Moved %d messages from the expired shard queue '
+                           '%s to %s.' % (count, shard, queue))
+        moved += count
+    return moved
+
+
+def homework_shards(client, queue, hwid):
+    """Get the live shard queues of `queue` chosen for `hwid`, in the
+    order of preference.
+
+    :param client: The Redis client.
+    :type client: :class:`redis.StrictRedis`
+    :param queue: The name of the shared queue.
+    :type queue: :class:`str`
+    :param hwid: The uuid of the homework.
+    :type hwid: :class:`str`
+    :rtype: :class:`list` of :class:`str`
+    """
+    ring = HashRing(live_shards(client, queue))
+    return ring.lookup(hwid, runconfig.RUNNER_AFFINITY_REPLICAS)
+
+
+def choose_queue(client, queue, hwid):
+    """Choose the queue for a submission of `hwid`.
+
+    :param client: The Redis client.
+    :type client: :class:`redis.StrictRedis`
+    :param queue: The name of the shared queue.
+    :type queue: :class:`str`
+    :param hwid: The uuid of the homework.
+    :type hwid: :class:`str`
+    :return: A shard queue, or `queue` if all the chosen shards are busy.
+    """
+    best, best_depth = queue, None
+    for shard in homework_shards(client, queue, hwid):
+        depth = sum(client.llen(k) for k in queue_keys(shard))
+        if depth < runconfig.RUNNER_AFFINITY_SPILL and \
+                (best_depth is None or depth < best_depth):
+            best, best_depth = shard, depth
+    return best
+
+
+class AffinityRouter(object):
+    """The Celery router to send the submissions to the shard queues.
+
+    Tasks other than :data:`SUBMISSION_TASKS` are left to the other routes.
+    """
+
+    def route_for_task(self, task, args=None, kwargs=None):
+        if task not in SUBMISSION_TASKS or not args or len(args) < 2:
+            return None
+        queue = runconfig.CELERY_DEFAULT_QUEUE
+        try:
+            client = redis.StrictRedis.from_url(runconfig.BROKER_URL)
+            return {'queue': choose_queue(client, queue, args[1])}
+        except Exception:
+            logger.exception('Cannot choose the shard queue of homework %s.'
+                             % args[1])
+            return {'queue': queue}
+
+
+class AffinityMembership(bootsteps.StartStopStep):
+    """The worker step to register the consumed shard queues as alive
+    every ``config.RUNNER_AFFINITY_HEARTBEAT`` seconds, and to expire them
+    when the worker stops.
+
+    Every worker, sharded or not, also drains the expired shard queues of
+    the consumed shared queues by :func:`drain_shards` at each heartbeat.
+    """
+
+    requires = ('Timer', )
+
+    def __init__(self, worker, **kwargs):
+        self.tref = None
+
+    def shards(self, worker):
+        """Get (shared queue, shard queue) consumed by `worker`."""
+        consumed = set(worker.app.amqp.queues.consume_from)
+        ret = []
+        for q in consumed:
+            base = q.rpartition(SHARD_SEP)[0]
+            if base in consumed:
+                ret.append((base, q))
+        return ret
+
+    def shared_queues(self, worker):
+        """Get the shared queues consumed by `worker`."""
+        shards = set(q for base, q in self.shards(worker))
+        return [q for q in worker.app.amqp.queues.consume_from
+                if q not in shards]
+
+    def start(self, worker):
+        self.beat(worker)
+        self.tref = worker.timer.call_repeatedly(
+            runconfig.RUNNER_AFFINITY_HEARTBEAT, self.beat, (worker, ),
+            priority=10)
+
+    def stop(self, worker):
+        if self.tref is not None:
+            self.tref.cancel()
+            self.tref = None
+        try:
+            client = redis.StrictRedis.from_url(runconfig.BROKER_URL)
+            for base, shard in self.shards(worker):
+                # Expire the shard queue instead of removing it, so that the
+                # messages restored to it later are drained by the other
+                # workers.
+                client.execute_command('ZADD', members_key(base), 0, shard)
+                drain_queue(client, shard, base)
+        except Exception:
+            logger.exception('Cannot unregister the shard queues.')
+
+    def beat(self, worker):
+        client = redis.StrictRedis.from_url(runconfig.BROKER_URL)
+        try:
+            for base, shard in self.shards(worker):
+                # The arguments of `zadd` differ among redis-py versions.
+                client.execute_command('ZADD', members_key(base),
+                                       time.time(), shard)
+        except Exception:
+            logger.exception('Cannot register the shard queues.')
+        try:
+            for queue in self.shared_queues(worker):
+                drain_shards(client, queue)
+        except Exception:
+            logger.exception('Cannot drain the expired shard queues.')
@@ -53,6 +53,8 @@ class ApiClient(object):
         :type payload: :class:`object`
 
         :return: The :class:`requests.Response` object.
+        :raises: :class:`requests.Timeout` if the website does not answer
+            in ``config.RUNNER_REPORT_TIMEOUT`` seconds.
         """
 
         payload = EncryptMessage(json.dumps(payload), self.key)
@@ -60,7 +62,8 @@ class ApiClient(object):
             self._get_url(action),
             data=payload,
             headers={'Content-Type': 'application/octet-stream'},
-            verify=False
+            verify=False,
+            timeout=runconfig.RUNNER_REPORT_TIMEOUT
         )
 
     def report(self, handid, hwscore):
@@ -84,9 +87,9 @@ class ApiClient(object):
         obj = {'uuid': handid}
         self.post('/handin/start/%s/' % handid, payload=obj)
 
-    def proclog(self, handid, exitcode, stdout, stderr):
-        """Store the process exitcode, standard output and standard error
-        output of the submission.
+    def proclog(self, handid, exitcode, stdout, stderr, usage=None):
+        """Store the process exitcode, standard output, standard error
+        output and resource usage of the submission.
 
         :param handid: The uuid of the submission.
         :type handid: :class:`str`
@@ -96,22 +99,28 @@ class ApiClient(object):
         :type stdout: :class:`str`
         :param stderr: The standard error output of the process.
         :type stderr: :class:`str`
+        :param usage: The resource usage of the processes.
+        :type usage: :class:`~railgun.common.osutil.ResourceUsage`
         """
         obj = {'uuid': handid, 'exitcode': exitcode, 'stdout': stdout,
-               'stderr': stderr}
+               'stderr': stderr,
+               'usage': usage.to_plain() if usage else None}
         self.post('/handin/proclog/%s/' % handid, payload=obj)
 
 
-def report_error(handid, err):
+def report_error(handid, err, usage=None):
     """Shortcut to report the error of a submission.
 
     :param handid: The uuid of the submission.
     :type handid: :class:`str`
     :param err: A runner error object holding the error message.
     :type err: :class:`~railgun.runner.errors.RunnerError`
+    :param usage: The resource usage of the processes, if any.
+    :type usage: :class:`~railgun.common.osutil.ResourceUsage`
     """
     api = ApiClient(runconfig.WEBSITE_API_BASEURL)
-    score = HwScore(False, result=err.message, compile_error=err.compile_error)
+    score = HwScore(False, result=err.message, compile_error=err.compile_error,
+                    usage=usage)
     api.report(handid, score)
 
 
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# @file: railgun/runner/autoscale.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# This file is released under BSD 2-clause license.
+
+"""Resize the pool of the runner queue by the load of the machine.
+
+A fixed ``config.RUNNER_CONCURRENTY`` either wastes the cores when few
+submissions come, or thrashes the machine during a deadline rush, since a
+Java submission takes much more memory than a Python one.  If
+``config.RUNNER_AUTOSCALE`` is enabled, `runner.py` starts the Celery
+worker with ``--autoscale``, and :class:`RunnerAutoscaler` decides the
+number of pool processes between ``config.RUNNER_AUTOSCALE_MIN`` and
+``config.RUNNER_AUTOSCALE_MAX`` from:
+
+*   the demand: the submissions reserved by the worker, plus the ones
+    waiting in the Redis queues consumed by the worker,
+*   the load average per CPU core,
+*   the available memory, and
+*   the free system accounts on the user host of the queue.
+
+The pool grows by one process each time the demand exceeds the pool, and
+the load and the memory are below the thresholds.  It shrinks by one
+process at once if the machine is overloaded, or after the demand has
+stayed below the pool for ``config.RUNNER_AUTOSCALE_SHRINK_DELAY``
+seconds.  The gap between the growing threshold and the overloading
+threshold, and the delay of shrinking, keep the pool from oscillating.
+"""
+
+import os
+import time
+import multiprocessing
+
+import redis
+from celery.worker.autoscale import Autoscaler
+
+from railgun.userhost.client import UserHostClient
+from . import runconfig
+from .context import logger
+from .priority import queue_keys
+
+
+class LoadSample(object):
+    """The state of the machine and the queue at one moment.
+
+    :param loadavg: The 1-minute load average per CPU core.
+    :type loadavg: :class:`float`
+    :param memory: The available memory in bytes.
+    :type memory: :class:`int`
+    :param demand: The number of submissions reserved or waiting.
+    :type demand: :class:`int`
+    :param accounts: The number of free system accounts, or :data:`None`
+        if not limited by a user host.
+    :type accounts: :class:`int`
+    """
+
+    def __init__(self, loadavg, memory, demand, accounts=None):
+        self.loadavg = loadavg
+        self.memory = memory
+        self.demand = demand
+        self.accounts = accounts
+
+    def __repr__(self):
+        return ('load %.2f/core, %d MB available, demand %d, '
+                'free accounts %s' % (self.loadavg, self.memory >> 20,
+                                      self.demand, self.accounts))
+
+
+class ConcurrencyController(object):
+    """Decide the size of the pool from :class:`LoadSample` objects.
+
+    :param min_size: Minimum number of processes.
+    :type min_size: :class:`int`
+    :param max_size: Maximum number of processes.
+    :type max_size: :class:`int`
+    """
+
+    def __init__(self, min_size, max_size):
+        self.min_size = min_size
+        self.max_size = max_size
+        # The time since when the demand has been below the pool size.
+        self._idle_since = None
+
+    def decide(self, size, sample, now=None):
+        """Decide the new size of the pool.
+
+        :param size: The current number of processes.
+        :type size: :class:`int`
+        :param sample: The current state.
+        :type sample: :class:`LoadSample`
+        :param now: The current :func:`time.time`.
+        :return: (new size, reason)
+        """
+        now = now if now is not None else time.time()
+        shrunk = max(self.min_size, size - 1)
+
+        # Leave the machine alone if it is overloaded.
+        if sample.memory < runconfig.RUNNER_AUTOSCALE_MEMORY_RESERVE:
+            self._idle_since = None
+            return shrunk, 'memory is low'
+        if sample.loadavg > runconfig.RUNNER_AUTOSCALE_LOAD_CRITICAL:
+            self._idle_since = None
+            return shrunk, 'machine is overloaded'
+
+        if sample.demand > size:
+            self._idle_since = None
+            if size >= self.max_size:
+                return size, 'pool is at maximum size'
+            if sample.accounts is not None and sample.accounts <= 0:
+                return size, 'no free system account'
+            if sample.loadavg > runconfig.RUNNER_AUTOSCALE_LOAD_HIGH:
+                return size, 'load is high'
+            if (sample.memory < runconfig.RUNNER_AUTOSCALE_MEMORY_RESERVE +
+                    runconfig.RUNNER_AUTOSCALE_PROCESS_MEMORY):
+                return size, 'not enough memory for one more process'
+            return size + 1, 'submissions are waiting'
+
+        if sample.demand < size and size > self.min_size:
+            if self._idle_since is None:
+                self._idle_since = now
+            if now - self._idle_since >= \
+                    runconfig.RUNNER_AUTOSCALE_SHRINK_DELAY:
+                self._idle_since = now
+                return shrunk, 'pool has been idle'
+            return size, 'pool is idle'
+
+        self._idle_since = None
+        return size, 'pool matches the demand'
+
+
+def available_memory():
+    """Get the available memory in bytes from ``/proc/meminfo``."""
+    fields = {}
+    with open('/proc/meminfo', 'rb') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2:
+                fields[parts[0].rstrip(':')] = int(parts[1]) * 1024
+    if 'MemAvailable' in fields:
+        return fields['MemAvailable']
+    # Kernels before 3.14 do not provide MemAvailable.
+    return (fields.get('MemFree', 0) + fields.get('Buffers', 0) +
+            fields.get('Cached', 0))
+
+
+def queue_depth(queues):
+    """Count the messages waiting in the Redis lists of all the priority
+    lanes of `queues`.
+
+    :param queues: The names of the queues.
+    :type queues: :class:`list` of :class:`str`
+    """
+    client = redis.StrictRedis.from_url(runconfig.BROKER_URL)
+    return sum(client.llen(k) for q in queues for k in queue_keys(q))
+
+
+def free_accounts(queues):
+    """Count the free system accounts for the submissions on `queues`.
+
+    :return: The number of accounts, or :data:`None` if no user host is
+        used.
+    """
+    userhost = (runconfig.ONLINE_USER_HOST if 'online' in queues
+                else runconfig.OFFLINE_USER_HOST)
+    if not userhost:
+        return None
+    return UserHostClient(userhost[0], userhost[1]).free()
+
+
+class RunnerAutoscaler(Autoscaler):
+    """The Celery autoscaler of the runner queue, enabled by
+    ``CELERYD_AUTOSCALER`` in :mod:`~railgun.runner.runconfig`.
+
+    Every decision is logged, and at most one decision is made in
+    ``config.RUNNER_AUTOSCALE_INTERVAL`` seconds.
+    """
+
+    def __init__(self, *args, **kwargs):
+        # The event loop of the worker calls us every `keepalive` seconds.
+        kwargs['keepalive'] = runconfig.RUNNER_AUTOSCALE_INTERVAL
+        super(RunnerAutoscaler, self).__init__(*args, **kwargs)
+        self.controller = ConcurrencyController(self.min_concurrency,
+                                                self.max_concurrency)
+        self._last_check = 0
+
+    @property
+    def queues(self):
+        """Names of the queues consumed by this worker."""
+        try:
+            return list(self.worker.app.amqp.queues.consume_from)
+        except Exception:
+            return [runconfig.CELERY_DEFAULT_QUEUE]
+
+    def sample(self):
+        """Take a :class:`LoadSample` of the machine and the queues."""
+        queues = self.queues
+        try:
+            waiting = queue_depth(queues)
+        except Exception:
+            logger.exception('Cannot get the length of queues %s.' % queues)
+            waiting = 0
+        try:
+            accounts = free_accounts(queues)
+        except Exception:
+            logger.exception('Cannot get the free system accounts.')
+            accounts = None
+        return LoadSample(
+            loadavg=os.getloadavg()[0] / multiprocessing.cpu_count(),
+            memory=available_memory(),
+            demand=self.qty + waiting,
+            accounts=accounts,
+        )
+
+    def _maybe_scale(self, req=None):
+        now = time.time()
+        if now - self._last_check < runconfig.RUNNER_AUTOSCALE_INTERVAL:
+            return
+        self._last_check = now
+
+        # The bounds may be changed by remote control commands.
+        self.controller.min_size = self.min_concurrency
+        self.controller.max_size = self.max_concurrency
+
+        procs = self.processes
+        sample = self.sample()
+        size, reason = self.controller.decide(procs, sample, now)
+        message = ('Autoscale: %(procs)d -> %(size)d processes, '
+                   '%(reason)s (%(sample)r).' %
+                   {'procs': procs, 'size': size, 'reason': reason,
+                    'sample': sample})
+        if size > procs:
+            logger.info(message)
+            self._grow(size - procs)
+        elif size < procs:
+            logger.info(message)
+            self._shrink(procs - size)
+        else:
+            logger.debug(message)
+            return
+        self._last_action = now
+        return True
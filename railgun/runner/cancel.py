@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# @file: railgun/runner/cancel.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# This file is released under BSD 2-clause license.
+
+"""Stop running the submissions nobody is waiting for.
+
+During a deadline rush, a student often uploads a fixed submission before
+the earlier one has been run, and only the newest one counts.  The website
+marks the older pending submissions of the same user and homework as
+rejected, and an administrator may cancel any pending or running
+submission.  In both cases the website calls :func:`cancel_handins`, which
+sets a flag for each submission in Redis, expiring after
+``config.RUNNER_CANCEL_TTL`` seconds.  The flag is cleared by
+:func:`uncancel_handins` when the submission is put into the queue again.
+
+:func:`~railgun.runner.tasks.run_handin` checks the flag before running a
+submission, and runs the submission under a :class:`CancelWatcher`, which
+checks the flag every ``config.RUNNER_CANCEL_POLL_INTERVAL`` seconds and
+kills the processes of the submission by
+:func:`~railgun.runner.sandbox.kill_sandboxes` once it is set.  The
+results of a cancelled submission are not reported, since the website has
+already rejected it.
+"""
+
+import threading
+
+import redis
+
+from . import runconfig
+from .context import logger
+from .sandbox import kill_sandboxes, release_sandboxes
+
+
+def cancel_key(handid):
+    """Get the Redis key of the cancellation flag of `handid`."""
+    return 'railgun.cancel.%s' % handid
+
+
+def cancel_handins(handids, client=None):
+    """Set the cancellation flags of the submissions.
+
+    :param handids: The uuid of the submissions.
+    :type handids: :class:`list` of :class:`str`
+    :param client: The Redis client, or :data:`None` to connect to
+        ``config.BROKER_URL``.
+    :type client: :class:`redis.StrictRedis`
+    """
+    if not handids:
+        return
+    client = client or redis.StrictRedis.from_url(runconfig.BROKER_URL)
+    pipe = client.pipeline()
+    for handid in handids:
+        pipe.setex(cancel_key(handid), runconfig.RUNNER_CANCEL_TTL, '1')
+    pipe.execute()
+
+
+def uncancel_handins(handids, client=None):
+    """Clear the cancellation flags of the submissions, so that they can
+    be run again.
+
+    :param handids: The uuid of the submissions.
+    :type handids: :class:`list` of :class:`str`
+    :param client: The Redis client, or :data:`None` to connect to
+        ``config.BROKER_URL``.
+    :type client: :class:`redis.StrictRedis`
+    """
+    if not handids:
+        return
+    client = client or redis.StrictRedis.from_url(runconfig.BROKER_URL)
+    client.delete(*[cancel_key(h) for h in handids])
+
+
+def is_cancelled(handid, client=None):
+    """Whether the submission `handid` has been cancelled?
+
+    Errors are logged, and the submission is regarded as not cancelled.
+
+    :param handid: The uuid of the submission.
+    :type handid: :class:`str`
+    :param client: The Redis client, or :data:`None` to connect to
+        ``config.BROKER_URL``.
+    :type client: :class:`redis.StrictRedis`
+    """
+    try:
+        client = client or redis.StrictRedis.from_url(runconfig.BROKER_URL)
+        return bool(client.exists(cancel_key(handid)))
+    except Exception:
+        logger.exception('Cannot check whether submission %s is cancelled.'
+                         % handid)
+        return False
+
+
+class CancelWatcher(object):
+    """Kill the processes of a submission once it is cancelled, while in
+    the ``with`` block.
+
+    :param handid: The uuid of the submission.
+    :type handid: :class:`str`
+    :param interval: Seconds between two checks, or :data:`None` to use
+        ``config.RUNNER_CANCEL_POLL_INTERVAL``.  The watcher does nothing
+        if it is zero.
+    :type interval: :class:`float`
+    :param client: The Redis client, or :data:`None` to connect to
+        ``config.BROKER_URL``.
+    :type client: :class:`redis.StrictRedis`
+    """
+
+    def __init__(self, handid, interval=None, client=None):
+        self.handid = handid
+        self.interval = (interval if interval is not None
+                         else runconfig.RUNNER_CANCEL_POLL_INTERVAL)
+        self.client = client
+        #: Whether the submission has been cancelled?
+        self.cancelled = False
+
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        if self.interval:
+            self._thread = threading.Thread(target=self._run,
+                                            name='CancelWatcher')
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def __exit__(self, ignore1, ignore2, ignore3):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        release_sandboxes(self.handid)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            if is_cancelled(self.handid, self.client):
+                logger.info('Submission %s is cancelled, killing its '
+                            'processes.' % self.handid)
+                self.cancelled = True
+                kill_sandboxes(self.handid)
+                return
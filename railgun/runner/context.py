@@ -21,6 +21,15 @@ from . import runconfig, permcheck
 app = Celery('railgun.runner')
 app.config_from_object(runconfig)
 
+# Move the waiting submissions towards the urgent lanes, so that they are
+# not starved (see :mod:`railgun.runner.priority`).  The step is given by
+# name to avoid importing `priority` before `app` is created.
+app.steps['worker'].add('railgun.runner.priority:LaneAging')
+
+# Register the shard queues consumed by this worker, so that the submissions
+# are routed to them (see :mod:`railgun.runner.affinity`).
+app.steps['worker'].add('railgun.runner.affinity:AffinityMembership')
+
 #: The default logger for this Celery application.  It is used everywhere
 #: in this package.  The interface is the same as :class:`logging.Logger`,
 #: so you may refer to :mod:`logging` for more details.
@@ -15,10 +15,18 @@ or just uses the ``config.OFFLINE_USER_ID`` and ``config.ONLINE_USER_ID``.
 
     Offline users will not be able to access the internet.  You must
     use the correct type of users for different submission types.
+
+A submission should hold its account through all the phases with a
+:class:`UserLease`, which is renewed in background until released.
 """
 
+import threading
+
 from railgun.userhost.client import UserHostClient
 from . import runconfig
+from .context import logger
+from .errors import SystemAccountLostError
+from .sandbox import kill_sandboxes
 
 
 def _acquire(userhost, expires):
@@ -29,7 +37,8 @@ def _acquire(userhost, expires):
     :param expires: Seconds for this user to expire.
     :type expires: :class:`int`
 
-    :return: The acquired user account name.
+    :return: (`user`, `token`), the acquired user account name and the
+        lease token.
     :raises: Various :class:`Exception` if the user cannot be acquired.
     """
     client = UserHostClient(userhost[0], userhost[1])
@@ -39,18 +48,20 @@ def _acquire(userhost, expires):
     return ret
 
 
-def _put(userhost, user):
+def _put(userhost, user, token):
     """Release a system account to user credential server.
 
     :param userhost: (`server`, `port`) of the user credential server.
     :type userhost: :class:`tuple`
     :param user: The name of acquired user.
     :type user: :class:`str`
+    :param token: The lease token of acquired user.
+    :type token: :class:`str`
 
     :raises: Various :class:`Exception` if the user cannot be released.
     """
     client = UserHostClient(userhost[0], userhost[1])
-    if not client.release(user):
+    if not client.release(user, token):
         raise RuntimeError('Could not release system account.')
 
 
@@ -59,24 +70,27 @@ def acquire_offline_user(expires=10):
 
     :param expires: Seconds for this user to expire.
     :type expires: :class:`int`
-    :return: The acquired user account name.
+    :return: (`user`, `token`), the acquired user account name and the
+        lease token (:data:`None` if no credential server is configured).
     :raises: Various :class:`Exception` if the user cannot be acquired.
     """
     if runconfig.OFFLINE_USER_HOST:
         return _acquire(runconfig.OFFLINE_USER_HOST, expires)
-    return runconfig.OFFLINE_USER_ID
+    return runconfig.OFFLINE_USER_ID, None
 
 
-def release_offline_user(user):
+def release_offline_user(user, token):
     """Release an offline system account.
     Will do nothing if on credential server is configured.
 
     :param user: The name of acquired user.
     :type user: :class:`str`
+    :param token: The lease token of acquired user.
+    :type token: :class:`str`
     :raises: Various :class:`Exception` if the user cannot be released.
     """
     if runconfig.OFFLINE_USER_HOST:
-        _put(runconfig.OFFLINE_USER_HOST, user)
+        _put(runconfig.OFFLINE_USER_HOST, user, token)
 
 
 def acquire_online_user(expires=10):
@@ -84,20 +98,155 @@ def acquire_online_user(expires=10):
 
     :param expires: Seconds for this user to expire.
     :type expires: :class:`int`
-    :return: The acquired user account name.
+    :return: (`user`, `token`), the acquired user account name and the
+        lease token (:data:`None` if no credential server is configured).
     :raises: Various :class:`Exception` if the user cannot be acquired."""
     if runconfig.ONLINE_USER_HOST:
         return _acquire(runconfig.ONLINE_USER_HOST, expires)
-    return runconfig.ONLINE_USER_ID
+    return runconfig.ONLINE_USER_ID, None
 
 
-def release_online_user(user):
+def release_online_user(user, token):
     """Release an online system account.
     Will do nothing if on credential server is configured.
 
     :param user: The name of acquired user.
     :type user: :class:`str`
+    :param token: The lease token of acquired user.
+    :type token: :class:`str`
     :raises: Various :class:`Exception` if the user cannot be released.
     """
     if runconfig.ONLINE_USER_HOST:
-        _put(runconfig.ONLINE_USER_HOST, user)
+        _put(runconfig.ONLINE_USER_HOST, user, token)
+
+
+def _renew(userhost, user, token, expires):
+    """Extend the lease of a system account on user credential server.
+
+    :param userhost: (`server`, `port`) of the user credential server.
+    :type userhost: :class:`tuple`
+    :param user: The name of acquired user.
+    :type user: :class:`str`
+    :param token: The lease token of acquired user.
+    :type token: :class:`str`
+    :param expires: Seconds from now for this user to expire.
+    :type expires: :class:`int`
+
+    :raises: Various :class:`Exception` if the lease cannot be renewed.
+    """
+    client = UserHostClient(userhost[0], userhost[1])
+    if not client.renew(user, token, expires):
+        raise RuntimeError('System account lease has expired.')
+
+
+class UserLease(object):
+    """A system account leased for all the phases of a submission.
+
+    The account is acquired once by :meth:`acquire`, and if a credential
+    server is configured, the lease is renewed every `expires` / 3 seconds
+    in a background thread, so that long runs will not lose the account.
+    A crashed runner holds the account for at most `expires` seconds.
+
+    If the lease cannot be renewed, the account may be given to another
+    submission, so the lease is marked :attr:`lost`, and the processes of
+    the submission `handid` are killed by
+    :func:`~railgun.runner.sandbox.kill_sandboxes`.  :meth:`check` then
+    fails the submission.
+
+    The lease can be used by the ``with`` statement::
+
+        with UserLease(offline=True) as lease:
+            host.set_user(lease.user)
+
+    :param offline: Whether to lease an offline system account?
+    :type offline: :class:`bool`
+    :param expires: Seconds for the lease to expire if not renewed.
+    :type expires: :class:`int`
+    :param handid: The uuid of the submission running in this account, or
+        :data:`None` if no process should be killed when the lease is lost.
+    :type handid: :class:`str`
+    """
+
+    def __init__(self, offline=True, expires=30, handid=None):
+        #: Whether this is an offline system account?
+        self.offline = offline
+        #: Seconds for the lease to expire if not renewed.
+        self.expires = expires
+        #: The uuid of the submission running in this account.
+        self.handid = handid
+        #: The acquired user account name, :data:`None` if not acquired.
+        self.user = None
+        #: The lease token of the account, given by the credential server.
+        self.token = None
+        #: Whether the lease could not be renewed?
+        self.lost = False
+        self._stopped = threading.Event()
+        self._renewer = None
+
+    @property
+    def userhost(self):
+        """(`server`, `port`) of the user credential server, or
+        :data:`None` if not configured."""
+        if self.offline:
+            return runconfig.OFFLINE_USER_HOST
+        return runconfig.ONLINE_USER_HOST
+
+    def acquire(self):
+        """Acquire the system account, and start renewing the lease.
+
+        :return: The acquired user account name.
+        :raises: Various :class:`Exception` if the user cannot be acquired.
+        """
+        if self.offline:
+            self.user, self.token = acquire_offline_user(self.expires)
+        else:
+            self.user, self.token = acquire_online_user(self.expires)
+        self.lost = False
+        if self.userhost and self.user:
+            self._stopped.clear()
+            self._renewer = threading.Thread(target=self._renew_loop)
+            self._renewer.daemon = True
+            self._renewer.start()
+        return self.user
+
+    def _renew_loop(self):
+        while not self._stopped.wait(self.expires / 3.0):
+            try:
+                _renew(self.userhost, self.user, self.token, self.expires)
+            except Exception:
+                logger.exception(
+                    'Cannot renew the lease of system account %s, killing '
+                    'submission %s.' % (self.user, self.handid))
+                self.lost = True
+                if self.handid is not None:
+                    kill_sandboxes(self.handid)
+                return
+
+    def check(self):
+        """Raise an error if the lease has been lost.
+
+        :raises: :class:`~railgun.runner.errors.SystemAccountLostError`
+        """
+        if self.lost:
+            raise SystemAccountLostError()
+
+    def release(self):
+        """Stop renewing the lease, and release the system account."""
+        if self._renewer is not None:
+            self._stopped.set()
+            self._renewer.join()
+            self._renewer = None
+        if self.user:
+            user, token = self.user, self.token
+            self.user = self.token = None
+            if self.offline:
+                release_offline_user(user, token)
+            else:
+                release_online_user(user, token)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, ignore1, ignore2, ignore3):
+        self.release()
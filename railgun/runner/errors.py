@@ -106,6 +106,18 @@ class ArchiveContainTooManyFileError(RunnerError):
         ), **kwargs)
 
 
+class ArchiveTooLargeError(RunnerError):
+    """The files in the submission archive are too large after extraction.
+    See ``config.MAX_SUBMISSION_UNCOMPRESSED_SIZE`` and
+    ``config.MAX_SUBMISSION_COMPRESSION_RATIO``.
+    """
+
+    def __init__(self, **kwargs):
+        super(ArchiveTooLargeError, self).__init__(lazy_gettext(
+            "Archive is too large after extraction."
+        ), **kwargs)
+
+
 class LanguageNotSupportError(RunnerError):
     """The submission language doesn't belong to corresponding homework.
 
@@ -156,6 +168,36 @@ class RunnerTimeout(RunnerError):
         ), **kwargs)
 
 
+class OutputLimitExceededError(RunnerError):
+    """The submission has produced too much output on stdout and stderr.
+    You may refer to :meth:`~railgun.runner.host.BaseHost.spawn`
+    of :class:`~railgun.runner.host.BaseHost` to see more details.
+
+    :param stdout: The truncated standard output of the process.
+    :type stdout: :class:`str`
+    :param stderr: The truncated standard error output of the process.
+    :type stderr: :class:`str`
+    """
+
+    def __init__(self, stdout=None, stderr=None, **kwargs):
+        super(OutputLimitExceededError, self).__init__(lazy_gettext(
+            'Your submission has produced too much output.'
+        ), **kwargs)
+        self.stdout = stdout
+        self.stderr = stderr
+
+
+class MemoryLimitExceededError(RunnerError):
+    """The submission has been killed for running out of memory.
+    You may refer to :mod:`railgun.runner.sandbox` to see more details.
+    """
+
+    def __init__(self, **kwargs):
+        super(MemoryLimitExceededError, self).__init__(lazy_gettext(
+            'Your submission has run out of memory.'
+        ), **kwargs)
+
+
 class NonUTF8OutputError(RunnerError):
     """The runner host produces invalid UTF-8 sequence.
     You should tell the students to encode their source code in UTF-8.
@@ -178,3 +220,29 @@ class NetApiAddressRejected(RunnerError):
         super(NetApiAddressRejected, self).__init__(lazy_gettext(
             'Given address is rejected.'
         ), **kwargs)
+
+
+class ScoreTamperedError(RunnerError):
+    """The submission has reported more than one score, or a malformed
+    score, through the Python zygote.
+    You may refer to :mod:`railgun.runner.zygote` for more details.
+    """
+
+    def __init__(self, **kwargs):
+        super(ScoreTamperedError, self).__init__(lazy_gettext(
+            'Your submission has tampered with the score report.'
+        ), **kwargs)
+
+
+class SystemAccountLostError(RunnerError):
+    """The lease of the system account running the submission could not be
+    renewed, so the account may have been given to another submission.
+    You may refer to :class:`~railgun.runner.credential.UserLease` for more
+    details.
+    """
+
+    def __init__(self, **kwargs):
+        super(SystemAccountLostError, self).__init__(lazy_gettext(
+            'The system account of your submission has been lost, please '
+            'submit again.'
+        ), **kwargs)
@@ -15,61 +15,17 @@ uploaded data (for example, extracting the archive files, or parsing
 the csv data), and prepares for the runner host.
 """
 
-import os
 import base64
 
 from . import runconfig
 
 from .errors import (InternalServerError, LanguageNotSupportError,
-                     ExtractFileFailure)
+                     ExtractFileFailure, ArchiveTooLargeError)
 from .host import PythonHost, NetApiHost, InputClassHost, JavaHost
-from railgun.common.fileutil import Extractor
+from railgun.common.fileutil import Extractor, ArchiveSizeExceeded
 import hw
 
 
-class TempDiskUploadFile(object):
-    """Decode base64 file content and save to disk as a temporary file.
-
-    The file will be placed under ``config.TEMPORARY_DIR``.  If you manage
-    the :class:`TempDiskUploadFile` via ``with`` statement, then the file
-    will be removed automatically.  For example::
-
-        with TempDiskUploadFile(upload, '%s.zip' % uuid) as tempFile:
-            os.system('7z x "%s"' % tempeFile.path)
-
-    :param upload: The base64 encoded file content.
-    :type upload: :class:`str`
-    :param fname: The temporary file name.  If the chosen file name exists,
-        it will be overwritten.
-    :type fname: :class:`str`
-    :param ignore_error: A :class:`bool` indicating whether we should ignore
-        system exceptions when we are trying to delete the temporary file?
-    :type ignore_error: :class:`bool`
-    """
-
-    def __init__(self, upload, fname, ignore_error=False):
-        #: Store the full path of this temporary file.
-        self.path = os.path.join(runconfig.TEMPORARY_DIR, fname)
-        #: The original base64 encoded file content.
-        self.upload = upload
-        #: Whether we should ignore the system exceptions when we are trying
-        #: to delete the temporary file?
-        self.ignore_error = ignore_error
-
-    def __enter__(self):
-        with open(self.path, 'wb') as f:
-            f.write(base64.b64decode(self.upload))
-        return self
-
-    def __exit__(self, ignore1, ignore2, ignore3):
-        try:
-            if os.path.isfile(self.path):
-                os.remove(self.path)
-        except Exception:
-            if not self.ignore_error:
-                raise
-
-
 class BaseHandin(object):
     """The basic interface of a submission handler.
 
@@ -111,10 +67,44 @@ class BaseHandin(object):
         self.upload = upload
         #: The extra options of this submission.
         self.options = options
+        #: The :class:`~railgun.common.osutil.ResourceUsage` of the host
+        #: processes, set by :meth:`execute`.
+        self.usage = None
+
+    def open_archive(self):
+        """Decode the uploaded archive file and open it in memory.
+
+        The archive format is recognized by the magic number of the file
+        content, or by the extension of ``options['filename']`` if the
+        magic number is unknown.  Only the archive formats which really
+        rely on disk files (e.g., rar) will be written to disk.
+
+        The uncompressed size of the archive is limited by
+        ``config.MAX_SUBMISSION_UNCOMPRESSED_SIZE`` and
+        ``config.MAX_SUBMISSION_COMPRESSION_RATIO``.
+
+        :return: An :class:`~railgun.common.fileutil.Extractor` object.
+        :raises: :class:`~railgun.runner.errors.ExtractFileFailure` if the
+            archive cannot be opened.
+        :raises: :class:`~railgun.runner.errors.ArchiveTooLargeError` if the
+            archive is too large after decompression.
+        """
+        try:
+            return Extractor.open_buffer(
+                base64.b64decode(self.upload),
+                self.options.get('filename'),
+                max_size=runconfig.MAX_SUBMISSION_UNCOMPRESSED_SIZE,
+                max_ratio=runconfig.MAX_SUBMISSION_COMPRESSION_RATIO,
+            )
+        except ArchiveSizeExceeded:
+            raise ArchiveTooLargeError()
+        except Exception:
+            raise ExtractFileFailure()
 
     def execute(self):
         """Run this submission and store the result.  Derived classes should
-        at least implement this.
+        at least implement this, and set :attr:`usage` to the usage of the
+        host.
 
         :return: A :class:`tuple` of (`exitcode`, `stdout`, `stderr`).
         """
@@ -140,20 +130,11 @@ class PythonHandin(BaseHandin):
 
     def execute(self):
         with PythonHost(self.handid, self.hw) as host:
-            # put uploaded file content onto disk and then open the archive
-            # this is because some Extractors may rely on disk files.
-            archive_fext = os.path.splitext(self.options['filename'])[1]
-            archive_file = '%s%s' % (self.handid, archive_fext)
-            with TempDiskUploadFile(self.upload, archive_file) as f:
-                try:
-                    print 'f.path ' + f.path
-                    extractor = Extractor.open(f.path)
-                except Exception:
-                    raise ExtractFileFailure()
+            self.usage = host.usage
+            with self.open_archive() as extractor:
                 host.prepare_hwcode()
                 host.extract_handin(extractor)
-                print 'white box'
-                return host.run()
+            return host.run()
 
 class JavaHandin(BaseHandin):
     """Java submission handler, derived from :class:`BaseHandin`.
@@ -174,20 +155,12 @@ class JavaHandin(BaseHandin):
 
     def execute(self):
         with JavaHost(self.handid, self.hw) as host:
-            # put uploaded file content onto disk and then open the archive
-            # this is because some Extractors may rely on disk files.
-            archive_fext = os.path.splitext(self.options['filename'])[1]
-            archive_file = '%s%s' % (self.handid, archive_fext)
-            with TempDiskUploadFile(self.upload, archive_file) as f:
-                try:
-                    print 'f.path ' + f.path
-                    extractor = Extractor.open(f.path)
-                except Exception:
-                    raise ExtractFileFailure()
+            self.usage = host.usage
+            with self.open_archive() as extractor:
                 host.prepare_hwcode()
                 host.extract_handin(extractor)
-                host.compile()
-                return host.run()
+            host.compile()
+            return host.run()
 
 class NetApiHandin(BaseHandin):
     """NetAPI submission handler, derived from :class:`BaseHandin`.
@@ -210,6 +183,7 @@ class NetApiHandin(BaseHandin):
 
     def execute(self):
         with NetApiHost(self.remote_addr, self.handid, self.hw) as host:
+            self.usage = host.usage
             host.prepare_hwcode()
             host.compile()
             return host.run()
@@ -234,7 +208,8 @@ class InputClassHandin(BaseHandin):
 
     def execute(self):
         with InputClassHost(self.handid, self.hw) as host:
+            self.usage = host.usage
             host.prepare_hwcode()
-            with open(os.path.join(host.tempdir.path, 'data.csv'), 'wb') as f:
-                f.write(self.upload)
+            # the file must be owned by the submission user like the others
+            host.tempdir.write_file('data.csv', self.upload)
             return host.run()
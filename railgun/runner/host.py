@@ -19,22 +19,27 @@ import os
 import re
 import pwd
 import grp
+import time
 import socket
 import urllib
 
 from railgun.common.hw import FileRules
 from railgun.common.lazy_i18n import lazy_gettext
-from railgun.common.fileutil import dirtree, remove_firstdir
-from railgun.common.osutil import ProcessTimeout, execute
-from railgun.common.tempdir import TempDir
+from railgun.common.fileutil import dirtree, ArchiveSizeExceeded
+from railgun.common.osutil import (ProcessTimeout, ProcessOutputExceeded,
+                                   ResourceUsage)
 from . import runconfig
 from .context import logger
-from .credential import (acquire_offline_user, release_offline_user,
-                         acquire_online_user, release_online_user)
+from .workspace import templates, workspaces
+from .zygote import zygotes
+from .javaservice import JavaService
+from .credential import UserLease
+from .sandbox import Sandbox, ResourceLimits, execute_sandboxed
 from .errors import (RunnerError, FileDenyError, RunnerTimeout,
                      NetApiAddressRejected, ExtractFileFailure,
                      RuntimeFileCopyFailure, SpawnProcessFailure,
-                     ArchiveContainTooManyFileError)
+                     ArchiveContainTooManyFileError, OutputLimitExceededError,
+                     ArchiveTooLargeError, RunnerPermissionError)
 
 
 class HostConfig(dict):
@@ -99,8 +104,9 @@ class BaseHost(object):
 
     def __init__(self, uuid, hw, lang):
         #: A :class:`~railgun.common.tempdir.TempDir`, whose directory name
-        #: is `uuid`.
-        self.tempdir = TempDir(uuid)
+        #: contains `uuid`.  It is managed by
+        #: :data:`~railgun.runner.workspace.workspaces`.
+        self.tempdir = workspaces.create(uuid)
 
         #: The uuid of the submission.
         self.uuid = uuid
@@ -122,6 +128,14 @@ class BaseHost(object):
         #: The :class:`HostConfig` for the process.
         self.config = HostConfig(handid=uuid, hwid=self.hw.uuid)
 
+        #: The maximum bytes of stdout and stderr the process may produce
+        #: (from :attr:`runner_params`).
+        output_limit = None
+        if self.runner_params is not None:
+            output_limit = self.runner_params.get('outputLimit')
+        self.output_limit = int(output_limit or
+                                runconfig.RUNNER_DEFAULT_OUTPUT_LIMIT)
+
         #: The acquired system account (name or uid).
         #:
         #: Railgun can be configured to run multiple submissions in
@@ -134,25 +148,114 @@ class BaseHost(object):
         #: instead.
         self.runner_user = None
 
+        #: Whether this host uses offline system accounts?
+        #: Offline system accounts will not be able to access the internet.
+        self.offline = True
+
+        #: The :class:`~railgun.runner.credential.UserLease` of the system
+        #: account, held through all the phases of this submission.
+        self.lease = None
+
+        #: The :class:`~railgun.common.osutil.ResourceUsage` of all the
+        #: processes spawned by :meth:`spawn`.
+        self.usage = ResourceUsage()
+
+        #: The :class:`~railgun.runner.sandbox.ResourceLimits` of each
+        #: process (from :attr:`runner_params`).
+        self.limits = ResourceLimits.from_runner_params(self.runner_params)
+
     def __enter__(self):
         #: We create the directory with mode 0777, while the owner is the owner
         #: of runner queue process.
         #: The permissions and the owner will be set to `config['user_id']`
-        #: until :meth:`spawn`.
-        self.tempdir.open(mode=0777)
+        #: by :meth:`own_tempdir` once the system account is known.
+        workspaces.open(self.tempdir, mode=0777)
         return self
 
     def __exit__(self, ignore1, ignore2, ignore3):
-        #: The temporary directory will be removed here.
-        self.tempdir.close()
+        # Whether succeeded or not, we must release the system account.
+        if self.lease is not None:
+            try:
+                self.lease.release()
+            except Exception:
+                logger.exception(
+                    'Cannot release system account %(user)s of submission '
+                    '%(handid)s.' % {'user': self.runner_user,
+                                     'handid': self.uuid}
+                )
+            self.lease = None
+        #: The temporary directory will be removed here, or by the reaper
+        #: thread of :data:`~railgun.runner.workspace.workspaces`.
+        workspaces.release(self.tempdir)
+
+    def calibrated_timeout(self, limit):
+        """Get the timeout derived from the running time of the reference
+        answer, if the homework has been calibrated by ``manage.py
+        calibrate``.
+
+        :param limit: The timeout limit in ``code.xml``.
+        :type limit: :class:`int`
+        :return: The timeout in seconds, never larger than `limit`.
+        """
+        try:
+            calibration = self.hwcode.get_calibration(self.hw.uuid)
+        except Exception:
+            logger.exception('Cannot load the calibration of %(hwcode)r.' %
+                             {'hwcode': self.hwcode})
+            calibration = None
+        if calibration is None:
+            return limit
+        return calibration.timeout(limit)
+
+    def acquire_user(self):
+        """Lease a free system account for this submission, if not leased
+        yet.
+
+        The account is held through all the phases (preparing, compiling
+        and running) of this submission, renewed automatically, and
+        released when the host exits.  So the working directory is given
+        to the account only once, and the account cannot be taken by other
+        submissions between the phases.
+
+        :raises: Various :class:`Exception` if the account cannot be
+            acquired.
+        """
+        if self.lease is None:
+            lease = UserLease(self.offline,
+                              runconfig.RUNNER_USER_LEASE_EXPIRES,
+                              handid=self.uuid)
+            lease.acquire()
+            self.lease = lease
+            self.set_user(lease.user)
+
+    def check_lease(self):
+        """Raise an error if the lease of the system account has been lost.
+
+        :raises: :class:`~railgun.runner.errors.SystemAccountLostError`
+        """
+        if self.lease is not None:
+            self.lease.check()
 
-    def spawn(self, cmdline, timeout=None):
+    def spawn(self, cmdline, timeout=None, executor=execute_sandboxed):
         """Spawn an external process to execute the given commands.
 
         If the owner user of current process (runner queue) is `root`,
-        and ``config['user_id']`` != 0, the owner of :attr:`tempdir`
-        will be changed to that user, and the file system mode will
-        be changed to 0700.
+        and ``config['user_id']`` != 0, the :attr:`tempdir` will be given
+        to that user by :meth:`own_tempdir`.
+
+        The process runs in a :class:`~railgun.runner.sandbox.Sandbox`
+        with :attr:`limits`, and the resource usage of the process is added
+        to :attr:`usage`.
+
+        Only the first ``config.RUNNER_OUTPUT_HEAD_SIZE`` and the last
+        ``config.RUNNER_OUTPUT_TAIL_SIZE`` bytes of stdout and stderr are
+        kept, and the process will be killed once it produces more than
+        :attr:`output_limit` bytes.  The kept output is then carried by the
+        raised :class:`~railgun.runner.errors.OutputLimitExceededError`.
+
+        If the lease of the system account is lost, the process is killed,
+        and :class:`~railgun.runner.errors.SystemAccountLostError` is
+        raised instead of any other error.
 
         :param cmdline: The command line to be executed.
         :type cmdline: :class:`str`
@@ -162,35 +265,66 @@ class BaseHost(object):
             If this argument is not given, ``config.RUNNER_DEFAULT_TIMEOUT``
             will be chosen as the timeout limit.
         :type timeout: :class:`float`
+        :param executor: The function to run `cmdline`, having the same
+            arguments as :func:`~railgun.runner.sandbox.execute_sandboxed`.
+            (e.g., :meth:`~railgun.runner.zygote.Zygote.execute`)
+
+        :return: A :class:`tuple` of (exitcode, stdout, stderr).
         """
 
+        start = time.time()
+        timeout = timeout or runconfig.RUNNER_DEFAULT_TIMEOUT
         try:
+            self.check_lease()
             # Before spawn the process, we've already known the process
-            # user.  And we'll try to chown & chmod if our runner queue
-            # runs at root privilege (otherwise we cannot change the
-            # owner user).
-            if os.getuid() == 0:
-                # If config['user_id'] is 0, runner_user must be None,
-                # where we shouldn't go any more.
-                if self.config['user_id'] != 0:
-                    self.tempdir.chown(
-                        self.config['user_id'],
-                        self.config['group_id'],
-                        True
-                    )
-                    self.tempdir.chmod(0700, True)
+            # user.  The files are usually owned by this user since their
+            # creation, so this does nothing unless the user has changed.
+            self.own_tempdir()
             # Now we can execute the host process safely!
             #print "dir : " + str(self.tempdir.path)
             #print "env : " + str(self.config.make_environ())
-            return execute(
-                cmdline,
-                timeout or runconfig.RUNNER_DEFAULT_TIMEOUT,
-                cwd=self.tempdir.path,
-                env=self.config.make_environ(),
-                close_fds=True
-            )
+            with Sandbox(self.uuid, self.limits, timeout) as sandbox:
+                try:
+                    result = executor(
+                        cmdline,
+                        timeout,
+                        output_limit=self.output_limit,
+                        head_size=runconfig.RUNNER_OUTPUT_HEAD_SIZE,
+                        tail_size=runconfig.RUNNER_OUTPUT_TAIL_SIZE,
+                        cwd=self.tempdir.path,
+                        env=self.config.make_environ(),
+                        close_fds=True,
+                        usage=self.usage,
+                        sandbox=sandbox
+                    )
+                except (ProcessTimeout, ProcessOutputExceeded):
+                    # A process swapping or killed near the memory limit
+                    # may look like a timeout.  Report the real reason.
+                    self.check_lease()
+                    sandbox.check()
+                    raise
+                except Exception:
+                    self.check_lease()
+                    raise
+                self.check_lease()
+                if result[0] != 0:
+                    sandbox.check()
+                return result
+        except RunnerError:
+            raise
         except ProcessTimeout:
             raise RunnerTimeout()
+        except ProcessOutputExceeded, ex:
+            logger.warning(
+                'Submission %(handid)s of homework %(hwid)s exceeded the '
+                'output limit.\n'
+                '  stdout: %(stdout)s\n'
+                '  stderr: %(stderr)s' %
+                {'hwid': self.hw.uuid, 'handid': self.uuid,
+                 'stdout': repr(ex.stdout), 'stderr': repr(ex.stderr)}
+            )
+            raise OutputLimitExceededError(stdout=ex.stdout,
+                                           stderr=ex.stderr)
         except Exception:
             logger.exception(
                 'Error when executing submission %(handid)s of homework '
@@ -198,6 +332,8 @@ class BaseHost(object):
                 {'hwid': self.hw.uuid, 'handid': self.uuid}
             )
             raise SpawnProcessFailure()
+        finally:
+            self.usage.wall += time.time() - start
 
     def set_user(self, uid, gid=None):
         """Set the user and the group in host config.
@@ -239,6 +375,46 @@ class BaseHost(object):
         self.config['user_id'] = uid
         self.config['group_id'] = gid
 
+        # Files written from now on will be owned by this user at creation.
+        self.own_tempdir()
+
+    def own_tempdir(self):
+        """Give :attr:`tempdir` to the system account in
+        ``config['user_id']``, with file system mode 0700.
+
+        We can only change the owner if our runner queue runs at root
+        privilege.  Entries created after this call are owned by the user
+        at creation, and the existing entries will be changed only if the
+        user is changed.
+
+        If ``config.RUNNER_CHECK_PERM`` is enabled, all the entries will be
+        verified to be owned by the user.
+
+        :raises: :class:`~railgun.runner.errors.RunnerPermissionError` if the
+            verification fails.
+        """
+        # If config['user_id'] is 0, runner_user must be None, where we
+        # shouldn't go any more.
+        if os.getuid() != 0 or self.config['user_id'] == 0:
+            return
+        # Hard linked template files must be kept unchanged.
+        skip_links = runconfig.RUNNER_WORKSPACE_LINK
+        self.tempdir.set_owner(
+            self.config['user_id'],
+            self.config['group_id'],
+            0700,
+            skip_links=skip_links
+        )
+        if runconfig.RUNNER_CHECK_PERM:
+            mismatched = self.tempdir.verify_owner(skip_links=skip_links)
+            if mismatched:
+                logger.error(
+                    'Files of submission %(handid)s are not owned by the '
+                    'system account: %(files)s.' %
+                    {'handid': self.uuid, 'files': ', '.join(mismatched)}
+                )
+                raise RunnerPermissionError()
+
     def compile(self):
         """Call to compile the submission.  Some programming language may
         skip this process.
@@ -256,8 +432,28 @@ class BaseHost(object):
         """Prepare the runner context by copying files from `hw/code` into
         :attr:`tempdir`.  This method should be called before
         :meth:`extract_handin`.
+
+        If ``config.RUNNER_WORKSPACE_TEMPLATE`` is enabled, the files are
+        cloned from a :class:`~railgun.runner.workspace.WorkspaceTemplate`
+        instead.  We fall back to copy the files if the template cannot
+        be built.
+
+        The system account is leased before the files are copied, so that
+        the files are owned by the account since their creation.
         """
+        self.acquire_user()
         try:
+            if runconfig.RUNNER_WORKSPACE_TEMPLATE:
+                try:
+                    template = templates.get(self.hw, self.hwcode)
+                except Exception:
+                    logger.exception(
+                        'Cannot build workspace template for homework '
+                        '%(hwid)s.' % {'hwid': self.hw.uuid}
+                    )
+                else:
+                    template.materialize(self.tempdir, mode=0777)
+                    return
             self.tempdir.copyfiles(
                 self.hwcode.path,
                 dirtree(self.hwcode.path),
@@ -283,27 +479,36 @@ class BaseHost(object):
         """
 
         try:
+            # Read the list of files in the archive only once.  The file
+            # count, the top-level directory analysis and the file rules
+            # below all work on this manifest.
+            #
+            # If the archive file contains only one top-level directory,
+            # it is likely that all the code files are placed under it.
+            # The manifest removes such directory from the paths, so that
+            # the files in it are extracted directly to :attr:`tempdir`.
+            manifest = archive.manifest()
+
             # We limit the count of files in an archive file, since too many
             # files may slow down the runner queue.
-            maxCount = runconfig.MAX_SUBMISSION_FILE_COUNT
-            if archive.countfiles(maxCount) > maxCount:
+            if len(manifest) > runconfig.MAX_SUBMISSION_FILE_COUNT:
                 raise ArchiveContainTooManyFileError()
 
-            # If the archive file contains only one top-level directory,
-            # it is likely that all the code files are placed under it.
-            #
-            # So we remove the top-level directory and extract the files
-            # in it directly to :attr:`tempdir`.
-            onedir = archive.onedir()
-            canonical_path = remove_firstdir if onedir else (lambda s: s)
-
             # Use the :class:`FileRules` to filter out unwanted files.
+            # The rules in HwCode take precedence, and the rules in Homework
+            # are only checked on the files not matched by HwCode.
+            paths = [m.path for m in manifest]
+            code_actions = dict(
+                self.hwcode.file_rules.classify(paths, default_action=-1)
+            )
+            hw_actions = dict(self.hw.file_rules.classify(
+                (p for p in paths if code_actions[p] == -1),
+                default_action=FileRules.LOCK
+            ))
+
             def should_skip(path):
-                path = canonical_path(path)
                 # First, check the rules in HwCode
-                action = self.hwcode.file_rules.get_action(
-                    path, default_action=-1
-                )
+                action = code_actions[path]
                 if action == FileRules.DENY:
                     raise FileDenyError(path)
                 if action == FileRules.ACCEPT:
@@ -313,18 +518,19 @@ class BaseHost(object):
                     # that rules in `hwcode` rejects this file.
                     return True
                 # Next, check the rules in Homework
-                action = self.hw.file_rules.get_action(
-                    path, default_action=FileRules.LOCK
-                )
+                action = hw_actions[path]
                 if action == FileRules.DENY:
                     raise FileDenyError(path)
                 return (action != FileRules.ACCEPT)
 
-            # Call utility to do the extraction.  Initial file mode is 0777,
-            # and we'll correct this problem in :meth:`spawn`
+            # Call utility to do the extraction.  Initial file mode is 0777
+            # if the system account is not known yet, and we'll correct this
+            # problem in :meth:`own_tempdir`
             self.tempdir.extract(archive, should_skip, mode=0777)
         except RunnerError:
             raise
+        except ArchiveSizeExceeded:
+            raise ArchiveTooLargeError()
         except Exception:
             logger.exception(
                 'Cannot extract archive into tempdir for homework %(hwid)s '
@@ -384,8 +590,12 @@ class PythonHost(BaseHost):
 
         #: The timeout limit of this submission
         #: (from :attr:`BaseHost.runner_params`).
-        self.timeout = int(self.runner_params.get('timeout') or
-                           runconfig.RUNNER_DEFAULT_TIMEOUT)
+        self.timeout_limit = int(self.runner_params.get('timeout') or
+                                 runconfig.RUNNER_DEFAULT_TIMEOUT)
+
+        #: The timeout of this submission, calibrated by the reference
+        #: answer if possible (see :meth:`calibrated_timeout`).
+        self.timeout = self.calibrated_timeout(self.timeout_limit)
 
         #: The parent directory of :attr:`entry` file.
         self.entry_path = os.path.join(self.tempdir.path, self.entry)
@@ -393,31 +603,21 @@ class PythonHost(BaseHost):
 
     def run(self):
         """Run this Python submission."""
-        try:
-            # Get a free system account.
-            #
-            # Note that we'll keep the process running for at most `timeout`
-            # seconds (with a 1~2 second error), so we hold the system
-            # account for at most such a long time.
-            expires = self.timeout + 2
-            if self.offline:
-                user_login = acquire_offline_user(expires)
-            else:
-                user_login = acquire_online_user(expires)
-            self.set_user(user_login)
-
-            print "score : " + str(self.entry_path)
-            return self.spawn(
-                '"%s" "%s"' % (self.safe_runner, self.entry_path),
-                self.timeout
-            )
-        finally:
-            # Whether succeeded or not, we must release the system account.
-            if self.runner_user:
-                if self.offline:
-                    release_offline_user(self.runner_user)
-                else:
-                    release_online_user(self.runner_user)
+        # The system account is leased once for all the phases.
+        self.acquire_user()
+
+        print "score : " + str(self.entry_path)
+        # Fork the submission from a preloaded zygote if possible.
+        zygote = None
+        if runconfig.RUNNER_PYTHON_ZYGOTE:
+            zygote = zygotes.get(self)
+        if zygote is not None:
+            return self.spawn(self.entry_path, self.timeout,
+                              executor=zygote.execute)
+        return self.spawn(
+            '"%s" "%s"' % (self.safe_runner, self.entry_path),
+            self.timeout
+        )
 
 class JavaHost(BaseHost):
     """The Java runner host, derived from :class:`BaseHost`.
@@ -469,71 +669,80 @@ class JavaHost(BaseHost):
 
         #: The timeout limit of this submission
         #: (from :attr:`BaseHost.runner_params`).
-        self.timeout = int(self.runner_params.get('timeout') or
-                           runconfig.RUNNER_DEFAULT_TIMEOUT)
+        self.timeout_limit = int(self.runner_params.get('timeout') or
+                                 runconfig.RUNNER_DEFAULT_TIMEOUT)
+
+        #: The timeout of this submission, calibrated by the reference
+        #: answer if possible (see :meth:`calibrated_timeout`).
+        self.timeout = self.calibrated_timeout(self.timeout_limit)
 
         #: The parent directory of :attr:`entry` file.
         self.entry_path = os.path.join(self.tempdir.path, self.entry)
+
+        #: The request to build this submission in the Java host service
+        #: (from :attr:`BaseHost.compiler_params`), or :data:`None` if the
+        #: homework does not declare `buildDir`.
+        self.build_request = None
+        if self.compiler_params is not None and \
+                self.compiler_params.get('buildDir'):
+            params = self.compiler_params
+            self.build_request = {
+                'buildDir': params.get('buildDir'),
+                'sources': params.get('sources'),
+                'checkstyle': params.get('checkstyle'),
+                'checkstyleConfig': (
+                    params.get('checkstyleConfig') or
+                    runconfig.RUNNER_JAVA_SERVICE_CHECKSTYLE_CONFIG
+                ),
+                'exportClasses': params.get('exportClasses'),
+            }
+            # Compile only the student sources against the homework classes
+            # precompiled by the homework cache task, if available.
+            artifacts = self.hwcode.get_artifacts(self.hw.uuid)
+            if artifacts is not None:
+                self.build_request['classesJar'] = artifacts.jar
         #print "nnnnnnnnnnnnnnnnnnnnnnnnnnnnnnnnnnnnnnnnnnnnnnnn : " + self.entry_path
 
     def compile(self):
         """Compile this Java submission."""
-        try:
-            # Get a free system account.
-            #
-            # Note that we'll keep the process running for at most `timeout`
-            # seconds (with a 1~2 second error), so we hold the system
-            # account for at most such a long time.
-            expires = self.timeout + 2
-            if self.offline:
-                user_login = acquire_offline_user(expires)
-            else:
-                user_login = acquire_online_user(expires)
-            self.set_user(user_login)
-
-            #print 'cd %s && %s %s' % (self.tempdir.path, "javac", "HelloWorld.java")
-            return self.spawn(
-                'sh compile.sh',
-                self.timeout + 100
-            )
-        finally:
-            # Whether succeeded or not, we must release the system account.
-            if self.runner_user:
-                if self.offline:
-                    release_offline_user(self.runner_user)
-                else:
-                    release_online_user(self.runner_user)
+        # The system account is leased once for all the phases.
+        self.acquire_user()
+
+        # Build in a Java host service of this account if possible.
+        if runconfig.RUNNER_JAVA_SERVICE and self.build_request:
+            service = JavaService(self.config['user_id'],
+                                  self.config['group_id'])
+            try:
+                return self.spawn(self.build_request, self.timeout + 100,
+                                  executor=service.execute)
+            except SpawnProcessFailure:
+                if not service.start_failed:
+                    raise
+                logger.warning(
+                    'Cannot start Java host service for submission '
+                    '%(handid)s, falling back to compile.sh.' %
+                    {'handid': self.uuid}
+                )
+
+        #print 'cd %s && %s %s' % (self.tempdir.path, "javac", "HelloWorld.java")
+        return self.spawn(
+            'sh compile.sh',
+            self.timeout + 100
+        )
 
     def run(self):
         """Run this Java submission."""
         #self.compile();
-        try:
-            # Get a free system account.
-            #
-            # Note that we'll keep the process running for at most `timeout`
-            # seconds (with a 1~2 second error), so we hold the system
-            # account for at most such a long time.
-            expires = self.timeout + 2
-            if self.offline:
-                user_login = acquire_offline_user(expires)
-            else:
-                user_login = acquire_online_user(expires)
-            self.set_user(user_login)
-
-            #print 'cd %s && %s %s' % (self.tempdir.path, "java", "HelloWorld")
-            return self.spawn(
-                #'"%s" "%s"' % ("java", self.entry_path.split('.')[0]),
-                #'sh run.sh',
-                '"%s" "%s" "%s" "%s"' % (self.safe_runner, self.entry_path, self.tempdir.path, self.config.make_environ()),
-                self.timeout
-            )
-        finally:
-            # Whether succeeded or not, we must release the system account.
-            if self.runner_user:
-                if self.offline:
-                    release_offline_user(self.runner_user)
-                else:
-                    release_online_user(self.runner_user)
+        # The system account is leased once for all the phases.
+        self.acquire_user()
+
+        #print 'cd %s && %s %s' % (self.tempdir.path, "java", "HelloWorld")
+        return self.spawn(
+            #'"%s" "%s"' % ("java", self.entry_path.split('.')[0]),
+            #'sh run.sh',
+            '"%s" "%s" "%s" "%s"' % (self.safe_runner, self.entry_path, self.tempdir.path, self.config.make_environ()),
+            self.timeout
+        )
 
 
 class NetApiHost(PythonHost):
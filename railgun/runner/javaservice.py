@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# @file: railgun/runner/javaservice.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# This file is released under BSD 2-clause license.
+
+"""Build and test Java submissions in a single JVM.
+
+The `compile.sh` of a Java homework starts ant, javac, JUnit with JaCoCo
+and Checkstyle, each in a cold JVM.  If ``config.RUNNER_JAVA_SERVICE`` is
+enabled, :class:`~railgun.runner.host.JavaHost` sends the build to a
+`JavaHostService` (see ``runlib/java/javahost``) instead, which compiles
+the submission in-process and runs the tests in a fresh class loader.
+
+The tests of the submission run in the service JVM, so a service never
+outlives the build it serves: it is started in the
+:class:`~railgun.runner.sandbox.Sandbox` of the build, under the system
+account leased to the submission, and killed once the build finishes.
+Its resource usage is added to the submission like any other process.
+The service also denies the submission classes to replace the standard
+streams or the security manager, to suppress the access checks of
+reflection, and to write to the standard file descriptors, so they cannot
+forge the reply of the service.
+
+The build is described by the ``<compiler>`` node of ``code.xml``:
+
+.. code-block:: xml
+
+    <compiler version="2.7" buildDir="coverage" sources="insertTest.java"
+              checkstyle="insertTest.java" />
+
+If `buildDir` is not given, or the service cannot be started, the runner
+falls back to `compile.sh`.
+"""
+
+import os
+import json
+import errno
+import select
+import subprocess
+
+from railgun.common.osutil import (ProcessTimeout, ProcessOutputExceeded,
+                                   OutputBuffer, ResourceUsage,
+                                   kill_process_group)
+from . import runconfig
+
+
+#: Maximum seconds to wait for a service to start.
+SERVICE_START_TIMEOUT = 30
+
+
+class JavaServiceError(Exception):
+    """The Java host service is not working."""
+
+
+class JavaService(object):
+    """Manage a `JavaHostService` process running under a system account,
+    serving a single build by :meth:`execute`.
+
+    :param uid: The user id of the service, or 0 to keep the current user.
+    :type uid: :class:`int`
+    :param gid: The group id of the service, or 0 to keep the current group.
+    :type gid: :class:`int`
+    """
+
+    def __init__(self, uid, gid):
+        self.uid = uid
+        self.gid = gid
+        self.proc = None
+        #: Whether the service could not be started by :meth:`execute`?
+        self.start_failed = False
+        self._sandbox = None
+
+    def _preexec(self):
+        os.setsid()
+        # Enter the sandbox while we are still privileged.
+        if self._sandbox is not None:
+            self._sandbox.enter()
+        if os.getuid() == 0 and (self.uid or self.gid):
+            os.setgroups([])
+        if self.gid:
+            os.setgid(self.gid)
+        if self.uid:
+            os.setuid(self.uid)
+
+    def start(self, sandbox=None):
+        """Start the service and wait until it is ready.
+
+        :param sandbox: The :class:`~railgun.runner.sandbox.Sandbox` to
+            run the service, or :data:`None` to run without limits.
+        :raises: :class:`JavaServiceError` if the service cannot be started.
+        """
+        self._sandbox = sandbox
+        self.proc = subprocess.Popen(
+            [runconfig.RUNNER_JAVA_SERVICE_JVM, '-cp',
+             os.path.pathsep.join(runconfig.RUNNER_JAVA_SERVICE_CLASSPATH),
+             'railgun.javahost.Service'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            preexec_fn=self._preexec,
+            cwd='/',
+            close_fds=True
+        )
+        if sandbox is not None:
+            sandbox.attach(self.proc)
+        try:
+            msg = self.recv(SERVICE_START_TIMEOUT)
+            if not msg or not msg.get('ready'):
+                raise JavaServiceError('Java host service is not ready.')
+        except Exception:
+            self.stop()
+            raise
+
+    def stop(self, usage=None):
+        """Kill the service and all the processes it has started.
+
+        :param usage: The :class:`~railgun.common.osutil.ResourceUsage` to
+            add the resource usage of the service to.
+        """
+        if self.proc is not None:
+            proc, self.proc = self.proc, None
+            kill_process_group(proc.pid)
+            while True:
+                try:
+                    pid, status, rusage = os.wait4(proc.pid, 0)
+                    break
+                except OSError, ex:
+                    if ex.errno != errno.EINTR:
+                        raise
+            proc._handle_exitstatus(status)
+            proc.stdin.close()
+            proc.stdout.close()
+            if usage is not None:
+                usage.add(ResourceUsage.from_rusage(rusage))
+
+    def alive(self):
+        """Whether the service is running?"""
+        return self.proc is not None and self.proc.poll() is None
+
+    def send(self, request):
+        """Send a build request to the service.
+
+        The request is framed as one ``key<TAB>value`` line for each item,
+        terminated by an empty line.  The items whose value is :data:`None`
+        are omitted, and the other values are encoded in UTF-8.
+
+        :param request: The build parameters.
+        :type request: :class:`dict`
+        :raises: :class:`ValueError` if a value contains a tab or a line
+            break, which would break the framing.
+        """
+        lines = []
+        for k, v in request.iteritems():
+            if v is None:
+                continue
+            v = unicode(v).encode('utf-8')
+            if '\t' in v or '\n' in v or '\r' in v:
+                raise ValueError('Invalid request value %r.' % v)
+            lines.append('%s\t%s\n' % (k, v))
+        self.proc.stdin.write(''.join(lines) + '\n')
+        self.proc.stdin.flush()
+
+    def recv(self, timeout=None):
+        """Receive a reply from the service.
+
+        :param timeout: Seconds to wait, or :data:`None` to wait forever.
+        :return: The reply object, or :data:`None` if timeout.
+        :raises: :class:`JavaServiceError` if the service has exited.
+        """
+        if timeout is not None:
+            ready = select.select([self.proc.stdout], [], [], timeout)[0]
+            if not ready:
+                return None
+        line = self.proc.stdout.readline()
+        if not line:
+            raise JavaServiceError('Java host service has exited.')
+        msg = json.loads(line)
+        if 'error' in msg:
+            raise JavaServiceError(msg['error'])
+        return msg
+
+    def execute(self, request, timeout=None, output_limit=None,
+                head_size=None, tail_size=None, cwd=None, usage=None,
+                sandbox=None, **kwargs):
+        """Start the service in `sandbox`, build the submission in `cwd`,
+        and stop the service.  The arguments are the same as
+        :func:`~railgun.runner.sandbox.execute_sandboxed`, except that
+        `request` is a :class:`dict` of the build parameters.
+
+        :return: (exit code, stdout, stderr)
+        :raises: :class:`JavaServiceError` if the service cannot be started,
+            and :attr:`start_failed` is set.
+        :raises: :class:`~railgun.common.osutil.ProcessTimeout` if a timeout
+            was reached.
+        :raises: :class:`~railgun.common.osutil.ProcessOutputExceeded` if the
+            output limit was reached.
+        """
+        request = dict(request)
+        request['workdir'] = cwd
+        request['outputLimit'] = output_limit or 0
+        try:
+            try:
+                self.start(sandbox)
+            except Exception:
+                self.start_failed = True
+                raise
+            self.send(request)
+            msg = self.recv(timeout)
+        finally:
+            self.stop(usage)
+        if msg is None:
+            raise ProcessTimeout('Process timeout has been reached.')
+
+        buffers = (OutputBuffer(head_size, tail_size),
+                   OutputBuffer(head_size, tail_size))
+        buffers[0].write(msg['stdout'].encode('utf-8'))
+        buffers[1].write(msg['stderr'].encode('utf-8'))
+        stdout, stderr = buffers[0].getvalue(), buffers[1].getvalue()
+        if msg['outputExceeded']:
+            raise ProcessOutputExceeded('Process output limit has been '
+                                        'reached.', stdout, stderr)
+        return msg['exitcode'], stdout, stderr
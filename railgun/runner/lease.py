@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# @file: railgun/runner/lease.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# This file is released under BSD 2-clause license.
+
+"""Tell the website which running submissions still have a runner.
+
+If a runner process dies while running a submission (killed for running
+out of memory, or the machine reboots), nobody reports the result, and the
+submission stays `Running` forever, blocking further uploads of the user
+by ``config.MAX_USER_PENDING_PER_HW``.
+
+So :func:`~railgun.runner.tasks.run_handin` holds a lease of each
+submission in Redis by a :class:`HandinLease`: a key expiring after
+``config.RUNNER_LEASE_TTL`` seconds, touched every
+``config.RUNNER_LEASE_HEARTBEAT`` seconds while the submission runs.  The
+lease is taken before the start of the submission is reported, and is
+renewed until :data:`~railgun.runner.pipeline.reports` has sent the result
+and calls :meth:`HandinLease.release`.  A `Running` submission without a lease has lost its runner, and
+is run again or rejected by :class:`~railgun.maintain.reaper.HandinReapTask`.
+"""
+
+import threading
+
+import redis
+
+from . import runconfig
+from .context import logger
+
+
+def lease_key(handid):
+    """Get the Redis key of the lease of `handid`."""
+    return 'railgun.lease.%s' % handid
+
+
+def touch_lease(handid, client=None):
+    """Take or renew the lease of `handid` for ``config.RUNNER_LEASE_TTL``
+    seconds.
+
+    :param handid: The uuid of the submission.
+    :type handid: :class:`str`
+    :param client: The Redis client, or :data:`None` to connect to
+        ``config.BROKER_URL``.
+    :type client: :class:`redis.StrictRedis`
+    """
+    client = client or redis.StrictRedis.from_url(runconfig.BROKER_URL)
+    client.setex(lease_key(handid), runconfig.RUNNER_LEASE_TTL, '1')
+
+
+def release_lease(handid, client=None):
+    """Release the lease of `handid`.
+
+    :param handid: The uuid of the submission.
+    :type handid: :class:`str`
+    :param client: The Redis client, or :data:`None` to connect to
+        ``config.BROKER_URL``.
+    :type client: :class:`redis.StrictRedis`
+    """
+    client = client or redis.StrictRedis.from_url(runconfig.BROKER_URL)
+    client.delete(lease_key(handid))
+
+
+def live_leases(handids, client=None):
+    """Get the submissions among `handids` whose leases have not expired.
+
+    :param handids: The uuid of the submissions.
+    :type handids: :class:`list` of :class:`str`
+    :param client: The Redis client, or :data:`None` to connect to
+        ``config.BROKER_URL``.
+    :type client: :class:`redis.StrictRedis`
+    :rtype: :class:`set` of :class:`str`
+    """
+    handids = list(handids)
+    if not handids:
+        return set()
+    client = client or redis.StrictRedis.from_url(runconfig.BROKER_URL)
+    pipe = client.pipeline()
+    for handid in handids:
+        pipe.exists(lease_key(handid))
+    return set(h for h, alive in zip(handids, pipe.execute()) if alive)
+
+
+class HandinLease(object):
+    """Hold the lease of a submission between :meth:`start` and
+    :meth:`stop`, or in the ``with`` block.
+
+    Errors of Redis are logged but never raised, so that a broken Redis
+    does not stop the submissions from running.
+
+    :param handid: The uuid of the submission.
+    :type handid: :class:`str`
+    :param interval: Seconds between two heartbeats, or :data:`None` to
+        use ``config.RUNNER_LEASE_HEARTBEAT``.
+    :type interval: :class:`float`
+    :param client: The Redis client, or :data:`None` to connect to
+        ``config.BROKER_URL``.
+    :type client: :class:`redis.StrictRedis`
+    """
+
+    def __init__(self, handid, interval=None, client=None):
+        self.handid = handid
+        self.interval = (interval if interval is not None
+                         else runconfig.RUNNER_LEASE_HEARTBEAT)
+        self.client = client
+
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, ignore1, ignore2, ignore3):
+        self.stop()
+
+    def start(self):
+        """Take the lease, and renew it in a background thread."""
+        self.beat()
+        self._thread = threading.Thread(target=self._run,
+                                        name='HandinLease')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop renewing the lease.  The lease expires after
+        ``config.RUNNER_LEASE_TTL`` seconds unless released.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def release(self):
+        """Stop renewing the lease, and release it.  Submitted to
+        :data:`~railgun.runner.pipeline.reports` after the reports of the
+        submission, so that the lease is held until they are sent.
+        """
+        self.stop()
+        release_lease(self.handid, self.client)
+
+    def beat(self):
+        """Renew the lease once."""
+        try:
+            touch_lease(self.handid, self.client)
+        except Exception:
+            logger.exception('Cannot renew the lease of submission %s.' %
+                             self.handid)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.beat()
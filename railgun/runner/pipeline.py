@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# @file: railgun/runner/pipeline.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# This file is released under BSD 2-clause license.
+
+"""Overlap the reports of the submissions with the execution of others.
+
+:func:`~railgun.runner.tasks.run_handin` runs a submission in stages: it
+reports the start to the website, prepares the working directory, runs
+the processes, reports the score and the process log, and removes the
+working directory.  Only the processes use the CPU; the reports are HTTP
+requests waiting for the website, during which the runner process could
+have started the next submission.
+
+The working directories are already removed in background by
+:data:`~railgun.runner.workspace.workspaces`.  This module does the same
+for the reports: :data:`reports` sends them from a background thread of
+each runner process, in the order they are submitted, so the start, the
+score and the process log of one submission never overtake each other.
+At most ``config.RUNNER_REPORT_QUEUE_DEPTH`` reports may wait, after which
+the runner blocks until one is sent, so the memory taken by the waiting
+outputs stays bounded.  The waiting reports are flushed when the runner
+process exits.
+"""
+
+import os
+import time
+import Queue
+import threading
+
+from celery.signals import worker_process_shutdown
+
+from . import runconfig
+from .context import logger
+
+
+#: Seconds to wait before retrying a failed report, doubled on each retry.
+RETRY_DELAY = 1.0
+
+#: Maximum seconds to wait for the reports when the runner process exits.
+FLUSH_TIMEOUT = 30
+
+
+class ReportPipeline(object):
+    """Send the reports of submissions in a background thread.
+
+    :param depth: Maximum number of waiting reports.
+    :type depth: :class:`int`
+    :param retries: How many times to retry a failed report.
+    :type retries: :class:`int`
+    :param async_report: Whether or not to send the reports in background?
+        If :data:`False`, :meth:`submit` sends the report at once.
+    :type async_report: :class:`bool`
+    """
+
+    def __init__(self, depth, retries=0, async_report=True):
+        #: Maximum number of waiting reports.
+        self.depth = depth
+        #: How many times to retry a failed report.
+        self.retries = retries
+        #: Whether to send the reports in background?
+        self.async_report = async_report
+
+        self._lock = threading.Lock()
+        self._queue = Queue.Queue(maxsize=depth)
+        self._sender = None
+        self._sender_pid = None
+
+    def submit(self, func, *args):
+        """Call `func` with `args` to send a report.
+
+        If the pipeline is full, wait until a report has been sent.
+        Errors of `func` are retried and logged, but never raised.
+
+        :param func: The reporting method, e.g.,
+            :meth:`~railgun.runner.apiclient.ApiClient.report`.
+        """
+        if not self.async_report:
+            self._send(func, args)
+            return
+        self._start_sender()
+        self._queue.put((func, args))
+
+    def flush(self, timeout=None):
+        """Wait until all the submitted reports are sent.
+
+        :param timeout: Maximum seconds to wait, or :data:`None` to wait
+            forever.
+        :return: Whether all the reports have been sent?
+        """
+        if not self.async_report:
+            return True
+        q = self._queue
+        deadline = time.time() + timeout if timeout is not None else None
+        with q.all_tasks_done:
+            while q.unfinished_tasks:
+                if deadline is None:
+                    q.all_tasks_done.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    q.all_tasks_done.wait(remaining)
+        return True
+
+    def _start_sender(self):
+        with self._lock:
+            # A forked runner process does not inherit the sender thread.
+            if self._sender is not None and self._sender.is_alive() and \
+                    self._sender_pid == os.getpid():
+                return
+            self._sender = threading.Thread(target=self._run_sender,
+                                            name='ReportSender')
+            self._sender.daemon = True
+            self._sender_pid = os.getpid()
+            self._sender.start()
+
+    def _run_sender(self):
+        while True:
+            func, args = self._queue.get()
+            try:
+                self._send(func, args)
+            finally:
+                self._queue.task_done()
+
+    def _send(self, func, args):
+        for i in xrange(self.retries + 1):
+            try:
+                func(*args)
+                return
+            except Exception:
+                if i >= self.retries:
+                    name = getattr(func, '__name__', func)
+                    logger.exception('Cannot send report %s%r.' %
+                                     (name, args[:1]))
+                    return
+            time.sleep(RETRY_DELAY * (2 ** i))
+
+
+#: The global :class:`ReportPipeline` of this runner process.
+reports = ReportPipeline(
+    depth=runconfig.RUNNER_REPORT_QUEUE_DEPTH,
+    retries=runconfig.RUNNER_REPORT_RETRIES,
+    async_report=runconfig.RUNNER_ASYNC_REPORT,
+)
+
+
+@worker_process_shutdown.connect
+def flush_reports(**kwargs):
+    """Send the waiting reports before the runner process exits."""
+    if not reports.flush(FLUSH_TIMEOUT):
+        logger.warning('Some reports of submissions are not sent before the '
+                       'runner process exits.')
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# @file: railgun/runner/priority.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# This file is released under BSD 2-clause license.
+
+"""Put the submissions into priority lanes of the runner queue.
+
+Each submission is sent with a Celery message priority, and the Redis
+broker keeps one list for each priority (``BROKER_TRANSPORT_OPTIONS`` in
+:mod:`~railgun.runner.runconfig`).  The worker always takes the message
+from the most urgent non-empty lane, where lane 0 is the most urgent.
+
+The lane of a submission is decided by three things:
+
+*   How soon the next deadline of the homework comes.  The lane is the
+    index of the first threshold in ``config.RUNNER_PRIORITY_DEADLINES``
+    which is not earlier than the deadline, so the submissions for a
+    homework due in minutes are not blocked by the ones due next week.
+*   How long the submission is expected to run, estimated by the website
+    from the earlier submissions of the same homework (see
+    :mod:`railgun.website.runtime`).  A submission expected to run longer
+    than ``config.RUNNER_SJF_COST_STEPS[i]`` seconds is moved ``i + 1``
+    lanes backwards, so the many quick submissions are not stuck behind a
+    few slow ones.
+*   How many submissions of the same user are still pending.  Each of
+    them moves the new submission ``config.RUNNER_PRIORITY_PENDING_PENALTY``
+    lanes backwards, so a user resubmitting again and again cannot take
+    the head of the queue from the others.
+
+Since the worker never takes a message from a lane while a more urgent
+lane is not empty, the slow submissions might wait forever during a
+deadline rush.  :class:`LaneAging` is added to the steps of the worker,
+which moves all the waiting messages one lane forward every
+``config.RUNNER_SJF_AGING_INTERVAL`` seconds.
+"""
+
+import os
+from datetime import timedelta
+
+import redis
+from celery import bootsteps
+
+from railgun.common.dateutil import utc_now
+from . import runconfig
+from .context import logger
+
+
+#: The priority values of the lanes, from the most urgent one.
+PRIORITY_STEPS = runconfig.BROKER_TRANSPORT_OPTIONS['priority_steps']
+
+#: The separator between the queue name and the priority in the names of
+#: the Redis lists, the same as :mod:`kombu.transport.redis`.
+PRIORITY_SEP = '\x06\x16'
+
+
+def deadline_lane(hw, now=None):
+    """Get the lane of the submissions for `hw` by its next deadline.
+
+    :param hw: The homework object.
+    :type hw: :class:`~railgun.common.hw.Homework`
+    :param now: The current UTC time, or :data:`None` to use
+        :func:`~railgun.common.dateutil.utc_now`.
+    :type now: :class:`~datetime.datetime`
+    :return: The lane index, counting from 0.
+    :rtype: :class:`int`
+    """
+    thresholds = runconfig.RUNNER_PRIORITY_DEADLINES
+    ddl = hw.get_next_deadline()
+    if ddl is None:
+        # The homework has expired, nobody is in a hurry.
+        return len(thresholds) + 1
+    remaining = ddl[0] - (now or utc_now())
+    for i, seconds in enumerate(thresholds):
+        if remaining <= timedelta(seconds=seconds):
+            return i
+    return len(thresholds)
+
+
+def cost_lane(cost):
+    """Get the number of lanes to move a submission backwards by its
+    expected running time.
+
+    :param cost: The expected wall clock seconds, or :data:`None` if
+        unknown.
+    :type cost: :class:`float`
+    :return: The lane offset, counting from 0.
+    :rtype: :class:`int`
+    """
+    if cost is None:
+        return 0
+    return len([s for s in runconfig.RUNNER_SJF_COST_STEPS if cost > s])
+
+
+def submission_priority(hw, pending=0, now=None, cost=None):
+    """Get the message priority of a submission.
+
+    :param hw: The homework object.
+    :type hw: :class:`~railgun.common.hw.Homework`
+    :param pending: The number of other pending submissions of the user.
+    :type pending: :class:`int`
+    :param now: The current UTC time.
+    :type now: :class:`~datetime.datetime`
+    :param cost: The expected running seconds of the submission, or
+        :data:`None` if unknown.
+    :type cost: :class:`float`
+    :return: One of :data:`PRIORITY_STEPS`.
+    """
+    lane = (deadline_lane(hw, now) + cost_lane(cost) +
+            pending * runconfig.RUNNER_PRIORITY_PENDING_PENALTY)
+    return PRIORITY_STEPS[min(lane, len(PRIORITY_STEPS) - 1)]
+
+
+def queue_keys(queue):
+    """Get the names of the Redis lists of all the lanes of `queue`.
+
+    :param queue: The name of the queue.
+    :type queue: :class:`str`
+    """
+    return [('%s%s%s' % (queue, PRIORITY_SEP, p) if p else queue)
+            for p in PRIORITY_STEPS]
+
+
+def age_lanes(client, queue):
+    """Move all the messages waiting in `queue` one lane forward.
+
+    The messages are pushed at the head of a Redis list and popped from
+    the tail, so moving them by ``RPOPLPUSH`` keeps their order, and puts
+    them behind the messages already waiting in the more urgent lane.
+
+    :param client: The Redis client.
+    :type client: :class:`redis.StrictRedis`
+    :param queue: The name of the queue.
+    :type queue: :class:`str`
+    :return: The number of moved messages.
+    :rtype: :class:`int`
+    """
+    keys = queue_keys(queue)
+    moved = 0
+    # Start from the most urgent lanes, so that a message is moved only once.
+    for src, dst in zip(keys[1:], keys[:-1]):
+        for i in xrange(client.llen(src)):
+            if client.rpoplpush(src, dst) is None:
+                break
+            moved += 1
+    return moved
+
+
+class LaneAging(bootsteps.StartStopStep):
+    """The worker step to call :func:`age_lanes` on the consumed queues
+    every ``config.RUNNER_SJF_AGING_INTERVAL`` seconds.
+
+    All the workers consuming the same queue share one Redis key as the
+    lock, so the messages are not moved faster when more workers start.
+    """
+
+    requires = ('Timer', )
+
+    def __init__(self, worker, **kwargs):
+        self.tref = None
+
+    def start(self, worker):
+        interval = runconfig.RUNNER_SJF_AGING_INTERVAL
+        if interval > 0:
+            self.tref = worker.timer.call_repeatedly(
+                interval, self.age, (worker, ), priority=10)
+
+    def stop(self, worker):
+        if self.tref is not None:
+            self.tref.cancel()
+            self.tref = None
+
+    def age(self, worker):
+        # Expire the lock slightly earlier than the next call, so that the
+        # same worker can take it again.
+        expires = int(runconfig.RUNNER_SJF_AGING_INTERVAL * 900)
+        try:
+            client = redis.StrictRedis.from_url(runconfig.BROKER_URL)
+            for queue in worker.app.amqp.queues.consume_from:
+                if not client.set('railgun.aging.%s' % queue, os.getpid(),
+                                  nx=True, px=expires):
+                    continue
+                moved = age_lanes(client, queue)
+                if moved:
+                    logger.debug('Aging: %d messages in queue %s are moved '
+                                 'one lane forward.' % (moved, queue))
+        except Exception:
+            logger.exception('Cannot move the waiting messages forward.')
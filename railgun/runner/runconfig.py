@@ -21,10 +21,35 @@ BROKER_URL = 'redis://localhost:6379/0'
 CELERY_DEFAULT_QUEUE = 'default'
 CELERY_CREATE_MISSING_QUEUES = True
 
-CELERY_ROUTES = {
-    # 'railgun.runner.tasks.helloWorld': {'queue': 'example'}
+# ---- priority lanes of the run queues (see railgun/runner/priority.py) ----
+# NOTE: With Redis, the messages of priority 0 are taken first.
+BROKER_TRANSPORT_OPTIONS = {
+    'priority_steps': list(range(10)),
+    'queue_order_strategy': 'priority',
 }
 
+# NOTE: Each pool process reserves only the message it is going to run, so
+#       the waiting messages stay in the lanes, where they can be reordered
+#       by priority and aging, and are not lost with a dead worker.  The
+#       messages are still acknowledged when the tasks start, since a
+#       submission whose runner died while running it is put into the queue
+#       again by `manage.py reap` (see railgun/maintain/reaper.py).  A late
+#       acknowledgement would make Redis redeliver it as well.
+CELERYD_PREFETCH_MULTIPLIER = 1
+CELERY_ACKS_LATE = False
+
+# NOTE: the submissions are routed to the shard queues of warm workers by
+#       railgun/runner/affinity.py, before the static routes are looked up.
+CELERY_ROUTES = (
+    'railgun.runner.affinity.AffinityRouter',
+    {
+        # 'railgun.runner.tasks.helloWorld': {'queue': 'example'}
+    },
+)
+
+# ---- the autoscaler used if the worker is started with --autoscale ----
+CELERYD_AUTOSCALER = 'railgun.runner.autoscale:RunnerAutoscaler'
+
 # ---- List of modules to import when celery starts ----
 CELERY_IMPORTS = ()
 
@@ -0,0 +1,428 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# @file: railgun/runner/sandbox.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# This file is released under BSD 2-clause license.
+
+"""Contain the memory, CPU and processes of each submission process.
+
+The timeout of :func:`~railgun.common.osutil.execute` only bounds the wall
+clock time of a submission, so one submission allocating all the memory,
+or forking without end, may starve all the others on the same machine.
+:class:`~railgun.runner.host.BaseHost` runs each process in a
+:class:`Sandbox`, which creates a cgroup v2 child group under
+``config.RUNNER_CGROUP_ROOT`` with ``memory.max``, ``cpu.max`` and
+``pids.max`` set, and puts the process into it before the process starts.
+When the process is killed by the kernel for running out of memory, the
+submission is rejected with
+:class:`~railgun.runner.errors.MemoryLimitExceededError`.
+
+The limits are read from the ``<runner>`` node of ``code.xml``:
+
+.. code-block:: xml
+
+    <runner entry="run.py" timeout="3" memoryLimit="256M" cpuLimit="0.5"
+            pidsLimit="32" />
+
+If cgroups are not available, the limits are enforced by rlimits instead:
+`RLIMIT_DATA` for the memory, `RLIMIT_CPU` (the CPU cores multiplied by the
+timeout) for the CPU, and `RLIMIT_NPROC` of the leased system account for
+the processes.  Running out of memory cannot be told apart from other
+failures in this case.
+
+All the sandboxes entered by a runner process are registered by their
+names, so :func:`kill_sandboxes` can kill the processes of a cancelled
+submission from another thread (see :mod:`railgun.runner.cancel`).
+"""
+
+import os
+import re
+import math
+import time
+import errno
+import signal
+import resource
+import threading
+import itertools
+
+from railgun.common.osutil import execute, kill_process_group
+from . import runconfig
+from .context import logger
+from .errors import MemoryLimitExceededError
+
+
+#: Controllers enabled for the child groups.
+CGROUP_CONTROLLERS = ('memory', 'cpu', 'pids')
+
+#: The period (in microseconds) of ``cpu.max``.
+CPU_PERIOD = 100000
+
+#: Maximum seconds to wait for the processes in a group to be killed.
+CGROUP_KILL_TIMEOUT = 5
+
+
+def parse_size(value):
+    """Parse a size in bytes, with an optional suffix of `K`, `M` or `G`.
+
+    :param value: The size text, e.g., ``'256M'``.
+    :type value: :class:`str`
+    :return: The size in bytes.
+    :rtype: :class:`int`
+    :raises: :class:`ValueError` if `value` is not a valid size.
+    """
+    m = re.match(r'^\s*(\d+)\s*([KkMmGg]?)[Bb]?\s*$', str(value))
+    if not m:
+        raise ValueError('%r is not a valid size.' % value)
+    scale = {'': 1, 'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30}
+    return int(m.group(1)) * scale[m.group(2).lower()]
+
+
+class ResourceLimits(object):
+    """The resource limits of a submission process.
+
+    :param memory: Maximum bytes of memory, or :data:`None` if unlimited.
+    :type memory: :class:`int`
+    :param cpu: Maximum CPU cores, or :data:`None` if unlimited.
+    :type cpu: :class:`float`
+    :param pids: Maximum number of processes and threads, or :data:`None`
+        if unlimited.
+    :type pids: :class:`int`
+    """
+
+    def __init__(self, memory=None, cpu=None, pids=None):
+        self.memory = memory
+        self.cpu = cpu
+        self.pids = pids
+
+    def __repr__(self):
+        return '<ResourceLimits(memory=%r, cpu=%r, pids=%r)>' % (
+            self.memory, self.cpu, self.pids)
+
+    @staticmethod
+    def from_runner_params(params):
+        """Read the limits from the ``<runner>`` node of ``code.xml``.
+        Missing limits are taken from ``config.RUNNER_DEFAULT_*_LIMIT``.
+
+        :param params: The runner parameters, or :data:`None`.
+        :type params: :class:`xml.etree.ElementTree.Element`
+        """
+        def get(name):
+            if params is not None:
+                return params.get(name)
+
+        memory = get('memoryLimit')
+        cpu = get('cpuLimit')
+        pids = get('pidsLimit')
+        return ResourceLimits(
+            memory=(parse_size(memory) if memory
+                    else runconfig.RUNNER_DEFAULT_MEMORY_LIMIT),
+            cpu=float(cpu) if cpu else runconfig.RUNNER_DEFAULT_CPU_LIMIT,
+            pids=int(pids) if pids else runconfig.RUNNER_DEFAULT_PIDS_LIMIT,
+        )
+
+    def rlimits(self, timeout=None):
+        """Get the rlimits to enforce these limits without cgroups.
+
+        :param timeout: The timeout of the process, to bound the CPU time.
+        :type timeout: :class:`float`
+        :return: A list of (resource name, value), where the name is an
+            attribute of :mod:`resource`.
+        """
+        ret = []
+        if self.memory:
+            ret.append(('RLIMIT_DATA', self.memory))
+        if self.cpu and timeout:
+            ret.append(('RLIMIT_CPU', int(math.ceil(self.cpu * timeout))))
+        if self.pids:
+            ret.append(('RLIMIT_NPROC', self.pids))
+        return ret
+
+
+def apply_rlimits(rlimits):
+    """Set the rlimits of the current process.
+
+    :param rlimits: A list of (resource name, value).
+    """
+    for name, value in rlimits:
+        res = getattr(resource, name)
+        hard = resource.getrlimit(res)[1]
+        if hard != resource.RLIM_INFINITY:
+            value = min(value, hard)
+        resource.setrlimit(res, (value, value))
+
+
+def _write(path, value):
+    with open(path, 'wb') as f:
+        f.write(value)
+
+
+# The prepared cgroup root of this process, or False if unavailable.
+_cgroup_root = None
+_cgroup_pid = None
+
+
+def cgroup_root():
+    """Prepare ``config.RUNNER_CGROUP_ROOT`` to hold the child groups.
+
+    The result is cached in each process, so the warning is only logged
+    once if cgroups are unavailable.
+
+    :return: The path of the root group, or :data:`None` if cgroups are
+        unavailable.
+    """
+    global _cgroup_root, _cgroup_pid
+    if _cgroup_pid == os.getpid():
+        return _cgroup_root or None
+    _cgroup_pid = os.getpid()
+    _cgroup_root = False
+
+    path = runconfig.RUNNER_CGROUP_ROOT
+    if not path:
+        return None
+    try:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        with open(os.path.join(path, 'cgroup.controllers'), 'rb') as f:
+            available = f.read().split()
+        missing = [c for c in CGROUP_CONTROLLERS if c not in available]
+        if missing:
+            raise EnvironmentError('Controllers %s are not available.' %
+                                   ', '.join(missing))
+        _write(os.path.join(path, 'cgroup.subtree_control'),
+               ' '.join('+' + c for c in CGROUP_CONTROLLERS))
+    except EnvironmentError:
+        logger.warning(
+            'cgroup v2 is not available at %(path)s, the submissions are '
+            'limited by rlimits instead.' % {'path': path},
+            exc_info=True
+        )
+        return None
+    _cgroup_root = path
+    return path
+
+
+def _kill_cgroup(path):
+    """Kill all the processes in the group at `path`."""
+    try:
+        if os.path.exists(os.path.join(path, 'cgroup.kill')):
+            _write(os.path.join(path, 'cgroup.kill'), '1')
+        else:
+            with open(os.path.join(path, 'cgroup.procs'), 'rb') as f:
+                for pid in f.read().split():
+                    try:
+                        os.kill(int(pid), signal.SIGKILL)
+                    except OSError:
+                        pass
+    except EnvironmentError:
+        pass
+
+
+# The entered sandboxes of this process by name, and the names killed by
+# `kill_sandboxes` until `release_sandboxes` is called.
+_sandboxes = {}
+_killed = set()
+_sandboxes_lock = threading.Lock()
+
+
+def kill_sandboxes(name):
+    """Kill the processes in all the sandboxes of `name` entered by this
+    process.  The processes attached to these sandboxes later are also
+    killed at once, until :func:`release_sandboxes` is called.
+
+    :param name: The name of the sandboxes, usually the submission uuid.
+    :type name: :class:`str`
+    """
+    with _sandboxes_lock:
+        _killed.add(name)
+        sandboxes = list(_sandboxes.get(name, ()))
+    for sandbox in sandboxes:
+        sandbox.kill()
+
+
+def release_sandboxes(name):
+    """Stop killing the processes attached to the sandboxes of `name`."""
+    with _sandboxes_lock:
+        _killed.discard(name)
+
+
+class Sandbox(object):
+    """Contain a submission process in a cgroup, or by rlimits if cgroups
+    are unavailable.
+
+    The group is created by :meth:`__enter__`, and all the processes left
+    in it are killed by :meth:`__exit__`.  The process should call
+    :meth:`preexec` before it executes the program.
+
+    :param name: The name prefix of the group, usually the submission uuid.
+    :type name: :class:`str`
+    :param limits: The resource limits.
+    :type limits: :class:`ResourceLimits`
+    :param timeout: The timeout of the process.
+    :type timeout: :class:`float`
+    """
+
+    # Make the group names unique among the spawns of a submission.
+    _counter = itertools.count()
+
+    def __init__(self, name, limits, timeout=None):
+        self.name = name
+        self.limits = limits
+        self.timeout = timeout
+        #: The path of the cgroup, or :data:`None` if using rlimits.
+        self.path = None
+        #: The process attached by :meth:`attach`.
+        self.process = None
+
+    def __enter__(self):
+        root = cgroup_root()
+        if root is not None:
+            path = os.path.join(root, '%s-%d-%d' % (
+                self.name, os.getpid(), next(self._counter)))
+            try:
+                os.mkdir(path)
+                self._set_limits(path)
+                self.path = path
+            except EnvironmentError:
+                logger.exception(
+                    'Cannot create cgroup %(path)s, fall back to rlimits.' %
+                    {'path': path}
+                )
+                self._remove(path)
+        with _sandboxes_lock:
+            _sandboxes.setdefault(self.name, set()).add(self)
+        return self
+
+    def __exit__(self, ignore1, ignore2, ignore3):
+        with _sandboxes_lock:
+            group = _sandboxes.get(self.name)
+            if group is not None:
+                group.discard(self)
+                if not group:
+                    del _sandboxes[self.name]
+        self.process = None
+        if self.path is not None:
+            self._remove(self.path)
+            self.path = None
+
+    def _set_limits(self, path):
+        limits = self.limits
+        if limits.memory:
+            _write(os.path.join(path, 'memory.max'), str(limits.memory))
+            # Swapping would turn the memory limit into a slow disk.
+            swap = os.path.join(path, 'memory.swap.max')
+            if os.path.exists(swap):
+                _write(swap, '0')
+        if limits.cpu:
+            _write(os.path.join(path, 'cpu.max'), '%d %d' % (
+                int(limits.cpu * CPU_PERIOD), CPU_PERIOD))
+        if limits.pids:
+            _write(os.path.join(path, 'pids.max'), str(limits.pids))
+
+    def _remove(self, path):
+        """Kill all the processes in the group at `path` and remove it."""
+        if not os.path.isdir(path):
+            return
+        deadline = time.time() + CGROUP_KILL_TIMEOUT
+        while True:
+            try:
+                os.rmdir(path)
+                return
+            except OSError, ex:
+                if ex.errno != errno.EBUSY or time.time() > deadline:
+                    logger.exception(
+                        'Cannot remove cgroup %(path)s.' % {'path': path})
+                    return
+            # The submission may have escaped from the process group by
+            # `setsid`, but it cannot escape from the cgroup.
+            _kill_cgroup(path)
+            time.sleep(0.01)
+
+    def rlimits(self):
+        """The rlimits to be set by the process, empty if the cgroup is
+        used.
+        """
+        if self.path is not None:
+            return []
+        return self.limits.rlimits(self.timeout)
+
+    def enter(self):
+        """Put the current process into this sandbox."""
+        if self.path is not None:
+            _write(os.path.join(self.path, 'cgroup.procs'), '0')
+        apply_rlimits(self.rlimits())
+
+    def attach(self, process):
+        """Remember the started `process`, so that :meth:`kill` can kill
+        its process group without cgroups.  The process is killed at once
+        if this sandbox has been killed by :func:`kill_sandboxes`.
+
+        :param process: The :class:`subprocess.Popen` or any object having
+            the same `pid` and `returncode` members.
+        """
+        self.process = process
+        with _sandboxes_lock:
+            killed = self.name in _killed
+        if killed:
+            self.kill()
+
+    def kill(self):
+        """Kill all the processes in this sandbox.  Without cgroups, only
+        the process group of the attached process is killed.
+        """
+        if self.path is not None:
+            _kill_cgroup(self.path)
+            return
+        process = self.process
+        # Do not kill a reused pid after the process has been waited.
+        if process is not None and process.returncode is None:
+            kill_process_group(process.pid)
+
+    def preexec(self):
+        """The `preexec_fn` for :class:`subprocess.Popen`, which makes the
+        process a group leader, and puts it into this sandbox.
+        """
+        os.setsid()
+        self.enter()
+
+    def oom_killed(self):
+        """Whether any process in this sandbox has been killed for running
+        out of memory?  Always :data:`False` when using rlimits.
+        """
+        if self.path is None:
+            return False
+        try:
+            with open(os.path.join(self.path, 'memory.events'), 'rb') as f:
+                for line in f:
+                    key, value = line.split()
+                    if key == 'oom_kill':
+                        return int(value) > 0
+        except (EnvironmentError, ValueError):
+            logger.exception(
+                'Cannot read memory events of cgroup %(path)s.' %
+                {'path': self.path}
+            )
+        return False
+
+    def check(self):
+        """Raise an error if any process in this sandbox has run out of
+        memory.
+
+        :raises: :class:`~railgun.runner.errors.MemoryLimitExceededError`
+        """
+        if self.oom_killed():
+            raise MemoryLimitExceededError()
+
+
+def execute_sandboxed(cmd, timeout=None, sandbox=None, **kwargs):
+    """Execute `cmd` by :func:`~railgun.common.osutil.execute` in `sandbox`.
+    The other arguments are the same as
+    :func:`~railgun.common.osutil.execute`.
+
+    :param sandbox: The :class:`Sandbox`, or :data:`None` to run without
+        limits.
+    """
+    if sandbox is not None:
+        kwargs['preexec_fn'] = sandbox.preexec
+        kwargs['on_start'] = sandbox.attach
+    return execute(cmd, timeout, **kwargs)
@@ -34,12 +34,34 @@ process::
 
 from . import runconfig, permcheck
 from .apiclient import ApiClient, report_error, report_start
+from .cancel import CancelWatcher, is_cancelled
 from .context import app, logger
+from .lease import HandinLease
+from .pipeline import reports
+from .host import PythonHost
+from .workspace import templates
+from .zygote import zygotes
 from .handin import PythonHandin, NetApiHandin, InputClassHandin, JavaHandin
 from .errors import (RunnerError, InternalServerError, NonUTF8OutputError,
-                     RunnerPermissionError)
+                     RunnerPermissionError, OutputLimitExceededError)
 from railgun.common.hw import HwScore
 from railgun.common.lazy_i18n import lazy_gettext
+import hw
+
+
+def decode_output(output):
+    """Decode the output of a process as UTF-8, replacing the invalid
+    bytes.  :data:`None` is returned as is."""
+    if output is not None:
+        return unicode(output, 'utf-8', 'replace')
+
+
+def log_cancelled(handid, hwid):
+    """Log that the submission `handid` of `hwid` has been cancelled."""
+    logger.info(
+        'Submission[%(handid)s] of hw[%(hwid)s]: Cancelled.' %
+        {'handid': handid, 'hwid': hwid}
+    )
 
 
 def run_handin(handler, handid, hwid):
@@ -51,6 +73,18 @@ def run_handin(handler, handid, hwid):
     It is guaranteed that all errors are handled and logged correctly in this
     method.
 
+    The reports to the website are sent in background by
+    :data:`~railgun.runner.pipeline.reports`, so this method may return
+    before the reports are delivered.
+
+    A submission cancelled by the website is skipped, or killed if it is
+    already running, and nothing is reported (see
+    :mod:`~railgun.runner.cancel`).
+
+    The lease of the submission is held until the reports have been sent,
+    so that the website can tell if this runner dies (see
+    :mod:`~railgun.runner.lease`).
+
     :param handler: A factory to create a
         :class:`~railgun.runner.handin.BaseHandin` handler object.
     :param handid: The uuid of this submission.
@@ -62,14 +96,31 @@ def run_handin(handler, handid, hwid):
     api = ApiClient(runconfig.WEBSITE_API_BASEURL)
     # Immediately report error if permcheck has error
     if permcheck.checker.has_error():
-        report_error(handid, RunnerPermissionError())
+        reports.submit(report_error, handid, RunnerPermissionError())
         return
+    # The submission may have been superseded while waiting in the queue.
+    if is_cancelled(handid):
+        log_cancelled(handid, hwid)
+        return
+    watcher = CancelWatcher(handid)
+    # The lease must be taken before the submission becomes `Running`.
+    lease = HandinLease(handid)
+    lease.start()
     try:
-        report_start(handid)
+        # All the reports are sent in background by the report pipeline, in
+        # the order they are submitted, so that we need not wait for the
+        # website before running this submission or taking the next one.
+        reports.submit(report_start, handid)
         # create and launch this handler
         if callable(handler):
             handler = handler()
-        exitcode, stdout, stderr = handler.execute()
+        with watcher:
+            exitcode, stdout, stderr = handler.execute()
+        # The website has already rejected a cancelled submission, and the
+        # result of the killed processes means nothing.
+        if watcher.cancelled:
+            log_cancelled(handid, hwid)
+            return
         # try to convert stdout & stderr to unicode in UTF-8 encoding
         # if not success, report the client has produced non UTF-8 output
         try:
@@ -78,7 +129,8 @@ def run_handin(handler, handid, hwid):
         except UnicodeError:
             # This routine will terminate the try-catch structure so that
             # we must report the exitcode earlier as well.
-            api.proclog(handid, exitcode, None, None)
+            reports.submit(api.proclog, handid, exitcode, None, None,
+                           handler.usage)
             raise NonUTF8OutputError()
         # log the handin execution
         if exitcode != 0:
@@ -98,35 +150,55 @@ def run_handin(handler, handid, hwid):
             score = HwScore(
                 False,
                 lazy_gettext('Exitcode %(exitcode)s != 0.',
-                             exitcode=exitcode)
+                             exitcode=exitcode),
+                usage=handler.usage
             )
-            api.report(handid, score)
+            reports.submit(api.report, handid, score)
         # Update exitcode, stdout and stderr here, which cannot be set in
         # the host itself.
         #
         # This process may also change Handin.state, if previous process
         # exit with code 0 before it reported the score. See website/api.py
         # for more details.
-        api.proclog(handid, exitcode, stdout, stderr)
+        reports.submit(api.proclog, handid, exitcode, stdout, stderr,
+                       handler.usage)
         # Log that we've succesfully done this job.
         logger.info(
             'Submission[%(handid)s] of hw[%(hwid)s]: OK.' %
             {'handid': handid, 'hwid': hwid}
         )
     except RunnerError, ex:
+        if watcher.cancelled:
+            log_cancelled(handid, hwid)
+            return
         # RunnerError is logically OK and sent to client only.
         # So we just log the message of this exception, not exception detail.
         logger.warning(
             'Submission[%(handid)s] of hw[%(hwid)s]: %(message)s.' %
             {'handid': handid, 'hwid': hwid, 'message': ex.message}
         )
-        report_error(handid, ex)
+        reports.submit(report_error, handid, ex,
+                       getattr(handler, 'usage', None))
+        # The truncated output of a flooding submission is still stored.
+        if isinstance(ex, OutputLimitExceededError):
+            reports.submit(api.proclog, handid, None,
+                           decode_output(ex.stdout), decode_output(ex.stderr),
+                           getattr(handler, 'usage', None))
     except Exception:
+        if watcher.cancelled:
+            log_cancelled(handid, hwid)
+            return
         logger.exception(
             'Error executing submission "%(handid)s" for homework "%(hwid)s".'
             % {'handid': handid, 'hwid': hwid}
         )
-        report_error(handid, InternalServerError())
+        reports.submit(report_error, handid, InternalServerError(),
+                       getattr(handler, 'usage', None))
+    finally:
+        # The lease is renewed until all the reports above are sent, and
+        # then released by the report pipeline.  It expires if this runner
+        # dies before that.
+        reports.submit(lease.release)
 
 
 @app.task
@@ -223,3 +295,36 @@ def run_input(handid, hwid, csvdata, options):
         handid,
         hwid
     )
+
+
+@app.task
+def prewarm_homework(hwid):
+    """Warm the caches of this runner process for the given homework, so
+    that the submissions do not pay the cold-start costs when the deadline
+    comes.  Sent by :class:`~railgun.maintain.prewarm.HwPrewarmTask`.
+
+    The workspace templates are built on the disk and shared by all the
+    runner processes, while the Python zygote is started only in the
+    runner process taking this task.
+
+    :param hwid: The uuid of the homework.
+    :type hwid: :class:`str`
+    """
+    homework = hw.homeworks.get_by_uuid(hwid)
+    if homework is None:
+        logger.warning('Cannot prewarm homework %s: not found.' % hwid)
+        return
+    for lang in homework.get_code_languages():
+        try:
+            hwcode = homework.get_code(lang)
+            if runconfig.RUNNER_WORKSPACE_TEMPLATE:
+                templates.get(homework, hwcode)
+            if lang == 'python' and runconfig.RUNNER_PYTHON_ZYGOTE:
+                # The host is not entered, so no working directory is made.
+                zygotes.get(PythonHost('prewarm-%s' % hwid, homework))
+        except Exception:
+            logger.exception(
+                'Cannot prewarm homework %(hwid)s in %(lang)s.' %
+                {'hwid': hwid, 'lang': lang}
+            )
+    logger.info('Homework %s is prewarmed.' % hwid)
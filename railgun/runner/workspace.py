@@ -0,0 +1,535 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# @file: railgun/runner/workspace.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# This file is released under BSD 2-clause license.
+
+"""Every submission runs in a fresh working directory, which is filled with
+the code files of the homework before the submitted archive is extracted.
+
+Instead of copying these files from the homework directory for every
+submission, this module builds a :class:`WorkspaceTemplate` once for each
+version of a :class:`~railgun.common.hw.HwCode`, and materializes the
+working directories from it.  Files are cloned with reflinks where the file
+system supports them, so that the cost of preparing a working directory
+depends on the number of files rather than the number of bytes.
+
+If ``config.RUNNER_WORKSPACE_LINK`` is enabled, files that the students
+cannot overwrite (i.e., not `ACCEPT` by the
+:class:`~railgun.common.hw.FileRules`) are hard linked into the working
+directory.  Such files are read-only and owned by the runner, so the
+submissions can read them, but cannot change the template.
+
+If the homework cache task has built the
+:class:`~railgun.common.hw.HwArtifacts` of the code package, the compiled
+bytecode of the locked Python files is put into the template as well, so
+these files are not compiled again in every working directory.
+
+The working directories themselves are managed by :class:`WorkspacePool`.
+They can be placed on a RAM-backed file system, optionally as dedicated
+tmpfs mounts with a size quota, and are removed by a background reaper so
+that the runner can take the next submission immediately.
+"""
+
+import os
+import time
+import errno
+import pipes
+import Queue
+import shutil
+import hashlib
+import threading
+
+from railgun.common.hw import HwArtifacts
+from railgun.common.fileutil import dirtree, clone_file, link_or_clone
+from railgun.common.osutil import execute
+from railgun.common.tempdir import TempDir
+from . import runconfig
+from .context import logger
+
+
+#: Name of the directory under ``config.TEMPORARY_DIR`` to store templates.
+TEMPLATE_DIR_NAME = '.templates'
+
+
+class WorkspaceTemplate(object):
+    """A private snapshot of the code files of a :class:`HwCode`, used to
+    prepare working directories for submissions.
+
+    :param hw: The homework object.
+    :type hw: :class:`~railgun.common.hw.Homework`
+    :param hwcode: The code package object.
+    :type hwcode: :class:`~railgun.common.hw.HwCode`
+    :param link: Whether or not to hard link the files that students cannot
+        overwrite?
+    :type link: :class:`bool`
+    """
+
+    def __init__(self, hw, hwcode, link=False):
+        #: The :class:`~railgun.common.hw.HwCode` of this template.
+        self.hwcode = hwcode
+        #: Whether to hard link the files that students cannot overwrite?
+        self.link = link
+        #: Relative paths of all files in this template.
+        self.files = sorted(
+            f for f in dirtree(hwcode.path)
+            if not os.path.isdir(os.path.join(hwcode.path, f))
+        )
+        #: Relative paths of all directories which contain some files.
+        dirs = set()
+        for f in self.files:
+            d = os.path.dirname(f)
+            while d and d not in dirs:
+                dirs.add(d)
+                d = os.path.dirname(d)
+        self.dirs = sorted(dirs)
+        #: Relative paths of the files that students may overwrite.
+        self.overwritable = set(
+            f for f in self.files if hw.is_overwritable(hwcode, f)
+        )
+        #: The precompiled artifacts of the code package, if built by the
+        #: homework cache task.
+        self.artifacts = hwcode.get_artifacts(hw.uuid)
+        #: Relative paths of the locked Python files, mapped to their
+        #: precompiled bytecode files in :attr:`artifacts`.
+        self.compiled = {}
+        if self.artifacts is not None:
+            for f in self.files:
+                if f.endswith('.py') and f not in self.overwritable:
+                    pyc = self.artifacts.get_pyc(f)
+                    if pyc:
+                        self.compiled[f] = pyc
+        #: The version string of this template, computed from the paths,
+        #: sizes and modification times of all files.
+        self.version = self._compute_version()
+        #: The root directory of this template.
+        self.path = os.path.join(
+            runconfig.TEMPORARY_DIR,
+            TEMPLATE_DIR_NAME,
+            '%s-%s-%s' % (hw.uuid, hwcode.lang, self.version)
+        )
+
+    def _compute_version(self):
+        h = hashlib.md5()
+        h.update('link' if self.link else 'clone')
+        for f in self.files:
+            st = os.stat(os.path.join(self.hwcode.path, f))
+            h.update('%s\0%d\0%d\0' % (f, st.st_size, int(st.st_mtime)))
+        if self.artifacts is not None:
+            h.update('%s\0%s\0' % (self.artifacts.path,
+                                     ','.join(sorted(self.compiled))))
+        return h.hexdigest()
+
+    def build(self):
+        """Copy the code files into the template directory if it does not
+        exist yet.
+
+        The template is built in a temporary directory, and then renamed to
+        its final path, so that other runner processes would never see an
+        incomplete template.
+        """
+        if os.path.isdir(self.path):
+            return
+        parent = os.path.dirname(self.path)
+        if not os.path.isdir(parent):
+            try:
+                os.makedirs(parent, 0700)
+            except OSError:
+                if not os.path.isdir(parent):
+                    raise
+        building = '%s.%d.building' % (self.path, os.getpid())
+        if os.path.isdir(building):
+            shutil.rmtree(building)
+        os.makedirs(building, 0700)
+        try:
+            for d in self.dirs:
+                os.makedirs(os.path.join(building, d), 0755)
+            for f in self.files:
+                # Linked files are shared with all working directories, so
+                # they must be read-only.
+                mode = 0444 if self.link else 0644
+                shutil.copyfile(os.path.join(self.hwcode.path, f),
+                                os.path.join(building, f))
+                os.chmod(os.path.join(building, f), mode)
+            for f, pyc in self.compiled.iteritems():
+                shutil.copyfile(pyc, os.path.join(building, f + 'c'))
+                os.chmod(os.path.join(building, f + 'c'), mode)
+                # The bytecode is used only if the source file has the
+                # modification time recorded in it.
+                mtime = HwArtifacts.read_pyc_mtime(pyc)
+                os.utime(os.path.join(building, f), (mtime, mtime))
+            os.rename(building, self.path)
+        except OSError:
+            # Another process may have built the same template.
+            shutil.rmtree(building, ignore_errors=True)
+            if not os.path.isdir(self.path):
+                raise
+
+    def materialize(self, tempdir, mode=0700):
+        """Fill the working directory `tempdir` with the files in this
+        template.
+
+        New directories and files are given to the owner of `tempdir` at
+        creation (see :meth:`~railgun.common.tempdir.TempDir.set_owner`),
+        except for the hard linked files.
+
+        :param tempdir: The working directory.
+        :type tempdir: :class:`~railgun.common.tempdir.TempDir`
+        :param mode: Unix file system mode for the new directories and the
+            files that are not hard linked.
+        :type mode: :class:`int`
+        """
+        for d in self.dirs:
+            tempdir.makedirs(tempdir.fullpath(d), mode)
+        mode = tempdir.entry_mode(mode)
+        for f in self.files:
+            srcpath = os.path.join(self.path, f)
+            dstpath = tempdir.fullpath(f)
+            if self.link and f not in self.overwritable:
+                link_or_clone(srcpath, dstpath, mode, tempdir.owner)
+            else:
+                clone_file(srcpath, dstpath, mode, tempdir.owner)
+            if f in self.compiled:
+                self._materialize_pyc(f, tempdir, mode)
+
+    def _materialize_pyc(self, f, tempdir, mode):
+        srcpath = os.path.join(self.path, f)
+        dstpath = tempdir.fullpath(f)
+        if self.link:
+            link_or_clone(srcpath + 'c', dstpath + 'c', mode, tempdir.owner)
+        else:
+            clone_file(srcpath + 'c', dstpath + 'c', mode, tempdir.owner)
+        # Cloned files get new modification times, which must be restored
+        # to keep the bytecode valid.
+        st = os.stat(srcpath)
+        if int(os.stat(dstpath).st_mtime) != int(st.st_mtime):
+            os.utime(dstpath, (st.st_atime, st.st_mtime))
+
+
+class TemplateCache(object):
+    """Cache the :class:`WorkspaceTemplate` for each code package in this
+    runner process.
+
+    A new template will be built if the :class:`HwCode` object is replaced,
+    which happens when the homework is reloaded.
+    """
+
+    def __init__(self):
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def get(self, hw, hwcode):
+        """Get the built template for `hwcode`, building it if necessary.
+
+        :param hw: The homework object.
+        :type hw: :class:`~railgun.common.hw.Homework`
+        :param hwcode: The code package object.
+        :type hwcode: :class:`~railgun.common.hw.HwCode`
+
+        :return: The :class:`WorkspaceTemplate` object.
+        """
+        key = (hw.uuid, hwcode.lang)
+        with self._lock:
+            template = self._templates.get(key)
+            if template is None or template.hwcode is not hwcode or \
+                    not os.path.isdir(template.path):
+                template = WorkspaceTemplate(
+                    hw, hwcode, link=runconfig.RUNNER_WORKSPACE_LINK)
+                template.build()
+                self._templates[key] = template
+            return template
+
+
+#: The global :class:`TemplateCache` of this runner process.
+templates = TemplateCache()
+
+
+#: Name prefix of the working directories managed by :class:`WorkspacePool`.
+#: The full name is ``ws-<pid>-<handid>``, where `pid` is the runner process.
+WORKSPACE_PREFIX = 'ws-'
+
+#: Name prefix of the working directories waiting to be removed.
+TRASH_PREFIX = '.trash-'
+
+#: Interval in seconds between two scans for orphaned working directories.
+#: The statistics of the pool are logged at the same interval.
+ORPHAN_SCAN_INTERVAL = 600
+
+#: Timeout in seconds of the `mount` and `umount` commands.
+MOUNT_TIMEOUT = 10
+
+
+def _pid_alive(pid):
+    """Check whether the process `pid` exists."""
+    try:
+        os.kill(pid, 0)
+    except OSError, ex:
+        return ex.errno == errno.EPERM
+    return True
+
+
+def _disk_usage(path):
+    """Get the bytes taken by the directory `path`.  Files having more than
+    one hard links are ignored, since they are shared with the templates."""
+    if os.path.ismount(path):
+        st = os.statvfs(path)
+        return (st.f_blocks - st.f_bfree) * st.f_frsize
+    total = 0
+    for dpath, _, fnames in os.walk(path):
+        for fn in fnames:
+            try:
+                st = os.lstat(os.path.join(dpath, fn))
+            except OSError:
+                continue
+            if st.st_nlink == 1:
+                total += st.st_blocks * 512
+    return total
+
+
+class WorkspacePool(object):
+    """Create and remove the working directories of submissions.
+
+    The working directories are placed under `root`.  If `mount` is
+    :data:`True`, each working directory is a dedicated tmpfs mount of
+    `quota` bytes, so a submission cannot fill up the disk or the memory.
+    If `async_cleanup` is :data:`True`, the working directories are removed
+    by a background reaper thread, which also removes the directories left
+    by crashed runner processes.
+
+    :param root: The parent directory of all working directories.
+    :type root: :class:`str`
+    :param quota: Maximum bytes of each working directory.
+    :type quota: :class:`int`
+    :param mount: Whether or not to mount a tmpfs for each working directory?
+    :type mount: :class:`bool`
+    :param async_cleanup: Whether or not to remove the working directories
+        in background?
+    :type async_cleanup: :class:`bool`
+    """
+
+    def __init__(self, root, quota=None, mount=False, async_cleanup=True):
+        #: The parent directory of all working directories.
+        self.root = root
+        #: Maximum bytes of each working directory.
+        self.quota = quota
+        #: Whether to mount a tmpfs for each working directory?
+        self.mount = mount
+        #: Whether to remove the working directories in background?
+        self.async_cleanup = async_cleanup
+
+        self._lock = threading.Lock()
+        self._queue = Queue.Queue()
+        self._reaper = None
+        self._reaper_pid = None
+        self._in_use = {}
+        self._counters = {
+            'reaped': 0,
+            'orphans_reaped': 0,
+            'bytes_reaped': 0,
+            'max_bytes': 0,
+            'over_quota': 0,
+            'mount_failures': 0,
+            'reap_latency_total': 0.0,
+            'reap_latency_max': 0.0,
+        }
+
+    def create(self, handid):
+        """Get the :class:`~railgun.common.tempdir.TempDir` for a submission.
+        The directory is not created until :meth:`open`.
+
+        :param handid: The uuid of the submission.
+        :type handid: :class:`str`
+        """
+        name = '%s%d-%s' % (WORKSPACE_PREFIX, os.getpid(), handid)
+        return TempDir(name, root=self.root)
+
+    def open(self, tempdir, mode=0700):
+        """Create the working directory `tempdir`.
+
+        :param tempdir: The object from :meth:`create`.
+        :type tempdir: :class:`~railgun.common.tempdir.TempDir`
+        :param mode: Unix file system mode of the working directory.
+        :type mode: :class:`int`
+        """
+        tempdir.open(mode)
+        if self.mount and not os.path.ismount(tempdir.path):
+            cmd = 'mount -t tmpfs -o %s tmpfs %s' % (
+                pipes.quote('size=%d,mode=%o' % (self.quota, mode)),
+                pipes.quote(tempdir.path)
+            )
+            exitcode, _, stderr = execute(cmd, MOUNT_TIMEOUT)
+            if exitcode != 0:
+                # The quota is not enforced, but we can still run the
+                # submission in a plain directory.
+                with self._lock:
+                    self._counters['mount_failures'] += 1
+                logger.warning('Cannot mount tmpfs at %s: %s' %
+                               (tempdir.path, stderr.strip()))
+        with self._lock:
+            self._in_use[tempdir.path] = tempdir
+        if self.async_cleanup:
+            self._start_reaper()
+
+    def release(self, tempdir):
+        """Remove the working directory `tempdir`.
+
+        If `async_cleanup` is enabled, the directory will be renamed (unless
+        it is a mount point) and queued for the reaper thread.  Otherwise it
+        is removed at once.
+
+        :param tempdir: The object from :meth:`create`.
+        :type tempdir: :class:`~railgun.common.tempdir.TempDir`
+        """
+        released_at = time.time()
+        with self._lock:
+            self._in_use.pop(tempdir.path, None)
+        path = tempdir.path
+        if not os.path.exists(path):
+            return
+        if not self.async_cleanup:
+            self._reap(path, released_at)
+            return
+        if not os.path.ismount(path):
+            # Renaming is atomic, so the directory disappears immediately
+            # for the others.  A mount point cannot be renamed, but its name
+            # is never reused anyway.
+            trash = os.path.join(self.root, TRASH_PREFIX + tempdir.name)
+            try:
+                os.rename(path, trash)
+                path = trash
+            except OSError:
+                logger.exception('Cannot move %s to trash.' % path)
+        self._queue.put((path, released_at))
+
+    def flush(self):
+        """Wait until all the released working directories are removed."""
+        if self.async_cleanup:
+            self._queue.join()
+
+    def stats(self):
+        """Get the statistics of this pool in the current runner process.
+
+        .. note::
+            The bytes of plain working directories are computed by walking
+            them, so do not call this too often.
+
+        :return: A :class:`dict` of the statistics, where the latencies are
+            measured from the release of a working directory to its removal.
+        """
+        with self._lock:
+            ret = dict(self._counters)
+            in_use = list(self._in_use)
+        ret['in_use'] = len(in_use)
+        ret['in_use_bytes'] = sum(
+            _disk_usage(p) for p in in_use if os.path.isdir(p)
+        )
+        ret['pending_reap'] = self._queue.qsize()
+        total_reaped = ret['reaped'] + ret['orphans_reaped']
+        ret['reap_latency_avg'] = \
+            ret['reap_latency_total'] / total_reaped if total_reaped else 0.0
+        return ret
+
+    def _start_reaper(self):
+        with self._lock:
+            # A forked runner process does not inherit the reaper thread.
+            if self._reaper is not None and self._reaper.is_alive() and \
+                    self._reaper_pid == os.getpid():
+                return
+            self._reaper = threading.Thread(target=self._run_reaper,
+                                            name='WorkspaceReaper')
+            self._reaper.daemon = True
+            self._reaper_pid = os.getpid()
+            self._reaper.start()
+
+    def _run_reaper(self):
+        self._scan_orphans()
+        last_scan = time.time()
+        while True:
+            try:
+                item = self._queue.get(timeout=ORPHAN_SCAN_INTERVAL)
+            except Queue.Empty:
+                item = None
+            if item is not None:
+                try:
+                    self._reap(*item)
+                except Exception:
+                    logger.exception('Cannot remove working directory %s.' %
+                                     item[0])
+                finally:
+                    self._queue.task_done()
+            if time.time() - last_scan >= ORPHAN_SCAN_INTERVAL:
+                self._scan_orphans()
+                self._log_stats()
+                last_scan = time.time()
+
+    def _log_stats(self):
+        try:
+            stats = self.stats()
+        except Exception:
+            logger.exception('Cannot get the statistics of workspaces.')
+            return
+        logger.info('Workspaces of runner %d: %s.' % (
+            os.getpid(),
+            ', '.join('%s=%s' % (k, v) for k, v in sorted(stats.iteritems()))
+        ))
+
+    def _reap(self, path, released_at, orphan=False):
+        size = _disk_usage(path)
+        if os.path.ismount(path):
+            # Unmounting frees the whole tmpfs at once.  Fall back to lazy
+            # unmount if some process is still using it.
+            quoted = pipes.quote(path)
+            if execute('umount %s' % quoted, MOUNT_TIMEOUT)[0] != 0:
+                execute('umount -l %s' % quoted, MOUNT_TIMEOUT)
+            os.rmdir(path)
+        else:
+            shutil.rmtree(path, ignore_errors=True)
+
+        latency = time.time() - released_at
+        with self._lock:
+            c = self._counters
+            c['orphans_reaped' if orphan else 'reaped'] += 1
+            c['bytes_reaped'] += size
+            c['max_bytes'] = max(c['max_bytes'], size)
+            if not orphan:
+                c['reap_latency_total'] += latency
+                c['reap_latency_max'] = max(c['reap_latency_max'], latency)
+            if self.quota and size > self.quota:
+                c['over_quota'] += 1
+        if self.quota and size > self.quota:
+            logger.warning('Working directory %s took %d bytes, exceeding the '
+                           'quota of %d bytes.' % (path, size, self.quota))
+
+    def _scan_orphans(self):
+        """Remove the working directories left by dead runner processes."""
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return
+        for name in names:
+            rest = name
+            if rest.startswith(TRASH_PREFIX):
+                rest = rest[len(TRASH_PREFIX):]
+            if not rest.startswith(WORKSPACE_PREFIX):
+                continue
+            try:
+                pid = int(rest[len(WORKSPACE_PREFIX):].split('-', 1)[0])
+            except ValueError:
+                continue
+            if pid == os.getpid() or _pid_alive(pid):
+                continue
+            try:
+                self._reap(os.path.join(self.root, name), time.time(), True)
+            except Exception:
+                logger.exception('Cannot remove orphaned working directory '
+                                 '%s.' % name)
+
+
+#: The global :class:`WorkspacePool` of this runner process.
+workspaces = WorkspacePool(
+    root=runconfig.RUNNER_WORKSPACE_ROOT or runconfig.TEMPORARY_DIR,
+    quota=runconfig.RUNNER_WORKSPACE_QUOTA,
+    mount=runconfig.RUNNER_WORKSPACE_MOUNT,
+    async_cleanup=runconfig.RUNNER_WORKSPACE_ASYNC_CLEANUP,
+)
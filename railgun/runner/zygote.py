@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# @file: railgun/runner/zygote.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# This file is released under BSD 2-clause license.
+
+"""Run Python submissions in processes forked from a preloaded zygote.
+
+If ``config.RUNNER_PYTHON_ZYGOTE`` is enabled, :class:`~railgun.runner.host.
+PythonHost` asks :data:`zygotes` for a :class:`Zygote` of the homework.
+Each zygote is a :mod:`pyhost.zygote` process which has imported the scorer
+stack and the modules listed in the `preload` runner parameter of
+``code.xml``, for example:
+
+.. code-block:: xml
+
+    <runner entry="run.py" preload="numpy,scipy" />
+
+The submission processes forked from the zygote drop to the system account
+and run the entry script, just like the native `SafeRunner`.  The standard
+output and error are sent back through fifos, and the score is relayed to
+this process, which posts it to the website.  So the submission processes
+never hold the communication key.
+
+If the zygote cannot be started, the runner falls back to `SafeRunner`.
+"""
+
+import os
+import sys
+import json
+import shutil
+import select
+import tempfile
+import subprocess
+from collections import OrderedDict
+
+from railgun.common.hw import HwScore
+from railgun.common.osutil import (supervise, kill_process_group,
+                                   ResourceUsage)
+from . import runconfig
+from .apiclient import ApiClient
+from .context import logger
+from .errors import ScoreTamperedError
+
+
+#: Maximum seconds to wait for a zygote to start or to fork a child.
+ZYGOTE_START_TIMEOUT = 30
+
+
+class ZygoteError(Exception):
+    """The zygote process is not working."""
+
+
+class ZygoteProcess(object):
+    """A submission process forked by :class:`Zygote`.  It provides the
+    same members as :class:`subprocess.Popen` which are required by
+    :func:`~railgun.common.osutil.supervise`.
+
+    The process is not a child of the runner, so the exit code is sent by
+    the zygote.
+    """
+
+    def __init__(self, zygote, pid, stdout, stderr):
+        self.zygote = zygote
+        self.pid = pid
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = None
+        #: The scores reported by the process.
+        self.scores = None
+        #: The resource usage of the process, sent along with the exit code.
+        self.rusage = None
+
+    def _receive_exit(self, timeout):
+        msg = self.zygote.recv(timeout)
+        if msg is None:
+            return
+        if 'exitcode' not in msg:
+            raise ZygoteError('Unexpected message %r.' % msg)
+        self.returncode = msg['exitcode']
+        self.scores = msg['scores']
+        if msg.get('rusage') is not None:
+            self.rusage = ResourceUsage.from_plain(msg['rusage'])
+            self.rusage.processes = 1
+
+    def poll(self):
+        if self.returncode is None:
+            self._receive_exit(0)
+        return self.returncode
+
+    def wait(self):
+        while self.returncode is None:
+            self._receive_exit(None)
+        return self.returncode
+
+
+class Zygote(object):
+    """Manage a :mod:`pyhost.zygote` process for a code package.
+
+    :param hwcode: The code package object.
+    :type hwcode: :class:`~railgun.common.hw.HwCode`
+    :param env: The environmental variables of the zygote.
+    :type env: :class:`dict`
+    """
+
+    def __init__(self, hwcode, env):
+        #: The :class:`~railgun.common.hw.HwCode` of this zygote.
+        self.hwcode = hwcode
+        #: The modules to be preloaded, besides the scorer stack.
+        self.preload = []
+        if hwcode.runner_params is not None:
+            self.preload = [
+                m.strip()
+                for m in (hwcode.runner_params.get('preload') or '').split(',')
+                if m.strip()
+            ]
+        self.env = env
+        self.proc = None
+
+    def start(self):
+        """Start the zygote process and wait until it is ready.
+
+        :raises: :class:`ZygoteError` if the zygote cannot be started.
+        """
+        self.proc = subprocess.Popen(
+            [sys.executable, '-m', 'pyhost.zygote'] + self.preload,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            env=self.env,
+            close_fds=True
+        )
+        try:
+            msg = self.recv(ZYGOTE_START_TIMEOUT)
+            if not msg or not msg.get('ready'):
+                raise ZygoteError('Zygote is not ready.')
+        except Exception:
+            self.stop()
+            raise
+
+    def stop(self):
+        """Kill the zygote process."""
+        if self.proc is not None:
+            if self.proc.poll() is None:
+                self.proc.kill()
+                self.proc.wait()
+            self.proc.stdin.close()
+            self.proc.stdout.close()
+            self.proc = None
+
+    def alive(self):
+        """Whether the zygote process is running?"""
+        return self.proc is not None and self.proc.poll() is None
+
+    def send(self, obj):
+        self.proc.stdin.write(json.dumps(obj) + '\n')
+        self.proc.stdin.flush()
+
+    def recv(self, timeout=None):
+        """Receive a message from the zygote.
+
+        :param timeout: Seconds to wait, or :data:`None` to wait forever.
+        :return: The message object, or :data:`None` if timeout.
+        :raises: :class:`ZygoteError` if the zygote has exited.
+        """
+        if timeout is not None:
+            ready = select.select([self.proc.stdout], [], [], timeout)[0]
+            if not ready:
+                return None
+        line = self.proc.stdout.readline()
+        if not line:
+            raise ZygoteError('Zygote has exited.')
+        msg = json.loads(line)
+        if 'error' in msg:
+            raise ZygoteError(msg['error'])
+        return msg
+
+    def execute(self, entry, timeout=None, output_limit=None, head_size=None,
+                tail_size=None, cwd=None, env=None, usage=None, sandbox=None,
+                **kwargs):
+        """Run the Python script `entry` in a child of the zygote, and
+        report the score.  The arguments are the same as
+        :func:`~railgun.common.osutil.execute`, except that `entry` is the
+        path of the script.
+
+        :return: (exit code, stdout, stderr)
+        :raises: :class:`~railgun.runner.errors.ScoreTamperedError` if the
+            submission has reported more than one score.
+        """
+        fifodir = tempfile.mkdtemp(prefix='zygote-',
+                                   dir=runconfig.TEMPORARY_DIR)
+        try:
+            pipes = []
+            for name in ('stdout', 'stderr'):
+                path = os.path.join(fifodir, name)
+                os.mkfifo(path, 0600)
+                # Open the reading end first, so that the zygote will not
+                # block on opening the writing end.
+                fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+                pipes.append(os.fdopen(fd, 'rb'))
+            self.send({
+                'entry': entry,
+                'cwd': cwd,
+                'env': env,
+                'stdout': os.path.join(fifodir, 'stdout'),
+                'stderr': os.path.join(fifodir, 'stderr'),
+                'cgroup': sandbox.path if sandbox else None,
+                'rlimits': sandbox.rlimits() if sandbox else [],
+            })
+            msg = self.recv(ZYGOTE_START_TIMEOUT)
+            if msg is None or 'pid' not in msg:
+                raise ZygoteError('Zygote did not start the process.')
+            proc = ZygoteProcess(self, msg['pid'], pipes[0], pipes[1])
+            if sandbox is not None:
+                sandbox.attach(proc)
+            try:
+                result = supervise(proc, timeout, output_limit, head_size,
+                                   tail_size, usage)
+            except BaseException:
+                # `supervise` has killed the process and received the exit
+                # code, unless the zygote itself is broken.
+                if proc.returncode is None:
+                    kill_process_group(proc.pid)
+                    self.stop()
+                raise
+        except ZygoteError:
+            # The zygote is broken or out of sync, start a new one next time.
+            self.stop()
+            raise
+        finally:
+            shutil.rmtree(fifodir, ignore_errors=True)
+
+        self.report((env or {}).get('RAILGUN_HANDID'), proc.scores)
+        return result
+
+    def report(self, handid, scores):
+        """Post the score reported by the submission process.
+
+        :param handid: The uuid of the submission.
+        :type handid: :class:`str`
+        :param scores: The score objects received from the zygote.
+        :type scores: :class:`list`
+        """
+        if not scores:
+            # The submission exited before reporting the score, let the
+            # runner queue report the exit code.
+            return
+        if len(scores) > 1 or not isinstance(scores[0], dict) or \
+                scores[0].get('uuid') != handid:
+            raise ScoreTamperedError()
+        ApiClient(runconfig.WEBSITE_API_BASEURL).report(
+            handid, HwScore.from_plain(scores[0]))
+
+
+class ZygotePool(object):
+    """Keep the :class:`Zygote` processes of this runner process.
+
+    :param max_size: Maximum number of zygotes.  The least recently used
+        zygote will be stopped if exceeded.
+    :type max_size: :class:`int`
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._zygotes = OrderedDict()
+        self._pid = os.getpid()
+
+    def get(self, host):
+        """Get a running zygote for the given Python host, starting it if
+        necessary.
+
+        :param host: The Python runner host.
+        :type host: :class:`~railgun.runner.host.PythonHost`
+        :return: The :class:`Zygote`, or :data:`None` if it cannot be
+            started.
+        """
+        # The zygotes of the parent process cannot be used after fork.
+        if self._pid != os.getpid():
+            self._zygotes = OrderedDict()
+            self._pid = os.getpid()
+
+        key = (host.hw.uuid, host.hwcode.lang)
+        zygote = self._zygotes.pop(key, None)
+        if zygote is not None and \
+                (zygote.hwcode is not host.hwcode or not zygote.alive()):
+            zygote.stop()
+            zygote = None
+        if zygote is None:
+            env = os.environ.copy()
+            env['PYTHONPATH'] = host.config['PYTHONPATH']
+            env['RAILGUN_ROOT'] = runconfig.RAILGUN_ROOT
+            zygote = Zygote(host.hwcode, env)
+            try:
+                zygote.start()
+            except Exception:
+                logger.exception(
+                    'Cannot start Python zygote for homework %(hwid)s.' %
+                    {'hwid': host.hw.uuid}
+                )
+                return None
+        self._zygotes[key] = zygote
+        while len(self._zygotes) > self.max_size:
+            self._zygotes.popitem(last=False)[1].stop()
+        return zygote
+
+
+#: The global :class:`ZygotePool` of this runner process.
+zygotes = ZygotePool(runconfig.RUNNER_PYTHON_ZYGOTE_MAX)
@@ -33,19 +33,51 @@ class UserHostClient(object):
             next request.
         :type expires: :class:`int`
 
-        :return: The user name if available, :data:`None` otherwise.
+        :return: (`user`, `token`) if available, :data:`None` otherwise.
+            The lease `token` is required to release or renew the user.
         """
         ret = self._communicate('get %d' % expires).split(' ')
         if ret[0] == 'okay':
-            return ret[1]
+            return ret[1], ret[2]
 
-    def release(self, user):
+    def release(self, user, token):
         """Release the acquired user immediately.
 
         :param user: The name of acquired user.
         :type user: :class:`str`
+        :param token: The lease token returned by :meth:`acquire`.
+        :type token: :class:`str`
 
         :return: :data:`True` if succeeded, :data:`False` otherwise.
         """
-        ret = self._communicate('put %s' % user)
+        ret = self._communicate('put %s %s' % (user, token))
         return ret == 'okay'
+
+    def renew(self, user, token, expires=10):
+        """Extend the lease of an acquired user, which will expire in
+        `expires` seconds from now.
+
+        :param user: The name of acquired user.
+        :type user: :class:`str`
+        :param token: The lease token returned by :meth:`acquire`.
+        :type token: :class:`str`
+        :param expires: Seconds before the user is exipred and recycled for
+            next request.
+        :type expires: :class:`int`
+
+        :return: :data:`True` if succeeded, :data:`False` if the user has
+            expired or is not held by `token`.
+        """
+        ret = self._communicate('renew %s %s %d' % (user, token, expires))
+        return ret == 'okay'
+
+    def free(self):
+        """Count the free users.
+
+        :return: The number of free users.
+        :rtype: :class:`int`
+        """
+        ret = self._communicate('free').split(' ')
+        if ret[0] != 'okay':
+            raise RuntimeError('Could not count the free users.')
+        return int(ret[1])
@@ -20,19 +20,32 @@ class UserHostServer(object):
     def _serve_request(self, conn):
         """Serve a incoming request."""
         f = conn.makefile('rw')
-        act, arg = tuple(v for v in f.readline().strip().split(' ') if v)
+        args = [v for v in f.readline().strip().split(' ') if v]
+        act, arg = args[0], (args[1] if len(args) > 1 else None)
         if act == 'get':
-            user = self.pool.acquire(int(arg))
-            if user:
-                print('get %s -> okay %s' % (arg, user))
-                f.write('okay %s\n' % user)
+            lease = self.pool.acquire(int(arg))
+            if lease:
+                print('get %s -> okay %s' % (arg, lease[0]))
+                f.write('okay %s %s\n' % lease)
             else:
                 print('get %s -> fail' % arg)
                 f.write('error\n')
         elif act == 'put':
-            print('put %s -> okay' % arg)
-            self.pool.release(arg)
-            f.write('okay\n')
+            if self.pool.release(arg, args[2]):
+                print('put %s -> okay' % arg)
+                f.write('okay\n')
+            else:
+                print('put %s -> fail' % arg)
+                f.write('error\n')
+        elif act == 'renew':
+            if self.pool.renew(arg, args[2], int(args[3])):
+                print('renew %s %s -> okay' % (arg, args[3]))
+                f.write('okay\n')
+            else:
+                print('renew %s %s -> fail' % (arg, args[3]))
+                f.write('error\n')
+        elif act == 'free':
+            f.write('okay %d\n' % self.pool.count_free())
         else:
             print('unknown: %s' % act)
             f.write('unknown action\n')
@@ -6,14 +6,22 @@
 # This file is released under BSD 2-clause license.
 
 import time
+import uuid
 
 
 class UserPool(object):
-    """Manages the available account."""
+    """Manages the available account.
+
+    Each acquired user is given a random lease token, which must be
+    presented to :meth:`renew` and :meth:`release`.  A runner whose lease
+    has expired thus cannot renew or release the user after it has been
+    given to another runner.
+    """
 
     def __init__(self, users):
         self.users = users
         self._expires = {u: 0 for u in users}
+        self._tokens = {u: None for u in users}
 
     def current_time(self):
         """Get the current timestamp."""
@@ -26,19 +34,58 @@ class UserPool(object):
             next request.
         :type expires: :class:`int`
 
-        :return: The user name if available, :data:`None` otherwise.
+        :return: (`user`, `token`) if available, :data:`None` otherwise.
         """
         now_time = self.current_time()
         for u in self.users:
             user_expire = self._expires[u]
             if user_expire < now_time:
                 self._expires[u] = now_time + expires
-                return u
+                self._tokens[u] = uuid.uuid4().hex
+                return u, self._tokens[u]
+
+    def count_free(self):
+        """Count the users that are not acquired or already expired."""
+        now_time = self.current_time()
+        return sum(1 for u in self.users if self._expires[u] < now_time)
 
-    def release(self, user):
+    def _holds(self, user, token):
+        """Whether `token` is the unexpired lease of `user`?"""
+        return (self._tokens.get(user) is not None and
+                self._tokens[user] == token and
+                self._expires[user] >= self.current_time())
+
+    def release(self, user, token):
         """Release the acquired user immediately.
 
         :param user: The name of acquired user.
         :type user: :class:`str`
+        :param token: The lease token returned by :meth:`acquire`.
+        :type token: :class:`str`
+
+        :return: :data:`True` if succeeded, :data:`False` if the user is
+            not held by `token`.
         """
+        if not self._holds(user, token):
+            return False
         self._expires[user] = 0
+        self._tokens[user] = None
+        return True
+
+    def renew(self, user, token, expires=10):
+        """Extend the lease of an acquired user.
+
+        :param user: The name of acquired user.
+        :type user: :class:`str`
+        :param token: The lease token returned by :meth:`acquire`.
+        :type token: :class:`str`
+        :param expires: Seconds from now before the user is expired.
+        :type expires: :class:`int`
+
+        :return: :data:`True` if succeeded, :data:`False` if the user is
+            unknown, not held by `token`, or has already expired.
+        """
+        if not self._holds(user, token):
+            return False
+        self._expires[user] = self.current_time() + expires
+        return True
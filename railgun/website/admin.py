@@ -29,6 +29,7 @@ from .archivefile import unzip
 from flask_pagedown import PageDown
 from flask_pagedown.fields import PageDownField
 from railgun.runner.context import app as runner_app
+from railgun.runner.cancel import cancel_handins
 from .context import app, db
 from .models import User, Handin, FinalScore, Vote, VoteItem, assign_values
 from .forms import AdminUserEditForm, CreateUserForm, VoteJsonEditForm,AddproblemForm,Problem_edit_Form,AddcourseForm,Course_Choose_Form,User_ClassForm
@@ -924,6 +925,50 @@ def runqueue_rerun(handid):
     return redirect(nexturl)
 
 
+@bp.route('/runqueue/cancel/<handid>/')
+@admin_required
+def runqueue_cancel(handid):
+    """Cancel a pending or running submission.  Its score will be set to
+    0.0, and the state to `Rejected`.  The runner will skip the submission,
+    or kill its processes if it is already running.
+
+    The visitor will be redirected to the query string argument `next`,
+    or :func:`~railgun.website.admin.handins` if `next` is not given.
+
+    :route: /admin/runqueue/cancel/<handid>/
+    :method: GET
+
+    :param handid: The uuid of submission.
+    :type handid: :class:`str`
+    """
+    # We must not use flask.ext.babel.lazy_gettext, because we'll going to
+    # store it in the database!
+    from railgun.common.lazy_i18n import lazy_gettext
+
+    nexturl = request.args.get('next') or url_for('.handins')
+    try:
+        updated = db.session.query(Handin) \
+            .filter(Handin.uuid == handid) \
+            .filter(Handin.state.in_(['Pending', 'Running'])) \
+            .update({
+                'state': 'Rejected',
+                'result': lazy_gettext('Submission cancelled by admin.'),
+                'partials': [],
+                'score': 0.0,
+            }, synchronize_session=False)
+        db.session.commit()
+        if not updated:
+            flash(_('The submission is neither pending nor running.'),
+                  'warning')
+        else:
+            cancel_handins([handid])
+            flash(_('The submission is cancelled.'), 'success')
+    except Exception:
+        app.logger.exception('Could not cancel the submission %s.' % handid)
+        flash(_('Could not cancel the submission.'), 'danger')
+    return redirect(nexturl)
+
+
 @bp.route('/runqueue/clear/')
 @admin_required
 def runqueue_clear():
@@ -1087,6 +1132,72 @@ def hwscores(hwid):
     )
 
 
+@bp.route('/hwusage/')
+@admin_required
+def hwusage():
+    """The admin page to view the resource usage of the submissions of
+    each homework, for capacity planning and finding the homework whose
+    submissions run away.  The homework consuming the most CPU time are
+    listed first.
+
+    The view accepts a query string argument `csvfile`, and if `csvfile` is
+    set to 1, a csv data file will be responded to the visitor instead of
+    a html table page.
+
+    :route: /admin/hwusage/
+    :method: GET
+    :template: admin.csvdata.html
+    """
+    q = (db.session.query(Handin.hwid,
+                          func.count(Handin.cpu_time).label('count'),
+                          func.sum(Handin.cpu_time).label('total_cpu'),
+                          func.avg(Handin.cpu_time).label('avg_cpu'),
+                          func.max(Handin.cpu_time).label('max_cpu'),
+                          func.avg(Handin.wall_time).label('avg_wall'),
+                          func.max(Handin.wall_time).label('max_wall'),
+                          func.max(Handin.max_rss).label('max_rss')).
+         filter(Handin.cpu_time != None).
+         group_by(Handin.hwid))
+
+    def rounded(v):
+        return round(v or 0.0, 3)
+
+    csvdata = []
+    for rec in q:
+        hw = g.homeworks.get_by_uuid(rec.hwid)
+        csvdata.append({
+            'name': hw.info.name if hw else rec.hwid,
+            'count': rec.count,
+            'total_cpu': rounded(rec.total_cpu),
+            'avg_cpu': rounded(rec.avg_cpu),
+            'max_cpu': rounded(rec.max_cpu),
+            'avg_wall': rounded(rec.avg_wall),
+            'max_wall': rounded(rec.max_wall),
+            'max_rss': round((rec.max_rss or 0) / 1024.0, 1),
+        })
+    csvdata.sort(key=lambda d: d['total_cpu'], reverse=True)
+
+    raw_headers = ['name', 'count', 'total_cpu', 'avg_cpu', 'max_cpu',
+                   'avg_wall', 'max_wall', 'max_rss']
+    display_headers = [
+        lazy_gettext('Homework'),
+        lazy_gettext('Submissions'),
+        lazy_gettext('Total CPU (s)'),
+        lazy_gettext('Average CPU (s)'),
+        lazy_gettext('Max CPU (s)'),
+        lazy_gettext('Average Wall (s)'),
+        lazy_gettext('Max Wall (s)'),
+        lazy_gettext('Max Memory (MB)'),
+    ]
+    return _make_csv_report(
+        csvdata,
+        display_headers,
+        raw_headers,
+        _('Resource Usage of Submissions'),
+        'usage'
+    )
+
+
 @bp.route('/get_longblob_patch_command/')
 @admin_required
 def get_longblob_patch_command():
@@ -1126,6 +1237,36 @@ def get_longblob_patch_command():
     )
 
 
+@bp.route('/get_handin_columns_patch_command/')
+@admin_required
+def get_handin_columns_patch_command():
+    """`db.create_all()` does not add new columns to existing tables, so a
+    database created by an earlier version of Railgun lacks the columns
+    added to :class:`~railgun.website.models.Handin` since then (for example,
+    `cpu_time`, `wall_time` and `max_rss`, which store the resource usage of
+    submissions).
+
+    This view provides the SQL commands to add the missing columns.  It
+    gives nothing if the table is already up to date.
+    """
+    from sqlalchemy import inspect
+
+    table = Handin.__table__
+    dialect = db.engine.dialect
+    existing = set(c['name'] for c in
+                   inspect(db.engine).get_columns(table.name))
+    commands = [
+        'ALTER TABLE %s ADD COLUMN %s %s;' % (
+            table.name, c.name, c.type.compile(dialect=dialect))
+        for c in table.columns if c.name not in existing
+    ]
+    return make_response(
+        '\n'.join(commands),
+        200,
+        {'Content-Type': 'text/plain'}
+    )
+
+
 def make_charts_data(hw):
     """Make hwcharts data object."""
     ACCEPTED_AND_REJECTED = ('Accepted', 'Rejected')
@@ -1547,6 +1688,8 @@ navigates.add(
                                endpoint='admin.handins'),
             NaviItem.make_view(title=lazy_gettext('Scores'),
                                endpoint='admin.scores'),
+            NaviItem.make_view(title=lazy_gettext('Resource Usage'),
+                               endpoint='admin.hwusage'),
             NaviItem.make_view(title=lazy_gettext('Vote'),
                                endpoint='admin.edit_vote'),
             NaviItem.make_view(title=lazy_gettext('Vote Signup'),
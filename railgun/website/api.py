@@ -13,6 +13,7 @@ from flask import request, make_response
 from .context import app, db, csrf
 from .models import Handin, FinalScore
 from railgun.common.hw import HwScore
+from railgun.common.osutil import ResourceUsage
 from railgun.common.crypto import DecryptMessage
 from railgun.common.lazy_i18n import lazy_gettext
 
@@ -125,6 +126,8 @@ def api_handin_report(uuid):
         handin.result = lazy_gettext('Your submission is rejected.')
     handin.compile_error = score.compile_error
     handin.partials = score.partials
+    if score.usage is not None:
+        handin.set_usage(score.usage)
 
     # update hwscore table and set the final score of this homework
     if handin.is_accepted():
@@ -217,7 +220,8 @@ def api_handin_proclog(uuid):
         {"uuid": uuid of submission,
          "exitcode": The exitcode of the process,
          "stdout": The standard output of the process,
-         "stderr": The standard error output of the process}
+         "stderr": The standard error output of the process,
+         "usage": ResourceUsage of the processes, or null}
 
     :param uuid: The uuid of submission.
     :type uuid: :class:`str`
@@ -246,6 +250,8 @@ def api_handin_proclog(uuid):
         handin.exitcode = obj['exitcode']
         handin.stdout = obj['stdout']
         handin.stderr = obj['stderr']
+        if obj.get('usage'):
+            handin.set_usage(ResourceUsage.from_plain(obj['usage']))
         db.session.commit()
     except Exception:
         app.logger.exception('Cannot log proccess of submission(%s).' % uuid)
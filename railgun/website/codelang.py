@@ -32,7 +32,10 @@ from flask.ext.login import current_user
 from .context import app, db
 from .forms import UploadHandinForm, AddressHandinForm, CsvHandinForm
 from .models import Handin
+from .runtime import expected_runtime
 from railgun.runner.tasks import run_python, run_java, run_netapi, run_input
+from railgun.runner.priority import submission_priority
+from railgun.runner.cancel import cancel_handins, uncancel_handins
 
 
 class CodeLanguage(object):
@@ -81,6 +84,86 @@ class CodeLanguage(object):
         db.session.commit()
         return handin
 
+    def queue_options(self, handid, hw, fair=True):
+        """Get the options for :meth:`celery.Task.apply_async` to put a
+        submission into the runner queue.
+
+        The priority lane is decided by the next deadline of the homework,
+        the expected running time of the submission, and by the other
+        pending submissions of the user if `fair` is :data:`True`.  See
+        :mod:`railgun.runner.priority` for more details.
+
+        :param handid: The submission uuid.
+        :type handid: :class:`str`
+        :param hw: The homework instance.
+        :type hw: :class:`~railgun.common.hw.Homework`
+        :param fair: Whether to count the pending submissions of
+            :data:`~flask.ext.login.current_user`?
+        :type fair: :class:`bool`
+        """
+        pending = 0
+        if fair:
+            pending = (Handin.query.
+                       filter(Handin.user_id == current_user.id).
+                       filter(Handin.state == 'Pending').
+                       filter(Handin.uuid != handid).count())
+        cost = expected_runtime(hw.uuid, self.lang)
+        return {'priority': submission_priority(hw, pending, cost=cost)}
+
+    def supersede_pending(self, handid, hw):
+        """Reject the older pending submissions of
+        :data:`~flask.ext.login.current_user` for the given homework, which
+        are superseded by the new submission, and cancel them in the runner
+        queue.  Does nothing if ``config.SUPERSEDE_PENDING_HANDINS`` is
+        disabled.
+
+        :param handid: The uuid of the new submission.
+        :type handid: :class:`str`
+        :param hw: The homework instance.
+        :type hw: :class:`~railgun.common.hw.Homework`
+        """
+        if not app.config['SUPERSEDE_PENDING_HANDINS']:
+            return
+        # We must not use flask.ext.babel.lazy_gettext, because we're going
+        # to store it in the database!
+        from railgun.common.lazy_i18n import lazy_gettext as stored_gettext
+
+        older = (db.session.query(Handin.id, Handin.uuid).
+                 filter(Handin.user_id == current_user.id).
+                 filter(Handin.hwid == hw.uuid).
+                 filter(Handin.state == 'Pending').
+                 filter(Handin.uuid != handid).
+                 with_for_update().
+                 all())
+        # The rows are locked on the databases supporting FOR UPDATE, but
+        # not on SQLite.  So each row is updated only if still pending, and
+        # only the rows actually updated are cancelled, leaving alone the
+        # submissions started by the runner in the meantime.
+        handids = []
+        for h in older:
+            updated = (db.session.query(Handin).
+                       filter(Handin.id == h.id).
+                       filter(Handin.state == 'Pending').
+                       update({
+                           'state': 'Rejected',
+                           'result': stored_gettext(
+                               'Superseded by a newer submission.'),
+                           'partials': [],
+                           'score': 0.0,
+                       }, synchronize_session=False))
+            if updated:
+                handids.append(h.uuid)
+        db.session.commit()
+        if not handids:
+            return
+        try:
+            cancel_handins(handids)
+        except Exception:
+            # The runner will report to the rejected submissions in vain,
+            # which is harmless.
+            app.logger.exception('Cannot cancel the superseded submissions '
+                                 '%s.' % handids)
+
     def upload_form(self, hw):
         """Generate an upload form for the given homework in this language.
         Derived classes must override this method.
@@ -163,6 +246,9 @@ class CodeLanguage(object):
             # re-raise this exception
             raise
 
+        # the older pending submissions need not be run any more
+        self.supersede_pending(handid, hw)
+
     def do_rerun(self, handid, hw, stored_content):
         """Called by :meth:`rerun` to reput the submission into runqueue.
         Derived classes should implement this.
@@ -205,6 +291,9 @@ class CodeLanguage(object):
                 handin.scale = 1.0
             db.session.commit()
 
+            # The submission may have been superseded or cancelled before,
+            # and the runner would skip it without the flag cleared.
+            uncancel_handins([handid])
             self.do_rerun(handid, hw, stored_content)
         except Exception:
             # if we cannot post to run queue, modify the handin status to error
@@ -281,7 +370,10 @@ class PythonLanguage(StandardLanguage):
     def do_rerun(self, handid, hw, stored_content):
         print 'this is python'
         fcnt, fname = stored_content['fcnt'], stored_content['fname']
-        run_python.delay(handid, hw.uuid, fcnt, {'filename': fname})
+        run_python.apply_async(
+            (handid, hw.uuid, fcnt, {'filename': fname}),
+            **self.queue_options(handid, hw, fair=False)
+        )
 
     def do_handle_upload(self, handid, hw, form):
         print 'this is python'
@@ -290,7 +382,10 @@ class PythonLanguage(StandardLanguage):
         # We store the user uploaded file in local storage!
         self.store_content(handid, {'fname': filename, 'fcnt': fcnt})
         # Push the submission to run queue
-        run_python.delay(handid, hw.uuid, fcnt, {'filename': filename})
+        run_python.apply_async(
+            (handid, hw.uuid, fcnt, {'filename': filename}),
+            **self.queue_options(handid, hw)
+        )
 
 
 class JavaLanguage(StandardLanguage):
@@ -306,7 +401,10 @@ class JavaLanguage(StandardLanguage):
     def do_rerun(self, handid, hw, stored_content):
         print 'this is java'
         fcnt, fname = stored_content['fcnt'], stored_content['fname']
-        run_java.delay(handid, hw.uuid, fcnt, {'filename': fname})
+        run_java.apply_async(
+            (handid, hw.uuid, fcnt, {'filename': fname}),
+            **self.queue_options(handid, hw, fair=False)
+        )
 
     def do_handle_upload(self, handid, hw, form):
         print 'this is java'
@@ -315,7 +413,10 @@ class JavaLanguage(StandardLanguage):
         # We store the user uploaded file in local storage!
         self.store_content(handid, {'fname': filename, 'fcnt': fcnt})
         # Push the submission to run queue
-        run_java.delay(handid, hw.uuid, fcnt, {'filename': filename})
+        run_java.apply_async(
+            (handid, hw.uuid, fcnt, {'filename': filename}),
+            **self.queue_options(handid, hw)
+        )
 
 
 class NetApiLanguage(CodeLanguage):
@@ -328,13 +429,19 @@ class NetApiLanguage(CodeLanguage):
         super(NetApiLanguage, self).__init__('netapi', 'NetAPI')
 
     def do_rerun(self, handid, hw, stored_content):
-        run_netapi.delay(handid, hw.uuid, stored_content, {})
+        run_netapi.apply_async(
+            (handid, hw.uuid, stored_content, {}),
+            **self.queue_options(handid, hw, fair=False)
+        )
 
     def do_handle_upload(self, handid, hw, form):
         # We store the user uploaded file in local storage!
         self.store_content(handid, form.address.data)
         # Push the submission to run queue
-        run_netapi.delay(handid, hw.uuid, form.address.data, {})
+        run_netapi.apply_async(
+            (handid, hw.uuid, form.address.data, {}),
+            **self.queue_options(handid, hw)
+        )
 
     def do_handle_download(self, stored_content):
         resp = make_response(stored_content)
@@ -354,13 +461,19 @@ class InputLanguage(CodeLanguage):
         super(InputLanguage, self).__init__('input', 'CsvData')
 
     def do_rerun(self, handid, hw, stored_content):
-        run_input.delay(handid, hw.uuid, stored_content, {})
+        run_input.apply_async(
+            (handid, hw.uuid, stored_content, {}),
+            **self.queue_options(handid, hw, fair=False)
+        )
 
     def do_handle_upload(self, handid, hw, form):
         # We store the user uploaded file in local storage!
         self.store_content(handid, form.csvdata.data)
         # Push the submission to run queue
-        run_input.delay(handid, hw.uuid, form.csvdata.data, {})
+        run_input.apply_async(
+            (handid, hw.uuid, form.csvdata.data, {}),
+            **self.queue_options(handid, hw)
+        )
 
     def do_handle_download(self, stored_content):
         resp = make_response(stored_content)
@@ -265,6 +265,17 @@ class Handin(db.Model):
     #: serialized by :mod:`pickle` and stored as byte sequence.
     partials = db.Column(LongPickleType)
 
+    #: The user and system CPU seconds of all the processes of this
+    #: submission, collected by the runner.
+    cpu_time = db.Column(db.Float)
+
+    #: The wall clock seconds of all the processes of this submission.
+    wall_time = db.Column(db.Float)
+
+    #: The maximum resident set size (in kilobytes) of the processes of
+    #: this submission.
+    max_rss = db.Column(db.Integer)
+
     #: Link with the associated user, usually mapped to a foreign key.
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
 
@@ -324,6 +335,16 @@ class Handin(db.Model):
         """
         return unicode(self.compile_error) if self.compile_error else u''
 
+    def set_usage(self, usage):
+        """Store the resource usage of this submission.
+
+        :param usage: The resource usage reported by the runner.
+        :type usage: :class:`~railgun.common.osutil.ResourceUsage`
+        """
+        self.cpu_time = usage.cpu_time
+        self.wall_time = usage.wall
+        self.max_rss = usage.maxrss
+
 
 class Vote(db.Model):
     """An instance of :class:`Vote` is a vote initiated by an admini."""
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# @file: railgun/website/runtime.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# This file is released under BSD 2-clause license.
+
+"""Estimate how long a new submission will run from the earlier ones.
+
+The runner reports the wall clock time of each submission, which is
+stored in :attr:`~railgun.website.models.Handin.wall_time`.  The running
+time differs a lot among the homework (a NetAPI submission may take tens
+of seconds, and a small Python one only a second), but is similar among
+the submissions of the same homework in the same language.  So the
+expected running time of a new submission is the median of the latest
+``config.RUNNER_SJF_HISTORY`` submissions of the same homework and
+language, and is used to choose the priority lane of the submission (see
+:mod:`railgun.runner.priority`).
+"""
+
+from .context import app, db, cache
+from .models import Handin
+
+
+class RuntimeStats(object):
+    """The distribution of the running time of some submissions.
+
+    :param samples: The wall clock seconds of the submissions.
+    :type samples: :class:`list` of :class:`float`
+    """
+
+    def __init__(self, samples):
+        samples = sorted(samples)
+
+        #: The number of submissions.
+        self.count = len(samples)
+
+        #: The median of the running time, or :data:`None` if no sample.
+        self.median = percentile(samples, 0.5)
+
+    def __repr__(self):
+        return '<RuntimeStats(count=%d, median=%r)>' % (
+            self.count, self.median)
+
+
+def percentile(samples, q):
+    """Get the `q`-quantile of sorted `samples` by linear interpolation.
+
+    :param samples: The sorted samples.
+    :type samples: :class:`list`
+    :param q: The quantile, between 0.0 and 1.0.
+    :type q: :class:`float`
+    :return: The quantile value, or :data:`None` if `samples` is empty.
+    """
+    if not samples:
+        return None
+    pos = (len(samples) - 1) * q
+    lo = int(pos)
+    hi = min(lo + 1, len(samples) - 1)
+    return samples[lo] + (samples[hi] - samples[lo]) * (pos - lo)
+
+
+@cache.memoize(timeout=app.config['RUNNER_SJF_MODEL_TTL'])
+def runtime_stats(hwid, lang):
+    """Get the :class:`RuntimeStats` of the latest completed submissions.
+
+    The result is cached for ``config.RUNNER_SJF_MODEL_TTL`` seconds.
+
+    :param hwid: The homework uuid, or :data:`None` for all homework.
+    :type hwid: :class:`str`
+    :param lang: The programming language.
+    :type lang: :class:`str`
+    """
+    q = (db.session.query(Handin.wall_time).
+         filter(Handin.lang == lang).
+         filter(Handin.state.in_(['Accepted', 'Rejected'])).
+         filter(Handin.wall_time != None))
+    if hwid is not None:
+        q = q.filter(Handin.hwid == hwid)
+    q = q.order_by(Handin.id.desc()).limit(app.config['RUNNER_SJF_HISTORY'])
+    return RuntimeStats([r.wall_time for r in q])
+
+
+def expected_runtime(hwid, lang):
+    """Get the expected running time of a new submission.
+
+    If the homework does not have enough submissions in this language,
+    the submissions of all the homework in this language are used.
+
+    :param hwid: The homework uuid.
+    :type hwid: :class:`str`
+    :param lang: The programming language.
+    :type lang: :class:`str`
+    :return: The expected wall clock seconds, or :data:`None` if unknown.
+    """
+    min_samples = app.config['RUNNER_SJF_MIN_SAMPLES']
+    for key in (hwid, None):
+        stats = runtime_stats(key, lang)
+        if stats.count >= min_samples:
+            return stats.median
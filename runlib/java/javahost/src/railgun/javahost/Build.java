@@ -0,0 +1,534 @@
+// ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+// @file: runlib/java/javahost/src/railgun/javahost/Build.java
+// ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+// This file is released under BSD 2-clause license.
+
+package railgun.javahost;
+
+import java.io.File;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.InputStream;
+import java.io.OutputStream;
+import java.io.PrintWriter;
+import java.net.InetAddress;
+import java.net.URL;
+import java.net.URLClassLoader;
+import java.nio.file.Files;
+import java.nio.file.StandardCopyOption;
+import java.text.SimpleDateFormat;
+import java.util.ArrayList;
+import java.util.Arrays;
+import java.util.Date;
+import java.util.Enumeration;
+import java.util.List;
+import java.util.Map;
+import java.util.jar.JarEntry;
+import java.util.jar.JarFile;
+
+import javax.tools.JavaCompiler;
+import javax.tools.StandardJavaFileManager;
+import javax.tools.ToolProvider;
+import javax.xml.parsers.DocumentBuilderFactory;
+import javax.xml.transform.OutputKeys;
+import javax.xml.transform.Transformer;
+import javax.xml.transform.TransformerFactory;
+import javax.xml.transform.dom.DOMSource;
+import javax.xml.transform.stream.StreamResult;
+
+import org.w3c.dom.Document;
+import org.w3c.dom.Element;
+
+import org.apache.tools.ant.Project;
+import org.apache.tools.ant.taskdefs.optional.junit.AggregateTransformer;
+import org.apache.tools.ant.taskdefs.optional.junit.XMLResultAggregator;
+import org.apache.tools.ant.types.FileSet;
+
+import org.jacoco.core.analysis.Analyzer;
+import org.jacoco.core.analysis.CoverageBuilder;
+import org.jacoco.core.analysis.IBundleCoverage;
+import org.jacoco.core.data.ExecutionDataStore;
+import org.jacoco.core.data.ExecutionDataWriter;
+import org.jacoco.core.data.SessionInfoStore;
+import org.jacoco.core.instr.Instrumenter;
+import org.jacoco.core.runtime.IRuntime;
+import org.jacoco.core.runtime.LoggerRuntime;
+import org.jacoco.core.runtime.RuntimeData;
+import org.jacoco.report.DirectorySourceFileLocator;
+import org.jacoco.report.FileMultiReportOutput;
+import org.jacoco.report.IReportVisitor;
+import org.jacoco.report.MultiReportVisitor;
+import org.jacoco.report.csv.CSVFormatter;
+import org.jacoco.report.html.HTMLFormatter;
+import org.jacoco.report.xml.XMLFormatter;
+
+import org.junit.runner.Description;
+import org.junit.runner.JUnitCore;
+import org.junit.runner.Result;
+import org.junit.runner.notification.Failure;
+import org.junit.runner.notification.RunListener;
+
+import com.puppycrawl.tools.checkstyle.Checker;
+import com.puppycrawl.tools.checkstyle.ConfigurationLoader;
+import com.puppycrawl.tools.checkstyle.DefaultLogger;
+import com.puppycrawl.tools.checkstyle.PropertiesExpander;
+import com.puppycrawl.tools.checkstyle.api.CheckstyleException;
+import com.puppycrawl.tools.checkstyle.api.Configuration;
+
+/**
+ * Build and test a Java submission, producing the same files as the
+ * {@code compile.sh} and {@code coverage/build.xml} of the homework.
+ *
+ * <ol>
+ *   <li>Check the {@code checkstyle} files, and write the result to
+ *       {@code codestyle}.</li>
+ *   <li>Copy the {@code sources} files into {@code buildDir}.</li>
+ *   <li>Compile all the sources in {@code buildDir} into {@code classes}.
+ *       </li>
+ *   <li>Run the {@code *Test*} classes by JUnit, with the classes loaded
+ *       and instrumented by JaCoCo in a fresh class loader.</li>
+ *   <li>Write the JUnit and JaCoCo reports into {@code report}.</li>
+ * </ol>
+ *
+ * <p>If {@code classesJar} is given, it should contain the classes of
+ * all the other sources in {@code buildDir}, precompiled by the homework
+ * cache task.  The classes are extracted into {@code classes}, and only the
+ * {@code sources} are compiled.</p>
+ *
+ * <p>The request keys are: {@code workdir}, {@code buildDir},
+ * {@code sources}, {@code checkstyle}, {@code checkstyleConfig},
+ * {@code bundle}, {@code exportClasses} and {@code classesJar}.  The file
+ * lists are separated by commas.</p>
+ */
+public class Build {
+
+    final File workdir;
+    final File buildDir;
+    final File classesDir;
+    final File reportDir;
+    final List<String> sources;
+    final List<String> checkstyle;
+    final String checkstyleConfig;
+    final String bundle;
+    final boolean exportClasses;
+    final File classesJar;
+
+    public Build(Map<String, String> request) {
+        workdir = new File(request.get("workdir"));
+        buildDir = new File(workdir, request.get("buildDir"));
+        classesDir = new File(buildDir, "classes");
+        reportDir = new File(buildDir, "report");
+        sources = splitList(request.get("sources"));
+        checkstyle = splitList(request.get("checkstyle"));
+        checkstyleConfig = request.get("checkstyleConfig");
+        bundle = request.containsKey("bundle") ?
+            request.get("bundle") : "Jacoco Ant Ecample";
+        exportClasses = "true".equals(request.get("exportClasses"));
+        classesJar = request.containsKey("classesJar") ?
+            new File(request.get("classesJar")) : null;
+    }
+
+    static List<String> splitList(String value) {
+        List<String> ret = new ArrayList<String>();
+        if (value != null) {
+            for (String s : value.split(",")) {
+                if (!s.trim().isEmpty()) {
+                    ret.add(s.trim());
+                }
+            }
+        }
+        return ret;
+    }
+
+    /** Run the build, and return the exit code as {@code compile.sh}. */
+    public int run() throws Exception {
+        if (!checkstyle.isEmpty()) {
+            runCheckstyle();
+        }
+        for (String s : sources) {
+            File src = new File(workdir, s);
+            if (!src.isFile()) {
+                System.err.println("cannot find source file " + s);
+                continue;
+            }
+            Files.copy(src.toPath(), new File(buildDir, s).toPath(),
+                       StandardCopyOption.REPLACE_EXISTING);
+        }
+        if (!compile()) {
+            System.out.println("BUILD FAILED");
+            return 1;
+        }
+        runTests();
+        if (exportClasses) {
+            for (File f : classesDir.listFiles()) {
+                if (f.isFile()) {
+                    Files.copy(f.toPath(), new File(workdir, f.getName())
+                               .toPath(), StandardCopyOption.REPLACE_EXISTING);
+                }
+            }
+        }
+        System.out.println("BUILD SUCCESSFUL");
+        return 0;
+    }
+
+    void runCheckstyle() throws IOException {
+        OutputStream out = new FileOutputStream(new File(workdir, "codestyle"));
+        try {
+            Configuration config = ConfigurationLoader.loadConfiguration(
+                checkstyleConfig, new PropertiesExpander(System.getProperties()));
+            Checker checker = new Checker();
+            checker.setModuleClassLoader(Checker.class.getClassLoader());
+            checker.configure(config);
+            checker.addListener(new DefaultLogger(out, false));
+            List<File> files = new ArrayList<File>();
+            for (String s : checkstyle) {
+                files.add(new File(workdir, s));
+            }
+            checker.process(files);
+            checker.destroy();
+        } catch (CheckstyleException e) {
+            // `java -jar checkstyle.jar` does not stop `compile.sh` either.
+            e.printStackTrace();
+        } finally {
+            out.close();
+        }
+    }
+
+    static void listFiles(File dir, String suffix, List<File> result) {
+        File[] files = dir.listFiles();
+        if (files == null) {
+            return;
+        }
+        Arrays.sort(files);
+        for (File f : files) {
+            if (f.isDirectory()) {
+                listFiles(f, suffix, result);
+            } else if (f.getName().endsWith(suffix)) {
+                result.add(f);
+            }
+        }
+    }
+
+    List<File> libraries() {
+        List<File> jars = new ArrayList<File>();
+        listFiles(new File(buildDir, "lib"), ".jar", jars);
+        return jars;
+    }
+
+    boolean compile() throws IOException {
+        deleteTree(classesDir);
+        classesDir.mkdirs();
+        List<File> files = new ArrayList<File>();
+        if (classesJar != null) {
+            extractJar(classesJar, classesDir);
+            for (String s : sources) {
+                files.add(new File(buildDir, s));
+            }
+        } else {
+            listFiles(buildDir, ".java", files);
+        }
+
+        StringBuilder classpath = new StringBuilder(classesDir.getPath());
+        for (File jar : libraries()) {
+            classpath.append(File.pathSeparator).append(jar.getPath());
+        }
+        JavaCompiler javac = ToolProvider.getSystemJavaCompiler();
+        if (javac == null) {
+            throw new IllegalStateException("The service requires a JDK.");
+        }
+        StandardJavaFileManager fm = javac.getStandardFileManager(
+            null, null, null);
+        try {
+            List<String> options = Arrays.asList(
+                "-d", classesDir.getPath(), "-g",
+                "-classpath", classpath.toString());
+            return javac.getTask(
+                new PrintWriter(System.err, true), fm, null, options, null,
+                fm.getJavaFileObjectsFromFiles(files)).call();
+        } finally {
+            fm.close();
+        }
+    }
+
+    static void extractJar(File jar, File todir) throws IOException {
+        JarFile jarFile = new JarFile(jar);
+        try {
+            Enumeration<JarEntry> entries = jarFile.entries();
+            while (entries.hasMoreElements()) {
+                JarEntry entry = entries.nextElement();
+                File target = new File(todir, entry.getName());
+                if (entry.isDirectory()) {
+                    target.mkdirs();
+                    continue;
+                }
+                target.getParentFile().mkdirs();
+                InputStream in = jarFile.getInputStream(entry);
+                try {
+                    Files.copy(in, target.toPath(),
+                               StandardCopyOption.REPLACE_EXISTING);
+                } finally {
+                    in.close();
+                }
+            }
+        } finally {
+            jarFile.close();
+        }
+    }
+
+    static void deleteTree(File f) {
+        File[] children = f.listFiles();
+        if (children != null) {
+            for (File c : children) {
+                deleteTree(c);
+            }
+        }
+        f.delete();
+    }
+
+    /**
+     * Load the classes compiled from the submission, instrumented by
+     * JaCoCo.  Other classes, including JUnit, are loaded by the service.
+     */
+    static class InstrumentingLoader extends URLClassLoader {
+        final File classesDir;
+        final Instrumenter instrumenter;
+
+        InstrumentingLoader(File classesDir, URL[] libraries,
+                            Instrumenter instrumenter, ClassLoader parent) {
+            super(libraries, parent);
+            this.classesDir = classesDir;
+            this.instrumenter = instrumenter;
+        }
+
+        @Override
+        protected Class<?> loadClass(String name, boolean resolve)
+                throws ClassNotFoundException {
+            synchronized (getClassLoadingLock(name)) {
+                Class<?> c = findLoadedClass(name);
+                if (c == null) {
+                    File f = new File(classesDir,
+                                      name.replace('.', '/') + ".class");
+                    if (!f.isFile()) {
+                        return super.loadClass(name, resolve);
+                    }
+                    try {
+                        byte[] bytes = instrumenter.instrument(
+                            Files.readAllBytes(f.toPath()), name);
+                        c = defineClass(name, bytes, 0, bytes.length);
+                    } catch (IOException e) {
+                        throw new ClassNotFoundException(name, e);
+                    }
+                }
+                if (resolve) {
+                    resolveClass(c);
+                }
+                return c;
+            }
+        }
+    }
+
+    /** Write the JUnit result in the format of ant XML formatter. */
+    static class XmlReportListener extends RunListener {
+        final Document doc;
+        final Element suite;
+        Element testcase;
+        long started;
+
+        XmlReportListener(String name) throws Exception {
+            doc = DocumentBuilderFactory.newInstance().newDocumentBuilder()
+                .newDocument();
+            suite = doc.createElement("testsuite");
+            suite.setAttribute("name", name);
+            suite.setAttribute("hostname",
+                               InetAddress.getLocalHost().getHostName());
+            suite.setAttribute("timestamp", new SimpleDateFormat(
+                "yyyy-MM-dd'T'HH:mm:ss").format(new Date()));
+            suite.appendChild(doc.createElement("properties"));
+            doc.appendChild(suite);
+        }
+
+        @Override
+        public void testStarted(Description description) {
+            testcase = doc.createElement("testcase");
+            testcase.setAttribute("classname", description.getClassName());
+            testcase.setAttribute("name", description.getMethodName());
+            suite.appendChild(testcase);
+            started = System.currentTimeMillis();
+        }
+
+        @Override
+        public void testFinished(Description description) {
+            testcase.setAttribute("time", String.valueOf(
+                (System.currentTimeMillis() - started) / 1000.0));
+            testcase = null;
+        }
+
+        @Override
+        public void testFailure(Failure failure) {
+            Throwable ex = failure.getException();
+            Element e = doc.createElement(
+                ex instanceof AssertionError ? "failure" : "error");
+            if (ex.getMessage() != null) {
+                e.setAttribute("message", ex.getMessage());
+            }
+            e.setAttribute("type", ex.getClass().getName());
+            e.setTextContent(failure.getTrace());
+            if (testcase != null) {
+                testcase.appendChild(e);
+                return;
+            }
+            // Failures of the test class itself have no running test case.
+            Element c = doc.createElement("testcase");
+            Description d = failure.getDescription();
+            c.setAttribute("classname", d.getClassName());
+            c.setAttribute("name", d.getMethodName() != null ?
+                           d.getMethodName() : "initializationError");
+            c.setAttribute("time", "0.0");
+            c.appendChild(e);
+            suite.appendChild(c);
+        }
+
+        void write(Result result, File file) throws Exception {
+            suite.setAttribute("tests", String.valueOf(result.getRunCount()));
+            suite.setAttribute("failures", String.valueOf(
+                doc.getElementsByTagName("failure").getLength()));
+            suite.setAttribute("errors", String.valueOf(
+                doc.getElementsByTagName("error").getLength()));
+            suite.setAttribute("skipped",
+                               String.valueOf(result.getIgnoreCount()));
+            suite.setAttribute("time",
+                               String.valueOf(result.getRunTime() / 1000.0));
+            suite.appendChild(doc.createElement("system-out"));
+            suite.appendChild(doc.createElement("system-err"));
+            Transformer t = TransformerFactory.newInstance().newTransformer();
+            t.setOutputProperty(OutputKeys.INDENT, "yes");
+            t.transform(new DOMSource(doc), new StreamResult(file));
+        }
+    }
+
+    void runTests() throws Exception {
+        File junitData = new File(reportDir, "data/junit");
+        File jacocoData = new File(reportDir, "data/jacoco");
+        junitData.mkdirs();
+        jacocoData.mkdirs();
+
+        List<URL> urls = new ArrayList<URL>();
+        for (File jar : libraries()) {
+            urls.add(jar.toURI().toURL());
+        }
+        List<File> tests = new ArrayList<File>();
+        listFiles(buildDir, ".java", tests);
+
+        IRuntime runtime = new LoggerRuntime();
+        RuntimeData data = new RuntimeData();
+        runtime.startup(data);
+        ExecutionDataStore executionData = new ExecutionDataStore();
+        SessionInfoStore sessionInfos = new SessionInfoStore();
+        try {
+            Instrumenter instrumenter = new Instrumenter(runtime);
+            String base = buildDir.getPath() + File.separator;
+            for (File f : tests) {
+                if (!f.getName().contains("Test")) {
+                    continue;
+                }
+                String path = f.getPath().substring(base.length());
+                String name = path.substring(0, path.length() - 5)
+                    .replace(File.separatorChar, '.');
+                // Each test class runs in a fresh class loader, as if the
+                // class is run in a forked JVM by ant.
+                InstrumentingLoader loader = new InstrumentingLoader(
+                    classesDir, urls.toArray(new URL[urls.size()]),
+                    instrumenter, Build.class.getClassLoader());
+                try {
+                    runTest(loader, name, junitData);
+                } finally {
+                    loader.close();
+                }
+            }
+        } finally {
+            data.collect(executionData, sessionInfos, false);
+            runtime.shutdown();
+        }
+
+        OutputStream exec = new FileOutputStream(
+            new File(jacocoData, "jacoco.exec"));
+        try {
+            ExecutionDataWriter writer = new ExecutionDataWriter(exec);
+            sessionInfos.accept(writer);
+            executionData.accept(writer);
+        } finally {
+            exec.close();
+        }
+        writeJUnitReport(junitData);
+        writeCoverageReport(executionData, sessionInfos);
+    }
+
+    void runTest(ClassLoader loader, String name, File junitData)
+            throws Exception {
+        System.out.println("Running " + name);
+        XmlReportListener listener = new XmlReportListener(name);
+        Result result;
+        try {
+            JUnitCore core = new JUnitCore();
+            core.addListener(listener);
+            result = core.run(loader.loadClass(name));
+        } catch (ClassNotFoundException e) {
+            System.out.println("Test " + name + " is not found");
+            return;
+        }
+        System.out.println(String.format(
+            "Tests run: %d, Failures: %d, Skipped: %d, Time elapsed: %.3f sec",
+            result.getRunCount(), result.getFailureCount(),
+            result.getIgnoreCount(), result.getRunTime() / 1000.0));
+        listener.write(result, new File(junitData, "TEST-" + name + ".xml"));
+    }
+
+    void writeJUnitReport(File junitData) {
+        File todir = new File(reportDir, "junit");
+        todir.mkdirs();
+        Project project = new Project();
+        project.init();
+        XMLResultAggregator aggregator = new XMLResultAggregator();
+        aggregator.setProject(project);
+        aggregator.setTodir(todir);
+        FileSet fs = new FileSet();
+        fs.setDir(junitData);
+        fs.setIncludes("**/*.xml");
+        aggregator.addFileSet(fs);
+        AggregateTransformer transformer = aggregator.createReport();
+        AggregateTransformer.Format format = new AggregateTransformer.Format();
+        format.setValue(AggregateTransformer.FRAMES);
+        transformer.setFormat(format);
+        transformer.setTodir(todir);
+        aggregator.execute();
+    }
+
+    void writeCoverageReport(ExecutionDataStore executionData,
+                             SessionInfoStore sessionInfos)
+            throws IOException {
+        CoverageBuilder builder = new CoverageBuilder();
+        new Analyzer(executionData, builder).analyzeAll(classesDir);
+        IBundleCoverage coverage = builder.getBundle(bundle);
+
+        File todir = new File(reportDir, "jacoco");
+        todir.mkdirs();
+        OutputStream csv = new FileOutputStream(new File(todir, "report.csv"));
+        OutputStream xml = new FileOutputStream(new File(todir, "report.xml"));
+        try {
+            List<IReportVisitor> visitors = new ArrayList<IReportVisitor>();
+            visitors.add(new HTMLFormatter().createVisitor(
+                new FileMultiReportOutput(todir)));
+            visitors.add(new CSVFormatter().createVisitor(csv));
+            visitors.add(new XMLFormatter().createVisitor(xml));
+            IReportVisitor visitor = new MultiReportVisitor(visitors);
+            visitor.visitInfo(sessionInfos.getInfos(),
+                              executionData.getContents());
+            visitor.visitBundle(coverage, new DirectorySourceFileLocator(
+                buildDir, "UTF-8", 4));
+            visitor.visitEnd();
+        } finally {
+            csv.close();
+            xml.close();
+        }
+    }
+}
@@ -0,0 +1,243 @@
+// ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+// @file: runlib/java/javahost/src/railgun/javahost/Service.java
+// ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+// This file is released under BSD 2-clause license.
+
+package railgun.javahost;
+
+import java.io.BufferedReader;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.OutputStream;
+import java.io.PrintStream;
+import java.lang.reflect.ReflectPermission;
+import java.security.Permission;
+import java.util.HashMap;
+import java.util.Map;
+
+/**
+ * A JVM to build and test a Java submission.
+ *
+ * <p>The runner queue (see railgun/runner/javaservice.py) starts the service
+ * in the sandbox of the build, under the system account leased to the
+ * submission, and kills it after the build.  It saves the cold start of
+ * ant, javac, JUnit and Checkstyle in separate JVMs.</p>
+ *
+ * <p>The service talks with the runner through stdin and stdout.  After
+ * started, it writes {@code {"ready": true}}.  Each request is a block of
+ * {@code key<TAB>value} lines terminated by an empty line (see
+ * {@link Build} for the keys), and each reply is a JSON line of
+ * {@code {"exitcode", "stdout", "stderr", "outputExceeded"}}
+ * or {@code {"error"}}.</p>
+ */
+public class Service {
+
+    /**
+     * Forbid the submissions to terminate the service, and to reach the
+     * control channel of the service.
+     *
+     * <p>The submission classes, loaded by {@link Build.InstrumentingLoader},
+     * may not replace the standard streams or the security manager,
+     * suppress the access checks of reflection (which would expose the
+     * control stream), or write to the standard file descriptors.</p>
+     */
+    static class Guard extends SecurityManager {
+        volatile boolean allowExit = false;
+
+        /** Whether any class of the submission is on the call stack? */
+        boolean fromSubmission() {
+            for (Class<?> c : getClassContext()) {
+                if (c.getClassLoader() instanceof Build.InstrumentingLoader) {
+                    return true;
+                }
+            }
+            return false;
+        }
+
+        @Override
+        public void checkPermission(Permission perm) {
+            String name = perm.getName();
+            if (perm instanceof RuntimePermission &&
+                    "setSecurityManager".equals(name)) {
+                throw new SecurityException(
+                    "Replacing the security manager is not allowed.");
+            }
+            if ((perm instanceof RuntimePermission && "setIO".equals(name)) ||
+                    (perm instanceof ReflectPermission &&
+                     "suppressAccessChecks".equals(name))) {
+                if (fromSubmission()) {
+                    throw new SecurityException(perm + " is not allowed.");
+                }
+            }
+        }
+
+        @Override
+        public void checkPermission(Permission perm, Object context) {
+            checkPermission(perm);
+        }
+
+        @Override
+        public void checkWrite(FileDescriptor fd) {
+            if (fromSubmission()) {
+                throw new SecurityException(
+                    "Writing to file descriptors is not allowed.");
+            }
+        }
+
+        @Override
+        public void checkWrite(String file) {
+            if ((file.startsWith("/proc/") || file.startsWith("/dev/")) &&
+                    !"/dev/null".equals(file) && fromSubmission()) {
+                throw new SecurityException(
+                    "Writing to " + file + " is not allowed.");
+            }
+        }
+
+        @Override
+        public void checkExit(int status) {
+            if (!allowExit) {
+                throw new SecurityException("System.exit is not allowed.");
+            }
+        }
+    }
+
+    /**
+     * Capture stdout and stderr of a build, keeping at most {@code limit}
+     * bytes in total.
+     */
+    static class OutputCapture {
+        final long limit;
+        long total = 0;
+        boolean exceeded = false;
+
+        OutputCapture(long limit) {
+            this.limit = limit;
+        }
+
+        class Stream extends OutputStream {
+            final java.io.ByteArrayOutputStream buffer =
+                new java.io.ByteArrayOutputStream();
+
+            @Override
+            public void write(int b) {
+                write(new byte[] {(byte) b}, 0, 1);
+            }
+
+            @Override
+            public void write(byte[] b, int off, int len) {
+                synchronized (OutputCapture.this) {
+                    total += len;
+                    if (limit > 0 && total > limit) {
+                        exceeded = true;
+                        len = (int) Math.max(0, len - (total - limit));
+                    }
+                    buffer.write(b, off, len);
+                }
+            }
+
+            String text() {
+                try {
+                    return buffer.toString("UTF-8");
+                } catch (java.io.UnsupportedEncodingException e) {
+                    throw new RuntimeException(e);
+                }
+            }
+        }
+
+        final Stream stdout = new Stream();
+        final Stream stderr = new Stream();
+    }
+
+    /** Quote a string as JSON. */
+    static String quote(String s) {
+        StringBuilder sb = new StringBuilder(s.length() + 2);
+        sb.append('"');
+        for (int i = 0; i < s.length(); ++i) {
+            char c = s.charAt(i);
+            switch (c) {
+                case '"': sb.append("\\\""); break;
+                case '\\': sb.append("\\\\"); break;
+                case '\n': sb.append("\\n"); break;
+                case '\r': sb.append("\\r"); break;
+                case '\t': sb.append("\\t"); break;
+                default:
+                    if (c < 0x20 || c > 0x7e) {
+                        sb.append(String.format("\\u%04x", (int) c));
+                    } else {
+                        sb.append(c);
+                    }
+            }
+        }
+        sb.append('"');
+        return sb.toString();
+    }
+
+    /** Read a request block, or {@code null} at the end of stdin. */
+    static Map<String, String> readRequest(BufferedReader in)
+            throws IOException {
+        Map<String, String> request = new HashMap<String, String>();
+        String line;
+        while ((line = in.readLine()) != null) {
+            if (line.isEmpty()) {
+                return request;
+            }
+            int pos = line.indexOf('\t');
+            if (pos < 0) {
+                request.put(line, "");
+            } else {
+                request.put(line.substring(0, pos), line.substring(pos + 1));
+            }
+        }
+        return null;
+    }
+
+    public static void main(String[] args) throws Exception {
+        // Keep the control channel away from the output of submissions.
+        PrintStream control = new PrintStream(
+            new FileOutputStream(FileDescriptor.out), true, "UTF-8");
+        PrintStream stderr = System.err;
+        System.setOut(stderr);
+        BufferedReader in = new BufferedReader(
+            new InputStreamReader(System.in, "UTF-8"));
+        Guard guard = new Guard();
+        System.setSecurityManager(guard);
+        control.println("{\"ready\": true}");
+
+        Map<String, String> request;
+        while ((request = readRequest(in)) != null) {
+            OutputCapture capture = new OutputCapture(
+                Long.parseLong(request.containsKey("outputLimit") ?
+                               request.get("outputLimit") : "0"));
+            String reply;
+            try {
+                PrintStream out = new PrintStream(capture.stdout, true);
+                PrintStream err = new PrintStream(capture.stderr, true);
+                int exitcode;
+                System.setOut(out);
+                System.setErr(err);
+                try {
+                    exitcode = new Build(request).run();
+                } finally {
+                    out.flush();
+                    err.flush();
+                    System.setOut(stderr);
+                    System.setErr(stderr);
+                }
+                reply = String.format(
+                    "{\"exitcode\": %d, \"stdout\": %s, \"stderr\": %s, " +
+                    "\"outputExceeded\": %s}",
+                    exitcode, quote(capture.stdout.text()),
+                    quote(capture.stderr.text()), capture.exceeded);
+            } catch (Throwable t) {
+                t.printStackTrace(stderr);
+                reply = String.format("{\"error\": %s}", quote(t.toString()));
+            }
+            control.println(reply);
+        }
+
+        guard.allowExit = true;
+        System.exit(0);
+    }
+}
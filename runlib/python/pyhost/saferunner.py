@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# @file: runlib/python/pyhost/saferunner.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# This file is released under BSD 2-clause license.
+
+"""Python implementation of the `SafeRunner` module, used by the submission
+processes forked from :mod:`pyhost.zygote`.
+
+The native `SafeRunner` program posts the score to the website itself,
+with the secret communication key loaded before dropping privileges.  The
+forked processes never hold the key.  Instead, :func:`run` writes the
+score to a pipe set up by the zygote, along with the token given by the
+zygote, and the score is posted by the runner queue.  The zygote drops the
+scores without the token, so a stray write to the pipe is not taken as the
+score.
+
+.. warning::
+
+    The submission runs in the same interpreter as this module, so it can
+    always find the pipe and the token, which are only kept out of the
+    module namespace.  Unlike the key compiled into the native
+    `SafeRunner`, they do not stop a submission from forging its score.
+
+This module is installed as ``sys.modules['SafeRunner']``, so the
+homework scripts can ``import SafeRunner`` as usual.
+"""
+
+import os
+import json
+
+from railgun.common.lazy_i18n import GetTextString, lazystr_to_plain
+
+# The uuid of the submission, and the function to send the score
+_handid = None
+_send_score = None
+
+# Flag to indicate whether SafeRunner.run is called twice
+_executed = False
+
+
+def setup(score_fd, handid, token):
+    """Set up this module in a forked submission process.
+
+    :param score_fd: The file descriptor to write the score.
+    :type score_fd: :class:`int`
+    :param handid: The uuid of the submission.
+    :type handid: :class:`str`
+    :param token: The score token given by the zygote.
+    :type token: :class:`str`
+    """
+    global _handid, _send_score
+    _handid = handid
+    _send_score = _make_sender(score_fd, token)
+
+
+def _make_sender(score_fd, token):
+    # Keep the pipe and the token in a closure instead of the globals.
+    def send(score):
+        data = json.dumps(dict(score, token=token)) + '\n'
+        while data:
+            data = data[os.write(score_fd, data):]
+        os.close(score_fd)
+    return send
+
+
+def _plain_lazystr(s):
+    # Pure strings are given as raw messages, which will not be translated.
+    if isinstance(s, str):
+        s = unicode(s, 'utf-8')
+    if isinstance(s, unicode):
+        return {'text': u'%(RAW_MESSAGE)s', 'kwargs': {'RAW_MESSAGE': s}}
+    return lazystr_to_plain(s)
+
+
+def _partial_score(scorer, weight):
+    return {
+        'name': _plain_lazystr(scorer.name),
+        'typeName': type(scorer).__name__,
+        'score': float(scorer.score),
+        'weight': weight,
+        'time': scorer.time,
+        'brief': _plain_lazystr(scorer.brief),
+        'detail': [_plain_lazystr(d) for d in (scorer.detail or [])],
+    }
+
+
+def run(scorers, checker=None):
+    """Run all the scorers and report the final score, the same as
+    ``SafeRunner.run`` in the native program.
+
+    :param scorers: :class:`list` of (scorer, weight).
+    :param checker: A scorer to check the functionality of the submission,
+        which must give full score if given.
+    """
+    global _executed, _send_score
+    # Prevent user handin from calling this routine again.
+    if _executed:
+        raise RuntimeError(
+            'You cannot call SafeRunner.run twice in a same process!')
+    _executed = True
+
+    score = {'uuid': _handid, 'accepted': False, 'result': None,
+             'compile_error': None, 'partials': []}
+    try:
+        if not scorers:
+            score['result'] = lazystr_to_plain(
+                GetTextString('No scorer defined, please contact TA.'))
+        for scorer, weight in scorers:
+            # Run the scorer!
+            scorer.run()
+            score['partials'].append(_partial_score(scorer, float(weight)))
+        score['accepted'] = bool(scorers)
+        # We run the checker after the scorers, because the checker is
+        # likely to be unittest scorer, while they may break coverage scorer
+        # if they import related modules before coverage test.
+        if checker is not None:
+            checker.run()
+            partial = _partial_score(checker, 1.0)
+            partial['name'] = lazystr_to_plain(
+                GetTextString('Functionality Checker'))
+            # We require the checker scorer to get full score
+            if partial['score'] < 100.0 - 1e-5:
+                partial['score'] = 0.0
+                score['result'] = lazystr_to_plain(GetTextString(
+                    'Your submission does not pass the functionality '
+                    'checker.'))
+                score['partials'] = [partial]
+                score['accepted'] = False
+    except UnicodeError:
+        score = {'uuid': _handid, 'accepted': False, 'compile_error': None,
+                 'partials': [],
+                 'result': lazystr_to_plain(
+                     GetTextString('Not valid UTF-8 sequence produced.'))}
+
+    # Send the score to the zygote
+    send, _send_score = _send_score, None
+    send(score)
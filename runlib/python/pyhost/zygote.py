@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# @file: runlib/python/pyhost/zygote.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# This file is released under BSD 2-clause license.
+
+"""A fork server to run Python submissions.
+
+Starting a new interpreter and importing the scorer stack (`coverage`,
+`pep8`, `unittest`, ...) often takes longer than the submission itself.
+The zygote imports these modules once, and forks a child process for each
+submission.  The child drops to the system account of the submission,
+changes into the working directory, and runs the entry script as if it is
+executed by the native `SafeRunner` program.
+
+The zygote is started by the runner queue (see :mod:`railgun.runner.zygote`)
+with::
+
+    python -m pyhost.zygote [extra modules to preload...]
+
+and talks with the runner by JSON lines.  After the modules are loaded, it
+writes ``{"ready": true}``.  Then for each line of request::
+
+    {"entry": "/path/to/run.py", "cwd": "/path/to/workdir",
+     "env": {...}, "stdout": "/path/to/fifo", "stderr": "/path/to/fifo",
+     "cgroup": "/path/to/cgroup" or null, "rlimits": [[name, value], ...]}
+
+it writes ``{"pid": child pid}`` once the child is started, and
+``{"exitcode": exit code, "scores": [score objects], "rusage": {...}}``
+once the child exits, where `rusage` is the resource usage of the child
+returned by :func:`os.wait4`, keyed by the field names without ``ru_``.
+The user id and group id of the child are read from ``RAILGUN_USER_ID``
+and ``RAILGUN_GROUP_ID`` in `env`.
+
+The child writes the score to a pipe, which is closed on exec, so the
+programs started by the submission do not inherit it.  The zygote generates
+a random token for each child after the fork, which is kept by
+:mod:`pyhost.saferunner` in the child, and drops the scores which do not
+carry the token.  A dropped score is reported as `null`, and the runner
+rejects the submission.
+
+.. warning::
+
+    The token only tells the score of `SafeRunner.run` from other writes
+    to the pipe.  The submission shares the interpreter with the scorers,
+    so it can read the token, or patch the scorers, and forge its score.
+    Use the native `SafeRunner` if the submissions are not trusted that
+    far.
+"""
+
+import os
+import sys
+import json
+import time
+import errno
+import fcntl
+import select
+import random
+import signal
+import resource
+import traceback
+
+#: Modules always imported by the zygote.
+PRELOAD_MODULES = (
+    'unittest', 'pep8', 'coverage', 'json', 'csv', 'pyhost',
+    'pyhost.scorer', 'pyhost.saferunner',
+)
+
+#: Fields of the resource usage reported to the runner.
+RUSAGE_FIELDS = ('utime', 'stime', 'maxrss', 'minflt', 'majflt', 'inblock',
+                 'oublock', 'nvcsw', 'nivcsw')
+
+#: Interval in seconds to check whether the child has exited.
+CHILD_CHECK_INTERVAL = 0.05
+
+#: Number of random bytes in the score token of each child.
+TOKEN_BYTES = 16
+
+
+def preload(modules):
+    """Import the given modules.  Failures are reported to stderr, and
+    the module will be imported again by the submission if it needs."""
+    for name in modules:
+        try:
+            __import__(name)
+        except Exception:
+            sys.stderr.write('Cannot preload module %s.\n' % name)
+            traceback.print_exc()
+
+
+def run_child(request, token_fd, score_fd, stdout_fd, stderr_fd):
+    """Run the submission in the forked child.  Never returns."""
+    code = 1
+    try:
+        os.setsid()
+        # Receive the score token from the zygote.  It is generated after
+        # the fork, so it is not left anywhere else in our memory.
+        token = read_token(token_fd)
+        os.close(token_fd)
+        # Set up the standard streams, and close all other files.
+        null_fd = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(null_fd, 0)
+        os.dup2(stdout_fd, 1)
+        os.dup2(stderr_fd, 2)
+        os.closerange(3, score_fd)
+        os.closerange(score_fd + 1, os.sysconf('SC_OPEN_MAX'))
+        fcntl.fcntl(score_fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+        sys.stdin = os.fdopen(0, 'rb')
+        sys.stdout = os.fdopen(1, 'wb')
+        sys.stderr = os.fdopen(2, 'wb', 0)
+        for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGCHLD):
+            signal.signal(sig, signal.SIG_DFL)
+
+        # Enter the sandbox prepared by the runner while we are still
+        # privileged.  See railgun/runner/sandbox.py.
+        if request.get('cgroup'):
+            with open(os.path.join(request['cgroup'], 'cgroup.procs'),
+                      'wb') as f:
+                f.write('0')
+        for name, value in request.get('rlimits') or ():
+            res = getattr(resource, name)
+            hard = resource.getrlimit(res)[1]
+            if hard != resource.RLIM_INFINITY:
+                value = min(value, hard)
+            resource.setrlimit(res, (value, value))
+
+        # Downgrade user privilege, just like the native SafeRunner.
+        env = request['env']
+        uid = int(env.get('RAILGUN_USER_ID') or 0)
+        gid = int(env.get('RAILGUN_GROUP_ID') or 0)
+        if os.getuid() == 0 and (uid or gid):
+            os.setgroups([])
+        if gid:
+            os.setgid(gid)
+        if uid:
+            os.setuid(uid)
+
+        # Prepare the interpreter state as `python run.py` does.
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(env)
+        entry = request['entry']
+        sys.argv = [entry]
+        sys.path[0] = os.path.dirname(os.path.abspath(entry))
+        random.seed()
+
+        from pyhost import saferunner
+        saferunner.setup(score_fd, env.get('RAILGUN_HANDID'), token)
+        sys.modules['SafeRunner'] = saferunner
+        del token
+
+        import runpy
+        runpy.run_path(entry, run_name='__main__')
+        code = 0
+    except SystemExit, ex:
+        if ex.code is None:
+            code = 0
+        elif isinstance(ex.code, int):
+            code = ex.code
+        else:
+            sys.stderr.write('%s\n' % ex.code)
+            code = 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        except Exception:
+            pass
+        os._exit(code)
+
+
+def read_token(fd):
+    """Read the score token from `fd` until EOF."""
+    chunks = []
+    while True:
+        try:
+            data = os.read(fd, TOKEN_BYTES * 2)
+        except OSError, ex:
+            if ex.errno == errno.EINTR:
+                continue
+            raise
+        if not data:
+            return ''.join(chunks)
+        chunks.append(data)
+
+
+def parse_scores(data, token):
+    """Parse the score lines written by the child.
+
+    :param data: The data read from the score pipe.
+    :type data: :class:`str`
+    :param token: The score token of the child.
+    :type token: :class:`str`
+    :return: The score objects without the token, where the malformed ones
+        and those without the token are :data:`None`.
+    """
+    scores = []
+    for line in data.splitlines():
+        try:
+            score = json.loads(line)
+        except ValueError:
+            score = None
+        if not isinstance(score, dict) or score.pop('token', None) != token:
+            # Garbage or a forged score written by the submission.  Count
+            # it as a score, so the runner will reject the submission.
+            score = None
+        scores.append(score)
+    return scores
+
+
+def serve_request(request):
+    """Fork a child to run `request`, and wait for it to exit.
+
+    :return: (child pid, exit code, list of scores, resource usage).
+    """
+    # The reading ends of the fifos have been opened by the runner.
+    stdout_fd = os.open(request['stdout'], os.O_WRONLY)
+    stderr_fd = os.open(request['stderr'], os.O_WRONLY)
+    score_r, score_w = os.pipe()
+    token_r, token_w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(score_r)
+        os.close(token_w)
+        run_child(request, token_r, score_w, stdout_fd, stderr_fd)
+    os.close(stdout_fd)
+    os.close(stderr_fd)
+    os.close(score_w)
+    os.close(token_r)
+    token = os.urandom(TOKEN_BYTES).encode('hex')
+    try:
+        os.write(token_w, token)
+    finally:
+        os.close(token_w)
+    yield pid
+
+    # Read the scores until the child exits.  Some descendant may still hold
+    # the pipe, so we do not wait for EOF after that.
+    chunks = []
+    status = None
+    while status is None:
+        try:
+            wpid, st, ru = os.wait4(pid, os.WNOHANG)
+        except OSError, ex:
+            if ex.errno == errno.EINTR:
+                continue
+            raise
+        if wpid == pid:
+            status = st
+            rusage = dict(
+                (k, getattr(ru, 'ru_' + k))
+                for k in RUSAGE_FIELDS
+            )
+        timeout = 0 if status is not None else CHILD_CHECK_INTERVAL
+        while True:
+            try:
+                ready = select.select([score_r], [], [], timeout)[0]
+            except select.error, ex:
+                if ex.args[0] == errno.EINTR:
+                    continue
+                raise
+            if not ready:
+                break
+            data = os.read(score_r, 65536)
+            if not data:
+                break
+            chunks.append(data)
+            timeout = 0
+    os.close(score_r)
+
+    if os.WIFSIGNALED(status):
+        exitcode = -os.WTERMSIG(status)
+    else:
+        exitcode = os.WEXITSTATUS(status)
+    yield exitcode, parse_scores(''.join(chunks), token), rusage
+
+
+def main(argv):
+    # Keep the control channel away from the stdout of preloaded modules.
+    control = os.fdopen(os.dup(1), 'wb')
+    os.dup2(2, 1)
+
+    def reply(obj):
+        control.write(json.dumps(obj) + '\n')
+        control.flush()
+
+    preload(PRELOAD_MODULES + tuple(argv[1:]))
+    reply({'ready': True, 'time': time.time()})
+
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            break
+        try:
+            request = json.loads(line)
+            steps = serve_request(request)
+            reply({'pid': next(steps)})
+            exitcode, scores, rusage = next(steps)
+            reply({'exitcode': exitcode, 'scores': scores, 'rusage': rusage})
+        except Exception, ex:
+            traceback.print_exc()
+            reply({'error': str(ex)})
+
+
+if __name__ == '__main__':
+    main(sys.argv)
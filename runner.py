@@ -15,6 +15,14 @@ import config
 # netapi handins.
 queue = sys.argv[1] if len(sys.argv) > 1 else 'default'
 
+# a runner may be given a shard name, and then it also consumes the shard
+# queue of its own, to which the submissions of some homework are routed
+# (see railgun/runner/affinity.py).
+shard = sys.argv[2] if len(sys.argv) > 2 else None
+queues = queue
+if shard is not None:
+    queues = '%s,%s.%s' % (queue, queue, shard)
+
 # construct the new running environment
 env = copy.copy(os.environ)
 env['PYTHONPATH'] = os.pathsep.join([
@@ -28,8 +36,14 @@ args = [
     'railgun.runner.context',
     'worker',
     '-Q',
-    queue,
-    '--concurrency=%d' % config.RUNNER_CONCURRENTY,
+    queues,
     '--logfile=logs/celery.log',
 ]
+
+# the pool is either resized by railgun.runner.autoscale, or fixed
+if config.RUNNER_AUTOSCALE:
+    args.append('--autoscale=%d,%d' % (config.RUNNER_AUTOSCALE_MAX,
+                                       config.RUNNER_AUTOSCALE_MIN))
+else:
+    args.append('--concurrency=%d' % config.RUNNER_CONCURRENTY)
 os.execvpe('celery', args, env)
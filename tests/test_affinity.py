@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# @file: tests/test_affinity.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# This file is released under BSD 2-clause license.
+
+import unittest
+
+from railgun.runner import runconfig
+from railgun.runner.affinity import (HashRing, choose_queue, drain_shards,
+                                     shard_queue)
+from railgun.runner.priority import queue_keys
+
+
+class FakeRedis(object):
+
+    def __init__(self, shards, depths):
+        self.shards = shards
+        self.depths = depths
+
+    def zrangebyscore(self, key, lo, hi):
+        return list(self.shards)
+
+    def llen(self, key):
+        return self.depths.get(key, 0)
+
+
+class FakeListRedis(object):
+
+    def __init__(self, members):
+        self.members = members
+        self.lists = {}
+
+    def zrangebyscore(self, key, lo, hi):
+        hi = float(hi[1:])
+        return [m for m, score in self.members.iteritems() if score < hi]
+
+    def lpush(self, key, value):
+        self.lists.setdefault(key, []).insert(0, value)
+
+    def rpoplpush(self, src, dst):
+        if not self.lists.get(src):
+            return None
+        value = self.lists[src].pop()
+        self.lpush(dst, value)
+        return value
+
+
+class AffinityTestCase(unittest.TestCase):
+
+    def test_hash_ring(self):
+        nodes = ['default.%d' % i for i in xrange(4)]
+        ring = HashRing(nodes)
+        keys = ['hw%d' % i for i in xrange(200)]
+        placed = dict((k, ring.lookup(k, 2)) for k in keys)
+        for k in keys:
+            self.assertEqual(len(set(placed[k])), 2)
+            self.assertEqual(ring.lookup(k, 2), placed[k])
+
+        # removing a node only moves the keys placed on it
+        smaller = HashRing(nodes[:-1])
+        for k in keys:
+            if placed[k][0] != nodes[-1]:
+                self.assertEqual(smaller.lookup(k)[0], placed[k][0])
+        self.assertEqual(HashRing([]).lookup('hw0'), [])
+
+    def test_choose_queue(self):
+        shards = [shard_queue('default', i) for i in xrange(4)]
+        client = FakeRedis(shards, {})
+        first, second = HashRing(shards).lookup('hw0', 2)
+        self.assertEqual(choose_queue(client, 'default', 'hw0'), first)
+
+        # spill to the other replica, and then to the shared queue
+        client.depths[first] = runconfig.RUNNER_AFFINITY_SPILL
+        self.assertEqual(choose_queue(client, 'default', 'hw0'), second)
+        client.depths[second] = runconfig.RUNNER_AFFINITY_SPILL
+        self.assertEqual(choose_queue(client, 'default', 'hw0'), 'default')
+
+        client.shards = []
+        self.assertEqual(choose_queue(client, 'default', 'hw0'), 'default')
+
+    def test_drain_shards(self):
+        dead, alive = shard_queue('default', 0), shard_queue('default', 1)
+        now = 1000.0
+        client = FakeListRedis({
+            dead: now - runconfig.RUNNER_AFFINITY_EXPIRES - 1,
+            alive: now,
+        })
+        for shard in (dead, alive):
+            for i, key in enumerate(queue_keys(shard)):
+                client.lpush(key, '%s-%d-a' % (shard, i))
+                client.lpush(key, '%s-%d-b' % (shard, i))
+        client.lpush('default', 'shared')
+
+        self.assertEqual(drain_shards(client, 'default', now),
+                         2 * len(queue_keys(dead)))
+        for key in queue_keys(dead):
+            self.assertFalse(client.lists[key])
+        for key in queue_keys(alive):
+            self.assertEqual(len(client.lists[key]), 2)
+        # the moved messages keep their lanes and order, behind the waiting
+        for i, key in enumerate(queue_keys('default')):
+            expected = ['%s-%d-b' % (dead, i), '%s-%d-a' % (dead, i)]
+            if i == 0:
+                expected.append('shared')
+            self.assertEqual(client.lists[key], expected)
+        self.assertEqual(drain_shards(client, 'default', now), 0)
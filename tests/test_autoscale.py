@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# @file: tests/test_autoscale.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# This file is released under BSD 2-clause license.
+
+import unittest
+
+from railgun.runner import runconfig
+from railgun.runner.autoscale import ConcurrencyController, LoadSample
+
+#: Plenty of memory for one more process.
+ENOUGH_MEMORY = (runconfig.RUNNER_AUTOSCALE_MEMORY_RESERVE +
+                 runconfig.RUNNER_AUTOSCALE_PROCESS_MEMORY * 2)
+
+
+class ConcurrencyControllerTestCase(unittest.TestCase):
+
+    def test_grow(self):
+        ctrl = ConcurrencyController(1, 3)
+        self.assertEqual(ctrl.decide(1, LoadSample(0.1, ENOUGH_MEMORY, 5),
+                                     0)[0], 2)
+        # bounded by the maximum size and the free system accounts
+        self.assertEqual(ctrl.decide(3, LoadSample(0.1, ENOUGH_MEMORY, 5),
+                                     0)[0], 3)
+        self.assertEqual(ctrl.decide(2, LoadSample(0.1, ENOUGH_MEMORY, 5, 0),
+                                     0)[0], 2)
+
+    def test_hysteresis(self):
+        ctrl = ConcurrencyController(1, 3)
+        load = (runconfig.RUNNER_AUTOSCALE_LOAD_HIGH +
+                runconfig.RUNNER_AUTOSCALE_LOAD_CRITICAL) / 2.0
+        # between the thresholds, neither grow nor shrink
+        self.assertEqual(ctrl.decide(2, LoadSample(load, ENOUGH_MEMORY, 5),
+                                     0)[0], 2)
+        # overloaded, shrink at once
+        load = runconfig.RUNNER_AUTOSCALE_LOAD_CRITICAL + 1
+        self.assertEqual(ctrl.decide(2, LoadSample(load, ENOUGH_MEMORY, 5),
+                                     0)[0], 1)
+
+    def test_shrink_delay(self):
+        ctrl = ConcurrencyController(1, 3)
+        delay = runconfig.RUNNER_AUTOSCALE_SHRINK_DELAY
+        idle = LoadSample(0.1, ENOUGH_MEMORY, 0)
+        self.assertEqual(ctrl.decide(3, idle, 100)[0], 3)
+        self.assertEqual(ctrl.decide(3, idle, 100 + delay - 1)[0], 3)
+        self.assertEqual(ctrl.decide(3, idle, 100 + delay)[0], 2)
+        self.assertEqual(ctrl.decide(1, idle, 1000)[0], 1)
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# @file: tests/test_cancel.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# This file is released under BSD 2-clause license.
+
+import unittest
+
+from railgun.runner.cancel import (cancel_handins, is_cancelled,
+                                   uncancel_handins)
+
+
+class FakeRedis(object):
+
+    def __init__(self):
+        self.keys = {}
+
+    def setex(self, key, ttl, value):
+        self.keys[key] = value
+
+    def delete(self, *keys):
+        for key in keys:
+            self.keys.pop(key, None)
+
+    def exists(self, key):
+        return key in self.keys
+
+    def pipeline(self):
+        return self
+
+    def execute(self):
+        pass
+
+
+class CancelTestCase(unittest.TestCase):
+
+    def test_uncancel(self):
+        client = FakeRedis()
+        cancel_handins(['h1', 'h2'], client)
+        self.assertTrue(is_cancelled('h1', client))
+        self.assertTrue(is_cancelled('h2', client))
+
+        # a submission put into the queue again is no longer cancelled
+        uncancel_handins(['h1'], client)
+        self.assertFalse(is_cancelled('h1', client))
+        self.assertTrue(is_cancelled('h2', client))
+        uncancel_handins([], client)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# @file: tests/test_fileutil.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# This file is released under BSD 2-clause license.
+
+import os
+import time
+import shutil
+import tarfile
+import zipfile
+import rarfile
+import tempfile
+import unittest
+from cStringIO import StringIO
+
+from railgun.common.fileutil import (Extractor, ZipExtractor, TarExtractor,
+                                     RarExtractor, ArchiveSizeExceeded,
+                                     copyfileobj_limited,
+                                     detect_archive_format)
+
+
+def make_zip(files):
+    buf = StringIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as f:
+        for name, content in files:
+            f.writestr(name, content)
+    return buf.getvalue()
+
+
+def make_tar(files, mode='w:gz'):
+    buf = StringIO()
+    with tarfile.open(fileobj=buf, mode=mode) as f:
+        for name, content in files:
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            info.mtime = time.time()
+            f.addfile(info, StringIO(content))
+    return buf.getvalue()
+
+
+class ExtractorTestCase(unittest.TestCase):
+
+    FILES = [('top/a.py', 'print 1\n'), ('top/sub/b.py', 'print 2\n')]
+
+    def test_detect_format(self):
+        self.assertEqual(detect_archive_format(make_zip(self.FILES)), 'zip')
+        self.assertEqual(detect_archive_format(make_tar(self.FILES)), 'tar')
+        self.assertEqual(
+            detect_archive_format(make_tar(self.FILES, 'w')), 'tar')
+        self.assertEqual(
+            detect_archive_format(make_tar(self.FILES, 'w:bz2')), 'tar')
+        self.assertEqual(detect_archive_format('Rar!\x1a\x07\x00'), 'rar')
+        self.assertIsNone(detect_archive_format('hello, world!'))
+
+    def test_open_buffer(self):
+        # the format is recognized by content rather than the file name
+        for data, cls in ((make_zip(self.FILES), ZipExtractor),
+                          (make_tar(self.FILES), TarExtractor)):
+            with Extractor.open_buffer(data, 'wrong.rar') as f:
+                self.assertIsInstance(f, cls)
+                self.assertTrue(f.onedir())
+                self.assertEqual(
+                    sorted((n, o.read()) for n, o in f.extract()),
+                    self.FILES
+                )
+
+    def test_open_buffer_unknown(self):
+        with self.assertRaises(ValueError):
+            Extractor.open_buffer('hello, world!', 'a.txt')
+
+    def test_manifest(self):
+        files = self.FILES + [('__MACOSX/top/._a.py', 'meta')]
+        with Extractor.open_buffer(make_tar(files, 'w:bz2')) as f:
+            manifest = f.manifest()
+            self.assertIs(f.manifest(), manifest)
+            self.assertTrue(manifest.onedir)
+            self.assertEqual(len(manifest), 3)
+            self.assertEqual(manifest.total_size, 20)
+            selected = manifest.select(lambda p: '._' in p)
+            self.assertEqual(
+                sorted((m.path, f.open_member(m).read()) for m in selected),
+                [('a.py', 'print 1\n'), ('sub/b.py', 'print 2\n')]
+            )
+
+    def test_size_budget(self):
+        bomb = [('a.txt', '\0' * (4 * 1024 * 1024))]
+        # the tar stream is rejected during decompression
+        with self.assertRaises(ArchiveSizeExceeded):
+            Extractor.open_buffer(make_tar(bomb), max_ratio=10)
+        with self.assertRaises(ArchiveSizeExceeded):
+            Extractor.open_buffer(make_tar(bomb, 'w:bz2'), max_ratio=10)
+        # the zip members are checked while copying
+        with Extractor.open_buffer(make_zip(bomb), max_ratio=10) as f:
+            self.assertEqual(f.size_budget, 1024 * 1024)
+            with self.assertRaises(ArchiveSizeExceeded):
+                copyfileobj_limited(f.open_member(f.manifest().members[0]),
+                                    StringIO(), f.size_budget)
+
+    def test_unrar_size_budget(self):
+        # a fake `unrar` writing more than the declared sizes
+        tmpdir = tempfile.mkdtemp()
+        tool = os.path.join(tmpdir, 'unrar')
+        with open(tool, 'wb') as f:
+            f.write('#!/bin/sh\nfor last; do :; done\n'
+                    'head -c 4194304 /dev/zero > "$last/a.txt"\n')
+        os.chmod(tool, 0700)
+        staging = os.path.join(tmpdir, 'staging')
+        os.mkdir(staging)
+        unrar_tool = rarfile.UNRAR_TOOL
+        rarfile.UNRAR_TOOL = tool
+        try:
+            f = RarExtractor.__new__(RarExtractor)
+            f.fpath = os.path.join(tmpdir, 'a.rar')
+            with self.assertRaises(ArchiveSizeExceeded):
+                f._unrar(['a.txt'], staging, 1024 * 1024)
+            self.assertLessEqual(os.path.getsize(
+                os.path.join(staging, 'a.txt')), 1024 * 1024 + 1)
+        finally:
+            rarfile.UNRAR_TOOL = unrar_tool
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# @file: tests/test_hw.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# This file is released under BSD 2-clause license.
+
+import os
+import math
+import unittest
+from datetime import timedelta
+
+import config
+from railgun.common.dateutil import utc_now
+from railgun.common.hw import (FileRules, HwArtifacts, HwCalibration,
+                               HwCode, Homework, HwSet)
+from railgun.common.tempdir import TempDir
+
+
+class FileRulesTestCase(unittest.TestCase):
+
+    def make_rules(self):
+        rules = FileRules()
+        rules.append_action('deny', r'.*\.exe$')
+        rules.append_action('accept', r'(a|b)\.py$')
+        # back references cannot be combined with other rules
+        rules.append_action('hide', r'(.)\1\.txt$')
+        for i in range(150):
+            rules.append_action('hide', r'x%d(y)?$' % i)
+        rules.append_action('lock', r'.*\.py$')
+        return rules
+
+    def test_first_match(self):
+        rules = self.make_rules()
+        for fname, action in (('a.exe', FileRules.DENY),
+                              ('b.py', FileRules.ACCEPT),
+                              ('c.py', FileRules.LOCK),
+                              ('aa.txt', FileRules.HIDE),
+                              ('x149y', FileRules.HIDE)):
+            # query twice to check the cached decisions
+            self.assertEqual(rules.get_action(fname), action)
+            self.assertEqual(rules.get_action(fname), action)
+        self.assertEqual(rules.get_action('ab.txt', -1), -1)
+
+    def test_update_rules(self):
+        rules = self.make_rules()
+        self.assertEqual(rules.get_action('c.py'), FileRules.LOCK)
+        rules.prepend_action('accept', r'c\.py$')
+        self.assertEqual(rules.get_action('c.py'), FileRules.ACCEPT)
+
+    def test_classify(self):
+        rules = self.make_rules()
+        self.assertEqual(
+            list(rules.classify(['a.exe', 'c.py', 'd.txt'], -1)),
+            [('a.exe', FileRules.DENY), ('c.py', FileRules.LOCK),
+             ('d.txt', -1)]
+        )
+        self.assertEqual(
+            list(rules.filter(['a.py', 'a.exe', 'c.py'], (FileRules.ACCEPT,))),
+            ['a.py']
+        )
+
+
+class HwArtifactsTestCase(unittest.TestCase):
+
+    def test_build_pyc(self):
+        with TempDir() as d:
+            code = HwCode(d.fullpath('code'), 'python')
+            code.file_rules = FileRules()
+            code.file_rules.append_action('accept', r'^answer\.py$')
+            hw = Homework()
+            hw.file_rules = FileRules()
+            os.mkdir(code.path)
+            for name in ('answer.py', 'locked.py'):
+                with open(os.path.join(code.path, name), 'wb') as f:
+                    f.write('x = 1\n')
+
+            self.assertEqual(
+                HwArtifacts.build(hw, code, d.fullpath('artifacts')), [])
+            artifacts = HwArtifacts(d.fullpath('artifacts'))
+            self.assertIsNone(artifacts.get_pyc('answer.py'))
+            self.assertIsNone(artifacts.jar)
+            pyc = artifacts.get_pyc('locked.py')
+            self.assertEqual(
+                HwArtifacts.read_pyc_mtime(pyc),
+                int(os.stat(os.path.join(code.path, 'locked.py')).st_mtime)
+            )
+
+
+class HwCalibrationTestCase(unittest.TestCase):
+
+    def test_timeout(self):
+        calibration = HwCalibration([0.5, 0.2, 0.4])
+        self.assertEqual(calibration.baseline, 0.5)
+        expected = max(config.HOMEWORK_TIMEOUT_MIN, int(math.ceil(
+            0.5 * config.HOMEWORK_TIMEOUT_FACTOR +
+            config.HOMEWORK_TIMEOUT_SLACK)))
+        self.assertEqual(calibration.timeout(100), expected)
+        # never exceed the limit in code.xml
+        self.assertEqual(HwCalibration([50.0]).timeout(10), 10)
+        self.assertEqual(HwCalibration([]).timeout(10), 10)
+
+    def test_save_load(self):
+        with TempDir() as d:
+            path = d.fullpath(HwCalibration.FILE_NAME)
+            HwCalibration([0.3, 0.1]).save(path)
+            self.assertEqual(HwCalibration.load(path).runs, [0.1, 0.3])
+
+
+class HwSetTestCase(unittest.TestCase):
+
+    def test_due_within(self):
+        now = utc_now()
+        soon, later, expired = Homework(), Homework(), Homework()
+        soon.deadlines = [(now + timedelta(hours=1), 1.0),
+                          (now + timedelta(days=7), 0.5)]
+        later.deadlines = [(now + timedelta(days=2), 1.0)]
+        expired.deadlines = [(now - timedelta(hours=1), 1.0)]
+        with TempDir() as d:
+            hwset = HwSet(d.path)
+            hwset.items = [soon, later, expired]
+            self.assertEqual(hwset.get_due_within(3600 * 6, now), [soon])
+            self.assertEqual(hwset.get_due_within(3600 * 72, now),
+                             [soon, later])
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# @file: tests/test_javaservice.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# This file is released under BSD 2-clause license.
+
+import os
+import sys
+import time
+import unittest
+
+from railgun.common.osutil import ProcessTimeout, ResourceUsage
+from railgun.common.tempdir import TempDir
+from railgun.runner import runconfig
+from railgun.runner.javaservice import JavaService, JavaServiceError
+from railgun.runner.sandbox import ResourceLimits, Sandbox
+
+#: A fake `JavaHostService` serving one build, which echoes the build dir.
+FAKE_SERVICE = '''#!%(python)s
+import sys, json
+print json.dumps({'ready': True})
+sys.stdout.flush()
+request = {}
+for line in iter(sys.stdin.readline, '\\n'):
+    k, v = line.rstrip('\\n').split('\\t', 1)
+    request[k] = v
+print json.dumps({'exitcode': 0, 'stdout': request['buildDir'],
+                  'stderr': '', 'outputExceeded': False})
+sys.stdout.flush()
+sys.stdin.read()
+'''
+
+#: A fake `JavaHostService` which starts a child process, and never replies.
+HANG_SERVICE = '''#!%(python)s
+import subprocess, sys, json, time
+child = subprocess.Popen(['sleep', '30'])
+with open(%(pidfile)r, 'wb') as f:
+    f.write(str(child.pid))
+print json.dumps({'ready': True})
+sys.stdout.flush()
+time.sleep(30)
+'''
+
+
+def process_exited(pid, timeout=5):
+    """Wait for at most `timeout` seconds until the process `pid` has exited
+    (or become a zombie), and return whether it has exited."""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            with open('/proc/%d/stat' % pid, 'rb') as f:
+                if f.read().rsplit(')', 1)[1].split()[0] == 'Z':
+                    return True
+        except IOError:
+            return True
+        if time.time() >= deadline:
+            return False
+        time.sleep(0.05)
+
+
+class JavaServiceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.jvm = runconfig.RUNNER_JAVA_SERVICE_JVM
+        self.tempdir = TempDir()
+        self.tempdir.open()
+
+    def tearDown(self):
+        runconfig.RUNNER_JAVA_SERVICE_JVM = self.jvm
+        self.tempdir.close()
+
+    def make_service(self, script):
+        path = os.path.join(self.tempdir.path, 'java')
+        with open(path, 'wb') as f:
+            f.write(script)
+        os.chmod(path, 0755)
+        runconfig.RUNNER_JAVA_SERVICE_JVM = path
+        return JavaService(0, 0)
+
+    def test_one_build(self):
+        service = self.make_service(FAKE_SERVICE % {'python': sys.executable})
+        usage = ResourceUsage()
+        with Sandbox('javaservice', ResourceLimits(), 10) as sandbox:
+            result = service.execute({'buildDir': 'coverage'}, 10,
+                                     cwd=self.tempdir.path, usage=usage,
+                                     sandbox=sandbox)
+        self.assertEqual(result, (0, 'coverage', ''))
+        # the service is stopped after the build, and its usage is counted
+        self.assertIsNone(service.proc)
+        self.assertEqual(usage.processes, 1)
+        self.assertFalse(service.start_failed)
+
+    def test_start_failed(self):
+        service = self.make_service('#!/bin/sh\nexit 1\n')
+        self.assertRaises(JavaServiceError, service.execute,
+                          {'buildDir': 'coverage'}, 10,
+                          cwd=self.tempdir.path)
+        self.assertTrue(service.start_failed)
+        self.assertIsNone(service.proc)
+
+    def test_timeout(self):
+        pidfile = os.path.join(self.tempdir.path, 'child.pid')
+        service = self.make_service(HANG_SERVICE % {
+            'python': sys.executable, 'pidfile': pidfile})
+        usage = ResourceUsage()
+        self.assertRaises(ProcessTimeout, service.execute,
+                          {'buildDir': 'coverage'}, 0.5,
+                          cwd=self.tempdir.path, usage=usage)
+        # the service and its children are killed, and its usage is counted
+        self.assertIsNone(service.proc)
+        self.assertFalse(service.start_failed)
+        self.assertEqual(usage.processes, 1)
+        with open(pidfile, 'rb') as f:
+            self.assertTrue(process_exited(int(f.read())))
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# @file: tests/test_lease.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# This file is released under BSD 2-clause license.
+
+import time
+import unittest
+
+from railgun.runner import credential, runconfig
+from railgun.runner.errors import SystemAccountLostError
+from railgun.runner.lease import (HandinLease, lease_key, live_leases,
+                                  release_lease)
+from railgun.runner.sandbox import (ResourceLimits, Sandbox,
+                                    execute_sandboxed, release_sandboxes)
+
+
+class FakeRedis(object):
+
+    def __init__(self):
+        self.keys = {}
+        self.touched = 0
+
+    def setex(self, key, ttl, value):
+        self.keys[key] = value
+        self.touched += 1
+
+    def delete(self, key):
+        self.keys.pop(key, None)
+
+    def exists(self, key):
+        return key in self.keys
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline(object):
+
+    def __init__(self, client):
+        self.client = client
+        self.results = []
+
+    def exists(self, key):
+        self.results.append(self.client.exists(key))
+
+    def execute(self):
+        return self.results
+
+
+class HandinLeaseTestCase(unittest.TestCase):
+
+    def test_heartbeat(self):
+        client = FakeRedis()
+        with HandinLease('h1', interval=0.05, client=client):
+            self.assertIn(lease_key('h1'), client.keys)
+            time.sleep(0.3)
+        touched = client.touched
+        self.assertGreater(touched, 2)
+        # the heartbeats stop with the lease
+        time.sleep(0.1)
+        self.assertEqual(client.touched, touched)
+
+    def test_release(self):
+        client = FakeRedis()
+        lease = HandinLease('h1', interval=0.05, client=client)
+        lease.start()
+        time.sleep(0.1)
+        lease.release()
+        self.assertNotIn(lease_key('h1'), client.keys)
+        # the heartbeats stop with the release
+        touched = client.touched
+        time.sleep(0.1)
+        self.assertEqual(client.touched, touched)
+        self.assertNotIn(lease_key('h1'), client.keys)
+
+    def test_live_leases(self):
+        client = FakeRedis()
+        HandinLease('h1', client=client).beat()
+        HandinLease('h2', client=client).beat()
+        release_lease('h2', client)
+        self.assertEqual(live_leases(['h1', 'h2', 'h3'], client), set(['h1']))
+        self.assertEqual(live_leases([], client), set())
+
+
+class UserLeaseTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.patched = (runconfig.OFFLINE_USER_HOST, credential._acquire,
+                        credential._renew, credential._put)
+        runconfig.OFFLINE_USER_HOST = ('localhost', 0)
+        credential._acquire = lambda userhost, expires: ('u1', 't1')
+        credential._put = lambda userhost, user, token: None
+
+    def tearDown(self):
+        (runconfig.OFFLINE_USER_HOST, credential._acquire,
+         credential._renew, credential._put) = self.patched
+        release_sandboxes('lease-lost')
+
+    def test_lost(self):
+        def renew(userhost, user, token, expires):
+            raise RuntimeError('System account lease has expired.')
+        credential._renew = renew
+
+        begin = time.time()
+        with credential.UserLease(True, 0.6, handid='lease-lost') as lease:
+            with Sandbox('lease-lost', ResourceLimits(), 10) as sandbox:
+                exitcode, _, _ = execute_sandboxed('sleep 10', 10,
+                                                   sandbox=sandbox)
+            self.assertTrue(lease.lost)
+            self.assertRaises(SystemAccountLostError, lease.check)
+        self.assertNotEqual(exitcode, 0)
+        self.assertLess(time.time() - begin, 5)
+
+    def test_renewed(self):
+        renewed = []
+        credential._renew = lambda userhost, user, token, expires: \
+            renewed.append((user, token))
+
+        with credential.UserLease(True, 0.15, handid='lease-lost') as lease:
+            time.sleep(0.3)
+            self.assertFalse(lease.lost)
+            lease.check()
+        self.assertIn(('u1', 't1'), renewed)
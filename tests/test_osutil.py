@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# @file: tests/test_osutil.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# This file is released under BSD 2-clause license.
+
+import time
+import unittest
+
+from railgun.common.osutil import (execute, ProcessTimeout,
+                                   ProcessOutputExceeded, OutputBuffer,
+                                   ResourceUsage)
+
+
+class ExecuteTestCase(unittest.TestCase):
+
+    def test_output(self):
+        exitcode, stdout, stderr = execute('echo hello; echo world >&2; '
+                                           'exit 3', 3)
+        self.assertEqual(exitcode, 3)
+        self.assertEqual(stdout, 'hello\n')
+        self.assertEqual(stderr, 'world\n')
+
+    def test_large_output(self):
+        exitcode, stdout, stderr = execute('head -c 1000000 /dev/zero', 3)
+        self.assertEqual(exitcode, 0)
+        self.assertEqual(len(stdout), 1000000)
+
+    def test_quick_return(self):
+        # The process should be reaped as soon as it exits, not after
+        # a fixed polling interval.
+        start = time.time()
+        execute('true', 3)
+        self.assertLess(time.time() - start, 0.5)
+
+    def test_timeout(self):
+        start = time.time()
+        with self.assertRaises(ProcessTimeout):
+            execute('sleep 10 & sleep 10', 0.3)
+        self.assertLess(time.time() - start, 1.0)
+
+    def test_output_limit(self):
+        with self.assertRaises(ProcessOutputExceeded) as cm:
+            execute('yes', 3, output_limit=100000, head_size=4, tail_size=4)
+        self.assertTrue(cm.exception.stdout.startswith('y\ny\n'))
+        self.assertTrue(cm.exception.stdout.endswith('y\ny\n'))
+        self.assertIn('bytes truncated', cm.exception.stdout)
+
+    def test_usage(self):
+        usage = ResourceUsage()
+        execute('i=0; while [ $i -lt 20000 ]; do i=$((i+1)); done', 10,
+                usage=usage)
+        with self.assertRaises(ProcessTimeout):
+            execute('sleep 10', 0.1, usage=usage)
+        self.assertEqual(usage.processes, 2)
+        self.assertGreater(usage.cpu_time, 0)
+        self.assertGreater(usage.maxrss, 0)
+        self.assertEqual(
+            ResourceUsage.from_plain(usage.to_plain()).to_plain(),
+            usage.to_plain()
+        )
+
+
+class OutputBufferTestCase(unittest.TestCase):
+
+    def test_not_truncated(self):
+        buf = OutputBuffer(4, 4)
+        buf.write('abcd')
+        buf.write('efgh')
+        self.assertFalse(buf.truncated)
+        self.assertEqual(buf.getvalue(), 'abcdefgh')
+
+    def test_truncated(self):
+        buf = OutputBuffer(4, 4)
+        for s in ('ab', 'cdef', 'ghij', 'k'):
+            buf.write(s)
+        self.assertTrue(buf.truncated)
+        self.assertEqual(buf.total, 11)
+        self.assertEqual(
+            buf.getvalue(),
+            'abcd\n\n... (3 bytes truncated) ...\n\nhijk'
+        )
+
+    def test_large_chunk(self):
+        buf = OutputBuffer(10, 5)
+        buf.write('a' * 10 + 'b' * 10)
+        self.assertTrue(buf.truncated)
+        self.assertEqual(
+            buf.getvalue(),
+            'a' * 10 + '\n\n... (5 bytes truncated) ...\n\n' + 'b' * 5
+        )
+
+    def test_utf8_boundary(self):
+        buf = OutputBuffer(4, 4)
+        buf.write(u'中文中文中文'.encode('utf-8'))
+        value = unicode(buf.getvalue(), 'utf-8')
+        self.assertTrue(value.startswith(u'中\n'))
+        self.assertTrue(value.endswith(u'\n文'))
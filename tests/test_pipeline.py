@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# @file: tests/test_pipeline.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# This file is released under BSD 2-clause license.
+
+import threading
+import unittest
+
+from railgun.runner import pipeline
+from railgun.runner.pipeline import ReportPipeline
+
+
+class ReportPipelineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.retry_delay = pipeline.RETRY_DELAY
+        pipeline.RETRY_DELAY = 0.0
+
+    def tearDown(self):
+        pipeline.RETRY_DELAY = self.retry_delay
+
+    def test_order(self):
+        sent = []
+        reports = ReportPipeline(depth=2)
+        for i in xrange(10):
+            reports.submit(sent.append, i)
+        self.assertTrue(reports.flush(5))
+        self.assertEqual(sent, range(10))
+
+    def test_retry(self):
+        calls = []
+
+        def flaky(handid):
+            calls.append(handid)
+            if len(calls) < 3:
+                raise IOError('website is down')
+
+        def broken(handid):
+            calls.append(handid)
+            raise IOError('website is down')
+
+        reports = ReportPipeline(depth=4, retries=2)
+        reports.submit(flaky, 'a')
+        reports.submit(broken, 'b')
+        self.assertTrue(reports.flush(5))
+        self.assertEqual(calls, ['a', 'a', 'a', 'b', 'b', 'b'])
+
+    def test_bounded(self):
+        gate = threading.Event()
+        reports = ReportPipeline(depth=1)
+        reports.submit(lambda: gate.wait())
+        reports.submit(lambda: None)
+        # the sender is blocked by the first report, and the second one
+        # fills the pipeline
+        self.assertFalse(reports.flush(0.1))
+        gate.set()
+        self.assertTrue(reports.flush(5))
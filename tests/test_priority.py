@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# @file: tests/test_priority.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# This file is released under BSD 2-clause license.
+
+import unittest
+from datetime import timedelta
+
+from railgun.common.dateutil import utc_now
+from railgun.runner import runconfig
+from railgun.runner.priority import (submission_priority, queue_keys,
+                                     cost_lane, age_lanes, PRIORITY_STEPS)
+
+
+class FakeHomework(object):
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+
+    def get_next_deadline(self):
+        if self.deadline is not None:
+            return (self.deadline, 1.0)
+
+
+class FakeRedis(object):
+    """Lists of a Redis server, pushed at the head and popped at the tail."""
+
+    def __init__(self):
+        self.lists = {}
+
+    def llen(self, key):
+        return len(self.lists.get(key, []))
+
+    def rpoplpush(self, src, dst):
+        if not self.lists.get(src):
+            return None
+        value = self.lists[src].pop()
+        self.lists.setdefault(dst, []).insert(0, value)
+        return value
+
+
+class PriorityTestCase(unittest.TestCase):
+
+    def test_deadline_lanes(self):
+        now = utc_now()
+        urgent = FakeHomework(now + timedelta(minutes=1))
+        later = FakeHomework(now + timedelta(days=30))
+        expired = FakeHomework(None)
+        self.assertEqual(submission_priority(urgent, 0, now), 0)
+        self.assertEqual(submission_priority(later, 0, now),
+                         len(runconfig.RUNNER_PRIORITY_DEADLINES))
+        self.assertGreater(submission_priority(expired, 0, now),
+                           submission_priority(later, 0, now))
+
+    def test_fair_share(self):
+        now = utc_now()
+        urgent = FakeHomework(now + timedelta(minutes=1))
+        self.assertGreater(submission_priority(urgent, 3, now),
+                           submission_priority(urgent, 0, now))
+        self.assertEqual(submission_priority(urgent, 1000, now),
+                         PRIORITY_STEPS[-1])
+
+    def test_queue_keys(self):
+        keys = queue_keys('default')
+        self.assertEqual(keys[0], 'default')
+        self.assertEqual(len(keys), len(PRIORITY_STEPS))
+
+    def test_cost_lane(self):
+        steps = runconfig.RUNNER_SJF_COST_STEPS
+        self.assertEqual(cost_lane(None), 0)
+        self.assertEqual(cost_lane(steps[0]), 0)
+        self.assertEqual(cost_lane(steps[0] + 0.1), 1)
+        self.assertEqual(cost_lane(steps[-1] + 1), len(steps))
+
+        now = utc_now()
+        later = FakeHomework(now + timedelta(days=30))
+        self.assertGreater(submission_priority(later, 0, now, steps[-1] + 1),
+                           submission_priority(later, 0, now, 0.1))
+
+    def test_age_lanes(self):
+        client = FakeRedis()
+        keys = queue_keys('default')
+        client.lists[keys[0]] = ['b0', 'a0']
+        client.lists[keys[1]] = ['b1', 'a1']
+        client.lists[keys[2]] = ['a2']
+        self.assertEqual(age_lanes(client, 'default'), 3)
+        # the aged messages are taken after the ones already in the lane
+        self.assertEqual(client.lists[keys[0]], ['b1', 'a1', 'b0', 'a0'])
+        self.assertEqual(client.lists[keys[1]], ['a2'])
+        self.assertEqual(client.lists[keys[2]], [])
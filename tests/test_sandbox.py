@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# @file: tests/test_sandbox.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# This file is released under BSD 2-clause license.
+
+import time
+import threading
+import unittest
+from xml.etree import ElementTree
+
+from railgun.runner.sandbox import (parse_size, ResourceLimits, Sandbox,
+                                    execute_sandboxed, kill_sandboxes,
+                                    release_sandboxes)
+
+
+class ResourceLimitsTestCase(unittest.TestCase):
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size('1024'), 1024)
+        self.assertEqual(parse_size('256M'), 256 * 1024 * 1024)
+        self.assertEqual(parse_size('2g'), 2 * 1024 * 1024 * 1024)
+        self.assertEqual(parse_size(' 4 KB '), 4096)
+        with self.assertRaises(ValueError):
+            parse_size('lots')
+
+    def test_from_runner_params(self):
+        node = ElementTree.fromstring(
+            '<runner entry="run.py" memoryLimit="64M" cpuLimit="0.5" '
+            'pidsLimit="8" />'
+        )
+        limits = ResourceLimits.from_runner_params(node)
+        self.assertEqual(limits.memory, 64 * 1024 * 1024)
+        self.assertEqual(limits.cpu, 0.5)
+        self.assertEqual(limits.pids, 8)
+        self.assertEqual(
+            sorted(limits.rlimits(3)),
+            [('RLIMIT_CPU', 2), ('RLIMIT_DATA', 64 * 1024 * 1024),
+             ('RLIMIT_NPROC', 8)]
+        )
+
+
+class KillSandboxesTestCase(unittest.TestCase):
+
+    def test_kill_running(self):
+        def kill():
+            time.sleep(0.5)
+            kill_sandboxes('kill-running')
+
+        thread = threading.Thread(target=kill)
+        thread.start()
+        begin = time.time()
+        try:
+            with Sandbox('kill-running', ResourceLimits(), 10) as sandbox:
+                exitcode, _, _ = execute_sandboxed('sleep 10', 10,
+                                                   sandbox=sandbox)
+        finally:
+            thread.join()
+            release_sandboxes('kill-running')
+        self.assertNotEqual(exitcode, 0)
+        self.assertLess(time.time() - begin, 5)
+
+    def test_kill_before_start(self):
+        kill_sandboxes('kill-before')
+        try:
+            with Sandbox('kill-before', ResourceLimits(), 10) as sandbox:
+                exitcode, _, _ = execute_sandboxed('sleep 10', 10,
+                                                   sandbox=sandbox)
+        finally:
+            release_sandboxes('kill-before')
+        self.assertNotEqual(exitcode, 0)
+        with Sandbox('kill-before', ResourceLimits(), 10) as sandbox:
+            exitcode, _, _ = execute_sandboxed('true', 10, sandbox=sandbox)
+        self.assertEqual(exitcode, 0)
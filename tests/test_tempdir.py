@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# @file: tests/test_tempdir.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# This file is released under BSD 2-clause license.
+
+import os
+import stat
+import unittest
+
+from railgun.common.fileutil import Extractor
+from railgun.common.tempdir import TempDir
+from test_fileutil import make_zip
+
+
+class TempDirTestCase(unittest.TestCase):
+
+    FILES = [('top/a.py', 'print 1\n'), ('top/sub/b.py', 'print 2\n')]
+
+    def test_owner_at_creation(self):
+        owner = (os.getuid(), os.getgid())
+        with TempDir() as d:
+            with open(d.fullpath('old.txt'), 'wb') as f:
+                f.write('old')
+            # the existing entries are changed once
+            self.assertTrue(d.set_owner(owner[0], owner[1], 0700))
+            self.assertFalse(d.set_owner(owner[0], owner[1], 0700))
+
+            with Extractor.open_buffer(make_zip(self.FILES)) as f:
+                d.extract(f, mode=0777)
+            d.write_file('data.csv', 'a,b\n', mode=0777)
+            for p in ('old.txt', 'a.py', 'sub', 'sub/b.py', 'data.csv'):
+                st = os.stat(d.fullpath(p))
+                self.assertEqual(stat.S_IMODE(st.st_mode), 0700)
+            self.assertEqual(d.verify_owner(), [])
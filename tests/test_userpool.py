@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# @file: tests/test_userpool.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# This file is released under BSD 2-clause license.
+
+import unittest
+
+from railgun.userhost.userpool import UserPool
+
+
+class UserPoolTestCase(unittest.TestCase):
+
+    def test_renew(self):
+        pool = UserPool(['a'])
+        pool.current_time = lambda: 100
+        user, token = pool.acquire(10)
+        self.assertEqual(user, 'a')
+        self.assertIsNone(pool.acquire(10))
+
+        # renewing before expired keeps the user away from others
+        pool.current_time = lambda: 108
+        self.assertTrue(pool.renew('a', token, 10))
+        pool.current_time = lambda: 115
+        self.assertIsNone(pool.acquire(10))
+
+        # an expired lease cannot be renewed
+        pool.current_time = lambda: 200
+        self.assertFalse(pool.renew('a', token, 10))
+        self.assertFalse(pool.renew('unknown', token, 10))
+        self.assertEqual(pool.acquire(10)[0], 'a')
+
+    def test_token(self):
+        pool = UserPool(['a'])
+        pool.current_time = lambda: 100
+        _, old_token = pool.acquire(10)
+
+        # the user is given to another holder after the lease expired
+        pool.current_time = lambda: 200
+        _, token = pool.acquire(10)
+        self.assertNotEqual(token, old_token)
+
+        # the former holder can neither renew nor release the user
+        self.assertFalse(pool.renew('a', old_token, 10))
+        self.assertFalse(pool.renew('a', None, 10))
+        self.assertFalse(pool.release('a', old_token))
+        self.assertIsNone(pool.acquire(10))
+
+        # while the current holder can
+        self.assertTrue(pool.renew('a', token, 10))
+        self.assertTrue(pool.release('a', token))
+        self.assertFalse(pool.release('a', token))
+        self.assertEqual(pool.acquire(10)[0], 'a')
+
+    def test_count_free(self):
+        pool = UserPool(['a', 'b'])
+        pool.current_time = lambda: 100
+        self.assertEqual(pool.count_free(), 2)
+        pool.acquire(10)
+        self.assertEqual(pool.count_free(), 1)
+        pool.current_time = lambda: 200
+        self.assertEqual(pool.count_free(), 2)
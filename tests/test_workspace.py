@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# @file: tests/test_workspace.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# This file is released under BSD 2-clause license.
+
+import os
+import unittest
+
+from railgun.common.tempdir import TempDir
+from railgun.runner.workspace import WorkspacePool, WORKSPACE_PREFIX
+
+
+class WorkspacePoolTestCase(unittest.TestCase):
+
+    def test_async_cleanup(self):
+        with TempDir() as root:
+            # a working directory left by a dead process
+            orphan = root.fullpath('%s999999-orphan' % WORKSPACE_PREFIX)
+            os.mkdir(orphan)
+
+            pool = WorkspacePool(root.path, quota=1024)
+            tempdir = pool.create('handid')
+            pool.open(tempdir)
+            with open(tempdir.fullpath('a.txt'), 'wb') as f:
+                f.write('a' * 4096)
+            self.assertEqual(pool.stats()['in_use'], 1)
+
+            pool.release(tempdir)
+            self.assertFalse(os.path.exists(tempdir.path))
+            pool.flush()
+
+            self.assertEqual(os.listdir(root.path), [])
+            stats = pool.stats()
+            self.assertEqual(stats['in_use'], 0)
+            self.assertEqual(stats['reaped'], 1)
+            self.assertEqual(stats['orphans_reaped'], 1)
+            self.assertEqual(stats['over_quota'], 1)
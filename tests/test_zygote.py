@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# @file: tests/test_zygote.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# This file is released under BSD 2-clause license.
+
+import os
+import unittest
+
+from railgun.common.osutil import ResourceUsage
+from railgun.common.tempdir import TempDir
+from railgun.runner import runconfig, zygote
+from railgun.runner.errors import ScoreTamperedError
+
+#: A submission reporting its score through `SafeRunner`.
+SCORED_ENTRY = '''
+import SafeRunner
+print 'hello'
+SafeRunner.run([])
+'''
+
+#: A submission writing a score with a wrong token to all its files.
+FORGED_ENTRY = '''
+import os, json
+score = json.dumps({'uuid': os.environ['RAILGUN_HANDID'], 'token': 'x',
+                    'accepted': True, 'result': None,
+                    'compile_error': None, 'partials': []})
+for fd in os.listdir('/proc/self/fd'):
+    try:
+        os.write(int(fd), score + '\\n')
+    except OSError:
+        pass
+'''
+
+#: A submission crashing before reporting the score.
+CRASHED_ENTRY = '''
+import os, signal
+os.kill(os.getpid(), signal.SIGSEGV)
+'''
+
+
+class FakeHwCode(object):
+    runner_params = None
+
+
+class FakeApiClient(object):
+    reports = []
+
+    def __init__(self, baseurl):
+        pass
+
+    def report(self, handid, hwscore):
+        self.reports.append((handid, hwscore))
+
+
+class ZygoteTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        env = os.environ.copy()
+        env['PYTHONPATH'] = os.path.pathsep.join(
+            [runconfig.RAILGUN_ROOT,
+             os.path.join(runconfig.RUNLIB_DIR, 'python')] +
+            ([env['PYTHONPATH']] if env.get('PYTHONPATH') else [])
+        )
+        cls.zygote = zygote.Zygote(FakeHwCode(), env)
+        cls.zygote.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.zygote.stop()
+
+    def setUp(self):
+        self.api_client = zygote.ApiClient
+        zygote.ApiClient = FakeApiClient
+        FakeApiClient.reports = []
+        self.tempdir = TempDir()
+        self.tempdir.open()
+
+    def tearDown(self):
+        zygote.ApiClient = self.api_client
+        self.tempdir.close()
+
+    def execute(self, source, handid='h1'):
+        entry = os.path.join(self.tempdir.path, 'run.py')
+        with open(entry, 'wb') as f:
+            f.write(source)
+        self.usage = ResourceUsage()
+        return self.zygote.execute(
+            entry, 10, output_limit=65536, cwd=self.tempdir.path,
+            env={'RAILGUN_HANDID': handid, 'PATH': os.environ['PATH']},
+            usage=self.usage
+        )
+
+    def test_score(self):
+        exitcode, stdout, stderr = self.execute(SCORED_ENTRY)
+        self.assertEqual((exitcode, stdout), (0, 'hello\n'))
+        self.assertEqual(len(FakeApiClient.reports), 1)
+        handid, score = FakeApiClient.reports[0]
+        self.assertEqual(handid, 'h1')
+        self.assertFalse(score.accepted)
+        self.assertEqual(self.usage.processes, 1)
+
+        # the zygote serves the next submission as well
+        self.execute(SCORED_ENTRY, 'h2')
+        self.assertEqual(FakeApiClient.reports[1][0], 'h2')
+
+    def test_wrong_token(self):
+        self.assertRaises(ScoreTamperedError, self.execute, FORGED_ENTRY)
+        self.assertEqual(FakeApiClient.reports, [])
+        self.assertTrue(self.zygote.alive())
+
+    def test_crashed(self):
+        exitcode, stdout, stderr = self.execute(CRASHED_ENTRY)
+        self.assertNotEqual(exitcode, 0)
+        self.assertEqual(FakeApiClient.reports, [])
+        self.assertTrue(self.zygote.alive())